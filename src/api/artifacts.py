@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import time
+import numpy as np
+import pyarrow.parquet as pq
+
+# Embedding chunk artifacts. Each chunk is a pair of files sharing a stem:
+#   <stem>.npy      float32/float16 matrix, one row per movie (memory-mappable)
+#   <stem>.parquet  the movie metadata, in the same row order
+# plus one manifest.json describing the whole set. Older JSONL chunks
+# (<stem>.json, one record per line with an "embedding" list) are still readable.
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT", "npy")
+ARTIFACT_DTYPE = os.getenv("ARTIFACT_DTYPE", "float32")
+MANIFEST_FILE = "manifest.json"
+CHUNK_PATTERN = re.compile(r"^movie_embeddings_chunk_(\d+)\.(npy|json)$")
+# Written by each `build.py --shard i/n` run; `build.py --merge` combines them
+SHARD_MANIFEST_PATTERN = re.compile(r"^shard_(\d+)_of_(\d+)\.json$")
+
+
+def chunk_stem(output_dir, idx):
+    return os.path.join(output_dir, f"movie_embeddings_chunk_{idx}")
+
+def write_chunk(stem, chunk_df, embeddings, dtype=ARTIFACT_DTYPE):
+    """Write metadata first and the matrix last; the .npy's presence marks completion."""
+    chunk_df.drop(columns=["embedding"], errors="ignore").to_parquet(f"{stem}.parquet", index=False)
+    tmp_path = f"{stem}.tmp.npy"
+    np.save(tmp_path, np.asarray(embeddings, dtype=dtype))
+    os.replace(tmp_path, f"{stem}.npy")
+
+def chunk_rows(path):
+    """Row count of a finished chunk, or None if it is missing or incomplete."""
+    if path.endswith(".npy"):
+        stem = path[:-len(".npy")]
+        if not (os.path.exists(path) and os.path.exists(f"{stem}.parquet")):
+            return None
+        return np.load(path, mmap_mode="r").shape[0]
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return sum(1 for _ in f)
+
+def list_chunks(chunk_dir):
+    """Finished chunk files (.npy, or legacy .json) in chunk-number order."""
+    chunks = {}
+    for name in os.listdir(chunk_dir):
+        match = CHUNK_PATTERN.match(name)
+        # Prefer the binary artifact if a chunk exists in both formats
+        if match and (match.group(2) == "npy" or int(match.group(1)) not in chunks):
+            chunks[int(match.group(1))] = name
+    return [os.path.join(chunk_dir, chunks[idx]) for idx in sorted(chunks)]
+
+def read_chunk(path):
+    """Return (metadata records, embeddings) for a chunk.
+
+    For .npy chunks the embeddings are a read-only memory map, so rows are
+    only paged in as they are touched. Legacy JSON rows may have None.
+    """
+    if path.endswith(".npy"):
+        stem = path[:-len(".npy")]
+        embeddings = np.load(path, mmap_mode="r")
+        records = pq.read_table(f"{stem}.parquet", memory_map=True).to_pylist()
+        return records, embeddings
+    records = []
+    embeddings = []
+    with open(path, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            embeddings.append(record.pop("embedding", None))
+            records.append(record)
+    return records, embeddings
+
+def iter_chunk_records(paths):
+    """Yield each record with its vector under 'embedding', skipping rows without one."""
+    for path in paths:
+        records, embeddings = read_chunk(path)
+        for record, embedding in zip(records, embeddings):
+            if embedding is None:
+                continue
+            record["embedding"] = embedding
+            yield record
+
+def write_manifest(chunk_dir, model_name=None, paths=None):
+    """Describe every finished chunk in chunk_dir (rows, dim, dtype, model)."""
+    paths = list_chunks(chunk_dir) if paths is None else paths
+    chunks = []
+    dim = None
+    dtype = None
+    for path in paths:
+        if path.endswith(".npy"):
+            matrix = np.load(path, mmap_mode="r")
+            dim, dtype = matrix.shape[1], str(matrix.dtype)
+            rows = matrix.shape[0]
+        else:
+            rows = chunk_rows(path)
+        chunks.append({"file": os.path.basename(path), "rows": rows})
+    manifest = {
+        "model": model_name or os.getenv("EMBEDDING_MODEL"),
+        "dim": dim,
+        "dtype": dtype,
+        "total_rows": sum(chunk["rows"] for chunk in chunks),
+        "chunks": chunks,
+        "created_at": time.time(),
+    }
+    tmp_path = os.path.join(chunk_dir, f"{MANIFEST_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(chunk_dir, MANIFEST_FILE))
+    return manifest
+
+def read_manifest(chunk_dir):
+    path = os.path.join(chunk_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def chunk_index(path):
+    match = CHUNK_PATTERN.match(os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+def write_shard_manifest(chunk_dir, manifest):
+    name = f"shard_{manifest['shard']}_of_{manifest['num_shards']}.json"
+    tmp_path = os.path.join(chunk_dir, f"{name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(chunk_dir, name))
+
+def read_shard_manifests(chunk_dir):
+    manifests = []
+    for name in sorted(os.listdir(chunk_dir)):
+        if SHARD_MANIFEST_PATTERN.match(name):
+            with open(os.path.join(chunk_dir, name), "r") as f:
+                manifests.append(json.load(f))
+    return manifests
@@ -0,0 +1,125 @@
+# asgi.py
+# /generate is served natively on the event loop and everything else by Flask,
+# so long LLM generations hold a coroutine instead of a worker thread and
+# search endpoints keep being served while pitches stream.
+# Run with `API_SERVER=asgi python main.py` or `uvicorn asgi:app`.
+import os
+import time
+import asyncio
+import orjson
+from a2wsgi import WSGIMiddleware
+from logger import logger
+from main import app as flask_app
+import llm
+import metrics
+
+# Threads available to the Flask (search / movies) endpoints
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", "16"))
+wsgi_app = WSGIMiddleware(flask_app, workers=WSGI_WORKERS)
+
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def send_json(send, status, payload):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json")] + CORS_HEADERS,
+    })
+    await send({"type": "http.response.body", "body": orjson.dumps(payload)})
+    return status
+
+def wants_server_timing(scope):
+    header = metrics.SERVER_TIMING_REQUEST_HEADER.lower().encode()
+    return metrics.SERVER_TIMING or any(name == header for name, _ in scope.get("headers", []))
+
+async def generate(scope, receive, send):
+    # Flask's request hooks don't see this route, so it records its own metrics
+    started = time.perf_counter()
+    timings = metrics.start_request_timings(wants_server_timing(scope))
+    status = await stream_generation(receive, send, timings, started)
+    if status is not None:
+        metrics.request_seconds.observe(time.perf_counter() - started, endpoint="/generate", method="POST")
+        metrics.requests_total.inc(endpoint="/generate", method="POST", status=status)
+
+async def stream_generation(receive, send, timings, started):
+    body = await read_body(receive)
+    if body is None:
+        return None
+    try:
+        data = orjson.loads(body) if body else {}
+        logger.info(f"data: {data}")
+        prompt = data.get('prompt', "too many puppies?")
+        num_ctx = data.get('num_ctx', 512)
+        use_cache = str(data.get('cache', False)).lower() == 'true'
+        if not prompt:
+            return await send_json(send, 400, {"error": "Prompt is required"})
+        # A cached stream only detaches this client on disconnect; the shared
+        # upstream generation keeps running for followers and the cache
+        stream = llm.acached_stream_chat if use_cache else llm.astream_chat
+        chunks = await stream(prompt, num_ctx)
+    except llm.LLMError as e:
+        return await send_json(send, e.status_code, {"error": f"LLM service returned an error: {e.message}"})
+    except Exception as e:
+        return await send_json(send, 500, {"error": f"An error occurred: {e}"})
+
+    # Stop pulling from the LLM as soon as the client goes away
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    headers = [(b"content-type", b"application/json")] + CORS_HEADERS
+    if timings is not None:
+        # Only the stages run before the first byte make it into the header
+        header = metrics.server_timing_header(timings, time.perf_counter() - started)
+        headers.append((b"server-timing", header.encode()))
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": headers,
+        })
+        # Each chunk is only read from upstream once the previous send has
+        # drained, so a slow client throttles the upstream read
+        async for text in chunks:
+            if disconnected.is_set():
+                break
+            await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        watcher.cancel()
+        await chunks.aclose()
+    return 200
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await llm.close_async_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/generate" and scope["method"] == "POST":
+        return await generate(scope, receive, send)
+    # Everything else (including CORS preflight) goes through Flask in a thread pool
+    await wsgi_app(scope, receive, send)
@@ -0,0 +1,570 @@
+# bench.py
+# Reproducible benchmarks for the API hot paths (/movies, /vector_search,
+# /hybrid_search and the batch endpoints), build.py's embedding loop and
+# ingest.py's load. Everything runs offline on CPU by default:
+#   python bench.py --size 10000 --concurrency 1,8,32 --output bench.json
+# --backend postgres rebuilds the movies table in the database named by
+# --dsn (or BENCH_DATABASE_URL) and serves the endpoints from it. It refuses
+# the app's own database unless --allow-default-db is given.
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import artifacts
+from filters import normalize_genres
+
+WORDS = (
+    "love war space robot ghost heist detective family island desert city river "
+    "mountain train ship king queen soldier doctor alien monster vampire witch "
+    "cowboy sheriff outlaw gangster boxer dancer singer pilot spy lawyer teacher "
+    "orphan twins wedding funeral revenge betrayal escape prison treasure storm "
+    "winter summer night dream secret murder rescue journey school village empire "
+    "dragon wizard zombie virus planet ocean jungle circus casino college army"
+).split()
+GENRES = ["drama", "comedy", "action", "horror", "western", "romance", "thriller", "sci-fi", "musical", "crime"]
+FIRST_NAMES = ["John", "Mary", "Ava", "Sam", "Lee", "Ida", "Max", "Ruth", "Otto", "June"]
+LAST_NAMES = ["Hale", "Ford", "Wynn", "Cole", "Park", "Lund", "Reyes", "Shaw", "Quinn", "Vance"]
+ENDPOINTS = ("movies", "vector_search", "hybrid_search", "vector_search_batch", "hybrid_search_batch")
+NUM_CLUSTERS = 64
+CORPUS_MARKER = "bench_corpus.json"
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+
+
+def peak_rss_mb():
+    """High-water resident set size of this process so far (Linux reports KiB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Synthetic corpus: movies are drawn around NUM_CLUSTERS topics, so vectors
+# have neighborhood structure (as real embeddings do) and each topic's
+# plots share vocabulary for the full-text side of hybrid search.
+
+def _name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def synthetic_chunk(start, count, dim, seed):
+    """(metadata DataFrame, float32 embeddings) for movies start..start+count."""
+    centers = np.random.default_rng(seed).standard_normal((NUM_CLUSTERS, dim)).astype(np.float32)
+    rng = np.random.default_rng([seed, start])
+    topics = rng.integers(0, NUM_CLUSTERS, size=count)
+    embeddings = centers[topics] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    rows = []
+    for offset, topic in enumerate(topics):
+        movie_id = start + offset
+        topic_words = [WORDS[(int(topic) * 7 + i) % len(WORDS)] for i in range(8)]
+        plot = " ".join(rng.choice(topic_words + WORDS, size=40))
+        rows.append({
+            "Release Year": int(rng.integers(1950, 2024)),
+            "Title": f"The {topic_words[0].title()} {rng.choice(WORDS).title()} {movie_id}",
+            "Origin/Ethnicity": "American",
+            "Director": _name(rng),
+            "Cast": ", ".join(_name(rng) for _ in range(3)),
+            "Genre": GENRES[int(topic) % len(GENRES)],
+            "Wiki Page": f"https://example.org/wiki/bench_{movie_id}",
+            "Plot": plot,
+            "PlotSummary": plot[:160],
+        })
+    return pd.DataFrame(rows), embeddings
+
+def write_corpus(chunk_dir, size, dim, seed, chunk_size=1000):
+    """Write the corpus as regular chunk artifacts, reusing a matching earlier run."""
+    marker_path = os.path.join(chunk_dir, CORPUS_MARKER)
+    marker = {"size": size, "dim": dim, "seed": seed, "chunk_size": chunk_size}
+    if os.path.exists(marker_path):
+        with open(marker_path) as f:
+            if json.load(f) == marker:
+                return artifacts.list_chunks(chunk_dir)
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+    os.makedirs(chunk_dir)
+    for idx, start in enumerate(range(0, size, chunk_size)):
+        frame, embeddings = synthetic_chunk(start, min(chunk_size, size - start), dim, seed)
+        artifacts.write_chunk(artifacts.chunk_stem(chunk_dir, idx + 1), frame, embeddings, dtype="float32")
+    artifacts.write_manifest(chunk_dir, model_name="bench-synthetic")
+    with open(marker_path, "w") as f:
+        json.dump(marker, f)
+    return artifacts.list_chunks(chunk_dir)
+
+def query_texts(count, seed):
+    rng = np.random.default_rng(seed + 1)
+    return [" ".join(rng.choice(WORDS, size=int(rng.integers(2, 8)))) for _ in range(count)]
+
+
+# Offline encoder: a hash tokenizer in front of a small randomly initialized
+# ModernBERT, which exercises the same code path as the real model.
+
+class HashTokenizer:
+    """Word-hashing tokenizer with the call signature model_utils/build.py rely on."""
+
+    PAD, CLS, SEP = 0, 1, 2
+
+    def __init__(self, vocab_size=8192):
+        self.vocab_size = vocab_size
+
+    def _encode(self, text, add_special_tokens, max_length, truncation):
+        ids = [3 + zlib.crc32(word.encode("utf-8")) % (self.vocab_size - 3) for word in re.findall(r"\w+", text.lower())]
+        if add_special_tokens:
+            ids = [self.CLS] + ids + [self.SEP]
+        if truncation and max_length:
+            ids = ids[:max_length]
+        return ids
+
+    def __call__(self, texts, add_special_tokens=True, max_length=512, padding=False,
+                 truncation=False, return_tensors=None):
+        from transformers import BatchEncoding
+        texts = [texts] if isinstance(texts, str) else texts
+        input_ids = [self._encode(text, add_special_tokens, max_length, truncation) for text in texts]
+        attention_mask = [[1] * len(ids) for ids in input_ids]
+        if padding:
+            width = max(len(ids) for ids in input_ids)
+            attention_mask = [mask + [0] * (width - len(mask)) for mask in attention_mask]
+            input_ids = [ids + [self.PAD] * (width - len(ids)) for ids in input_ids]
+        return BatchEncoding({"input_ids": input_ids, "attention_mask": attention_mask}, tensor_type=return_tensors)
+
+def tiny_encoder(dim=768, num_layers=2, seed=0):
+    """(tokenizer, model, device) shaped like load_model()'s, with no download."""
+    import torch
+    from transformers import ModernBertConfig, ModernBertModel
+    torch.manual_seed(seed)
+    tokenizer = HashTokenizer()
+    config = ModernBertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=dim,
+        intermediate_size=dim * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=max(1, dim // 64),
+        max_position_embeddings=512,
+        pad_token_id=HashTokenizer.PAD,
+        cls_token_id=HashTokenizer.CLS,
+        bos_token_id=HashTokenizer.CLS,
+        sep_token_id=HashTokenizer.SEP,
+        eos_token_id=HashTokenizer.SEP,
+        reference_compile=False,
+    )
+    model = ModernBertModel(config)
+    device = torch.device("cpu")
+    model.to(device)
+    model.eval()
+    return tokenizer, model, device
+
+
+# In-process stand-in for the Postgres-backed db functions, used by
+# --backend inprocess so endpoint benchmarks need no database.
+
+def export_chunks_index(chunk_files, index_dir):
+    """Write a vector_index version straight from chunk artifacts."""
+    total = sum(artifacts.chunk_rows(path) for path in chunk_files)
+    dim = np.load(chunk_files[0], mmap_mode="r").shape[1]
+    version_dir = os.path.join(index_dir, "bench")
+    os.makedirs(version_dir, exist_ok=True)
+    open_memmap = np.lib.format.open_memmap
+    ids = open_memmap(os.path.join(version_dir, "ids.npy"), mode="w+", dtype=np.int64, shape=(total,))
+    normalized = open_memmap(os.path.join(version_dir, "embeddings_normalized.npy"), mode="w+", dtype=np.float32, shape=(total, dim))
+    original = open_memmap(os.path.join(version_dir, "embeddings_original.npy"), mode="w+", dtype=np.float32, shape=(total, dim))
+    start = 0
+    for path in chunk_files:
+        block = np.load(path, mmap_mode="r").astype(np.float32)
+        end = start + len(block)
+        ids[start:end] = np.arange(start + 1, end + 1)
+        original[start:end] = block
+        normalized[start:end] = block / np.linalg.norm(block, axis=1, keepdims=True)
+        start = end
+    np.save(os.path.join(version_dir, "original_sq_norms.npy"), np.einsum("ij,ij->i", original, original))
+    for array in (ids, normalized, original):
+        array.flush()
+    with open(os.path.join(index_dir, "current.json"), "w") as f:
+        json.dump({"version": "bench", "count": total, "dim": dim}, f)
+
+
+class InProcessStore:
+    """Numpy/pandas implementations of the db functions routes.py calls."""
+
+    def __init__(self, chunk_files, index_dir):
+        import vector_index
+        export_chunks_index(chunk_files, index_dir)
+        self.index = vector_index.get_index(index_dir)
+        frames = [pd.read_parquet(path[:-len(".npy")] + ".parquet") for path in chunk_files]
+        movies = pd.concat(frames, ignore_index=True).rename(columns={
+            "Release Year": "release_year", "Title": "title", "Director": "director",
+            "Origin/Ethnicity": "origin_ethnicity", "PlotSummary": "plot_summary",
+            "Genre": "genre", "Cast": "cast",
+        })
+        movies.insert(0, "id", np.arange(1, len(movies) + 1))
+        self.columns = ["title", "release_year", "plot_summary", "director", "origin_ethnicity", "genre", "cast"]
+        self.movies = movies[["id"] + self.columns]
+        self.lower_titles = self.movies["title"].str.lower()
+        self.by_year = self.movies.sort_values(["release_year", "id"], ascending=False)
+        # Same derivation as the movies.genres column
+        self.genres = [set(normalize_genres(str(genre or ""))) - {"unknown"} for genre in self.movies["genre"]]
+        self.directors = self.movies["director"].fillna("").str.lower().to_numpy()
+        self.postings = {}
+        for movie_id, plot in zip(self.movies["id"], movies["plot_summary"]):
+            for word in set(plot.split()):
+                self.postings.setdefault(word, []).append(movie_id)
+
+    def _rows(self, ids):
+        frame = self.movies.iloc[np.asarray(ids, dtype=np.int64) - 1]
+        return frame[self.columns].to_dict("records")
+
+    def fetch_movies(self, limit=10, title_filter="", offset=0, cursor=None):
+        rows = self.by_year
+        if title_filter:
+            rows = rows[self.lower_titles.loc[rows.index].str.contains(title_filter.lower(), regex=False)]
+        page = rows.iloc[offset:offset + limit]
+        return {"movies": page.to_dict("records"), "total_count": len(rows), "next_cursor": None}
+
+    def _matching(self, filters):
+        """Mask over movies, in id order, of the rows filters (see filters.py) admit."""
+        mask = np.ones(len(self.movies), dtype=bool)
+        years = self.movies["release_year"].to_numpy()
+        if "year_min" in filters:
+            mask &= years >= filters["year_min"]
+        if "year_max" in filters:
+            mask &= years <= filters["year_max"]
+        if "genres" in filters:
+            wanted = set(filters["genres"])
+            mask &= np.array([bool(genres & wanted) for genres in self.genres], dtype=bool)
+        if "director" in filters:
+            mask &= self.directors == filters["director"].lower()
+        return mask
+
+    def _scores(self, embedding, metric, filters):
+        scores = self.index.scores(embedding, metric)
+        return np.where(self._matching(filters), scores, -np.inf) if filters else scores
+
+    def fetch_similar_movies(self, embedding, num_neighbors=5, metric='cosine', probes=None, exact=False, compact=None,
+                             filters=None):
+        if filters:
+            scores = self._scores(embedding, metric, filters)
+            top = np.argsort(-scores, kind="stable")[:min(num_neighbors, int(np.isfinite(scores).sum()))]
+            ids, similarities = top + 1, scores[top]
+        else:
+            ids, similarities = self.index.search(embedding, num_neighbors, metric)
+        rows = self._rows(ids)
+        for row, similarity in zip(rows, similarities.tolist()):
+            row["similarity"] = similarity
+        return rows
+
+    def fetch_similar_movies_batch(self, queries):
+        return [
+            self.fetch_similar_movies(
+                query["embedding"], query.get("num_neighbors", 5), query.get("metric", "cosine"),
+                filters=query.get("filters")
+            )
+            for query in queries
+        ]
+
+    def search_movies_hybrid(self, embedding, text_query="", num_neighbors=5, metric='cosine',
+                             use_normalized=True, embedding_weight=0.7, min_similarity=0.0,
+                             fusion=None, candidate_k=None, probes=None, exact=False, filters=None):
+        candidate_k = max(candidate_k or 100, num_neighbors)
+        scores = self._scores(embedding, metric, filters)
+        vector_ids = np.argpartition(-scores, min(candidate_k, len(scores)) - 1)[:candidate_k] + 1
+        vector_ids = vector_ids[np.isfinite(scores[vector_ids - 1])]
+        matching = self._matching(filters) if filters else None
+        terms = text_query.lower().split()
+        text_scores = {}
+        for term in terms:
+            for movie_id in self.postings.get(term, ()):
+                if matching is None or matching[movie_id - 1]:
+                    text_scores[movie_id] = text_scores.get(movie_id, 0) + 1 / len(terms)
+        candidates = set(vector_ids.tolist()) | set(sorted(text_scores, key=text_scores.get, reverse=True)[:candidate_k])
+        ranked = sorted(
+            (
+                (embedding_weight * float(scores[movie_id - 1]) + (1 - embedding_weight) * text_scores.get(movie_id, 0),
+                 movie_id)
+                for movie_id in candidates
+            ),
+            reverse=True
+        )[:num_neighbors]
+        rows = self._rows([movie_id for _, movie_id in ranked])
+        for row, (combined, movie_id) in zip(rows, ranked):
+            row["embedding_similarity"] = float(scores[movie_id - 1])
+            row["text_similarity"] = text_scores.get(movie_id, 0)
+            row["combined_similarity"] = combined
+        return [row for row in rows if row["combined_similarity"] >= min_similarity]
+
+    def search_movies_hybrid_batch(self, queries):
+        return [self.search_movies_hybrid(**query) for query in queries]
+
+    def install(self, routes):
+        for name in ("fetch_movies", "fetch_similar_movies", "fetch_similar_movies_batch",
+                     "search_movies_hybrid", "search_movies_hybrid_batch"):
+            setattr(routes, name, getattr(self, name))
+
+
+# Load generation
+
+def request_factory(endpoint, texts, batch_size):
+    """Function mapping a request number to (path, method, JSON body)."""
+    def make(i):
+        text = texts[i % len(texts)]
+        if endpoint == "movies":
+            title = text.split()[0] if i % 2 else ""
+            return f"/movies?limit=10&offset={(i * 10) % 200}&title={title}", "GET", None
+        if endpoint == "vector_search":
+            return "/vector_search", "POST", {"text": text, "num_neighbors": 10}
+        if endpoint == "hybrid_search":
+            return "/hybrid_search", "POST", {"text": text, "text_query": text, "num_neighbors": 10, "fusion": "rrf"}
+        batch = [texts[(i * batch_size + j) % len(texts)] for j in range(batch_size)]
+        if endpoint == "vector_search_batch":
+            return "/vector_search/batch", "POST", {"queries": batch, "num_neighbors": 10}
+        if endpoint == "hybrid_search_batch":
+            return "/hybrid_search/batch", "POST", {
+                "queries": [{"text": t, "text_query": t} for t in batch], "num_neighbors": 10, "fusion": "rrf"
+            }
+        raise ValueError(f"Unknown endpoint {endpoint}")
+    return make
+
+def in_process_client(app):
+    local = threading.local()
+
+    def send(path, method, body):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        response = local.client.open(path, method=method, json=body)
+        return response.status_code
+    return send
+
+def http_client(base_url):
+    import requests
+    local = threading.local()
+
+    def send(path, method, body):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        response = local.session.request(method, base_url.rstrip("/") + path, json=body)
+        return response.status_code
+    return send
+
+def summarize_latencies(latencies):
+    if not latencies:
+        return {}
+    ms = np.asarray(latencies) * 1000
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "mean": float(ms.mean()),
+        "max": float(ms.max()),
+    }
+
+def run_load(send, make_request, concurrency, num_requests, warmup=0):
+    """Issue num_requests across concurrency threads; returns the measurements."""
+    for i in range(warmup):
+        send(*make_request(i))
+    latencies = []
+    errors = [0]
+    counter = iter(range(warmup, warmup + num_requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            try:
+                status = send(*make_request(i))
+            except Exception:
+                status = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status is None or status >= 400:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    duration = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": errors[0],
+        "duration_s": duration,
+        "throughput_rps": num_requests / duration if duration else None,
+        "latency_ms": summarize_latencies(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# Phases
+
+def bench_build(chunk_files, encoder, rows, batch_size):
+    import build
+    tokenizer, model, device = encoder
+    frame = pd.read_parquet(chunk_files[0][:-len(".npy")] + ".parquet")
+    texts = (frame["PlotSummary"].tolist() * (rows // len(frame) + 1))[:rows]
+    started = time.perf_counter()
+    build.embed_texts(texts, tokenizer, model, device, batch_size=batch_size)
+    duration = time.perf_counter() - started
+    return {"rows": rows, "batch_size": batch_size, "duration_s": duration,
+            "rows_per_s": rows / duration, "peak_rss_mb": peak_rss_mb()}
+
+def database_config(dsn, allow_default=False):
+    """psycopg2.connect() arguments for dsn; refuses the app's own database unless allowed."""
+    import psycopg2.extensions
+    from db import DB_CONFIG
+    if not dsn:
+        raise ValueError("--backend postgres needs --dsn or BENCH_DATABASE_URL naming a scratch database")
+    config = psycopg2.extensions.parse_dsn(dsn)
+    same_host = config.get("host") in (None, DB_CONFIG["host"])
+    if config.get("dbname") == DB_CONFIG["dbname"] and same_host and not allow_default:
+        raise ValueError(
+            f"{dsn} is the app's database; the benchmark replaces its movies table. "
+            "Use a scratch database or pass --allow-default-db"
+        )
+    return config
+
+def bench_ingest(chunk_files, dim, modes, config):
+    import psycopg2
+    import ingest
+    rows = sum(artifacts.chunk_rows(path) for path in chunk_files)
+    results = []
+    conn = psycopg2.connect(**config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        conn.commit()
+        for mode in modes:
+            started = time.perf_counter()
+            ingest.rebuild(conn, chunk_files, dim, mode=mode)
+            duration = time.perf_counter() - started
+            results.append({"mode": mode, "rows": rows, "duration_s": duration,
+                            "rows_per_s": rows / duration, "peak_rss_mb": peak_rss_mb()})
+    finally:
+        conn.close()
+    return results
+
+def load_app(encoder):
+    """Import the Flask app with the given encoder in place of load_model()."""
+    import model_utils
+    model_utils.load_model = lambda: encoder
+    import routes
+    from main import app
+    return app, routes
+
+def environment():
+    info = {"python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "numpy": np.__version__}
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API endpoints, build.py and ingest.py.")
+    parser.add_argument("--size", type=int, default=10000, help="Number of synthetic movies (1k-1M).")
+    parser.add_argument("--dim", type=int, default=int(os.getenv("VECTOR_LENGTH", "768")), help="Embedding dimension.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus, queries and encoder.")
+    parser.add_argument("--backend", choices=["inprocess", "postgres"], default="inprocess",
+                        help="inprocess: numpy/pandas stand-in for the database; postgres: the --dsn database.")
+    parser.add_argument("--dsn", default=BENCH_DATABASE_URL,
+                        help="Scratch database for --backend postgres (default: BENCH_DATABASE_URL).")
+    parser.add_argument("--allow-default-db", action="store_true",
+                        help="Let --backend postgres rebuild the app's own movies table.")
+    parser.add_argument("--encoder", choices=["tiny", "model"], default="tiny",
+                        help="tiny: random 2-layer ModernBERT + hash tokenizer; model: EMBEDDING_MODEL.")
+    parser.add_argument("--url", help="Drive an already running server instead of the app in-process.")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated endpoints to drive.")
+    parser.add_argument("--concurrency", default="1,8", help="Comma-separated concurrency levels.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level.")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before each run.")
+    parser.add_argument("--queries", type=int, default=500, help="Distinct query texts to cycle through.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Queries per batch-endpoint request.")
+    parser.add_argument("--build-rows", type=int, default=1000, help="Texts to embed in the build phase (0 skips).")
+    parser.add_argument("--ingest-modes", default="stream",
+                        help="Comma-separated ingest modes to time with --backend postgres ('' skips).")
+    parser.add_argument("--embedding-cache", action="store_true",
+                        help="Keep the query embedding cache on (off by default so every request embeds).")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Keep the search result cache on (off by default so every request searches).")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "movie_bench"),
+                        help="Where the corpus and stand-in index are written (reused across runs).")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args(argv)
+
+    if not args.embedding_cache:
+        os.environ["EMBEDDING_CACHE_SIZE"] = "0"
+    if not args.result_cache:
+        os.environ["RESULT_CACHE_BACKEND"] = "off"
+    report = {"config": vars(args), "environment": environment()}
+
+    started = time.perf_counter()
+    chunk_files = write_corpus(os.path.join(args.work_dir, "chunks"), args.size, args.dim, args.seed)
+    database = None
+    if args.backend == "postgres":
+        try:
+            database = database_config(args.dsn, args.allow_default_db)
+        except ValueError as e:
+            parser.error(str(e))
+    report["corpus"] = {"rows": args.size, "chunks": len(chunk_files),
+                        "duration_s": time.perf_counter() - started, "peak_rss_mb": peak_rss_mb()}
+
+    encoder = None
+    if args.build_rows or not args.url:
+        if args.encoder == "tiny":
+            encoder = tiny_encoder(args.dim, seed=args.seed)
+        else:
+            from model_utils import load_model
+            encoder = load_model()
+    if args.build_rows:
+        report["build"] = bench_build(chunk_files, encoder, args.build_rows, int(os.getenv("BUILD_BATCH_SIZE", "32")))
+    if args.backend == "postgres" and args.ingest_modes:
+        report["ingest"] = bench_ingest(chunk_files, args.dim, args.ingest_modes.split(","), database)
+
+    if args.url:
+        send = http_client(args.url)
+    else:
+        app, routes = load_app(encoder)
+        if args.backend == "inprocess":
+            InProcessStore(chunk_files, os.path.join(args.work_dir, "index")).install(routes)
+        else:
+            import db
+            # The pool connects lazily, so nothing has touched DB_CONFIG's database yet
+            db.pool.config = database
+        send = in_process_client(app)
+
+    texts = query_texts(args.queries, args.seed)
+    report["endpoints"] = []
+    for endpoint in args.endpoints.split(","):
+        make_request = request_factory(endpoint, texts, args.batch_size)
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            result = run_load(send, make_request, concurrency, args.requests, args.warmup)
+            result["endpoint"] = endpoint
+            if endpoint.endswith("_batch"):
+                result["queries_per_s"] = result["throughput_rps"] * args.batch_size
+            report["endpoints"].append(result)
+            print(f"{endpoint} x{concurrency}: {result['throughput_rps']:.1f} req/s, "
+                  f"p95 {result['latency_ms'].get('p95', 0):.1f} ms", file=sys.stderr)
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,360 @@
 import os
+import glob
+import time
+import hashlib
+import argparse
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 from tqdm.auto import tqdm
-from concurrent.futures import ThreadPoolExecutor
-from model_utils import load_model, get_embedding
-import psycopg2
-from psycopg2.extras import execute_values
-import json
-
-
-# Function to process a chunk of data
-def process_chunk(chunk, output_file, tokenizer, model, device):
-    chunk["embedding"] = chunk["PlotSummary"].progress_apply(lambda text: get_embedding(text, tokenizer, model, device))
-    chunk.to_json(output_file, orient="records", lines=True)
-    print(f"Processed and saved chunk to {output_file}")
-
-# Check if chunk file already exists and is complete
-def is_chunk_complete(output_file, expected_count):
-    if not os.path.exists(output_file):
+from model_utils import load_model, get_embeddings, POOLING, EMBEDDING_QUANTIZE, MODEL_DTYPE
+from embedding_store import EmbeddingStore, EMBEDDING_STORE_PATH, model_identity, store_key
+import artifacts
+
+
+BATCH_SIZE = int(os.getenv("BUILD_BATCH_SIZE", "32"))
+BUILD_WORKERS = int(os.getenv("BUILD_WORKERS", "1"))
+MAX_LENGTH = 512
+CHUNK_SIZE = 1000
+OUTPUT_DIR = "/app/data/chunks"
+DATASET_URL = "https://huggingface.co/datasets/vishnupriyavr/wiki-movie-plots-with-summaries/resolve/main/wiki_movie_plots_deduped_with_summaries.csv"
+# Local copy of the dataset, downloaded once
+DATASET_CACHE = os.getenv("DATASET_CACHE", "/app/data/wiki_movie_plots_deduped_with_summaries.csv")
+# Corpus filters: comma-separated Origin/Ethnicity values ("all" for every origin) and a year range
+BUILD_ORIGINS = os.getenv("BUILD_ORIGINS", "American")
+BUILD_MIN_YEAR = int(os.getenv("BUILD_MIN_YEAR", "1950"))
+BUILD_MAX_YEAR = os.getenv("BUILD_MAX_YEAR")
+
+# Embed texts in token-length-sorted batches so padding per batch stays small.
+# Positions already in done (position -> embedding) are not embedded again,
+# and on_batch(positions, embeddings) is called after every new batch.
+def embed_texts(texts, tokenizer, model, device, batch_size=BATCH_SIZE, done=None, on_batch=None, progress=True):
+    done = done or {}
+    todo = [i for i in range(len(texts)) if i not in done]
+    embeddings = [done.get(i) for i in range(len(texts))]
+    if not todo:
+        return embeddings
+    lengths = [
+        len(ids) for ids in tokenizer(
+            [texts[i] for i in todo], add_special_tokens=True, truncation=True, max_length=MAX_LENGTH
+        )["input_ids"]
+    ]
+    order = [todo[j] for j in np.argsort(lengths, kind="stable")]
+    for start in tqdm(range(0, len(order), batch_size), desc="Embedding batches", leave=False, disable=not progress):
+        batch_idx = order[start:start + batch_size]
+        batch = get_embeddings([texts[i] for i in batch_idx], tokenizer, model, device, max_length=MAX_LENGTH)
+        for i, embedding in zip(batch_idx, batch):
+            embeddings[i] = embedding
+        if on_batch is not None:
+            on_batch(batch_idx, batch)
+    return embeddings
+
+
+class BatchCheckpoint:
+    """Append-only log of the batches embedded so far for one chunk.
+
+    Each record is two .npy blobs: row positions, then their embeddings. A
+    crash loses at most the batch being written, whose torn record is cut
+    off on the next load. The file name carries a hash of the chunk's texts,
+    so a checkpoint is never resumed against different data.
+    """
+
+    def __init__(self, output_stem, texts):
+        digest = hashlib.sha256("\0".join(texts).encode("utf-8")).hexdigest()[:16]
+        self.output_stem = output_stem
+        self.path = f"{output_stem}.{digest}.ckpt"
+        self._file = None
+
+    def load(self):
+        """position -> embedding for every checkpointed row (empty if none)."""
+        for path in glob.glob(f"{glob.escape(self.output_stem)}.*.ckpt"):
+            if path != self.path:
+                os.remove(path)
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        good = 0
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    positions = np.load(f)
+                    embeddings = np.load(f)
+                except (EOFError, ValueError, OSError):
+                    break
+                done.update(zip(positions.tolist(), embeddings))
+                good = f.tell()
+        os.truncate(self.path, good)
+        return done
+
+    def append(self, positions, embeddings):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        np.save(self._file, np.asarray(positions, dtype=np.int64))
+        np.save(self._file, np.asarray(embeddings, dtype=np.float32))
+        self._file.flush()
+
+    def remove(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def open_store(path=EMBEDDING_STORE_PATH):
+    return EmbeddingStore(path) if path else None
+
+def text_keys(texts):
+    model = model_identity(os.getenv("EMBEDDING_MODEL"), EMBEDDING_QUANTIZE, MODEL_DTYPE)
+    return [store_key(model, MAX_LENGTH, POOLING, text) for text in texts]
+
+# Function to process a chunk of data. Rows found in the store (or in this
+# chunk's checkpoint) are reused; only the rest go through the model.
+def process_chunk(chunk, output_stem, tokenizer, model, device, progress=True, store=None):
+    texts = chunk["PlotSummary"].tolist()
+    checkpoint = BatchCheckpoint(output_stem, texts)
+    done = checkpoint.load()
+    if store is not None:
+        keys = text_keys(texts)
+        stored = store.get_many({keys[i] for i in range(len(texts)) if i not in done})
+        done.update({i: stored[key] for i, key in enumerate(keys) if i not in done and key in stored})
+    if done:
+        print(f"{output_stem}: reusing {len(done)}/{len(texts)} embedded rows")
+
+    def on_batch(positions, embeddings):
+        # With a store, finished batches go there instead of to the checkpoint log
+        if store is not None:
+            store.put_many(zip((keys[i] for i in positions), embeddings))
+        else:
+            checkpoint.append(positions, embeddings)
+
+    embeddings = embed_texts(
+        texts, tokenizer, model, device, done=done, on_batch=on_batch, progress=progress
+    )
+    if artifacts.ARTIFACT_FORMAT == "jsonl":
+        chunk = chunk.copy()
+        chunk["embedding"] = pd.Series(embeddings, index=chunk.index)
+        chunk.to_json(f"{output_stem}.json", orient="records", lines=True)
+    else:
+        artifacts.write_chunk(output_stem, chunk, embeddings)
+    checkpoint.remove()
+    print(f"Processed and saved chunk to {output_stem}")
+    return len(chunk)
+
+# Check if chunk file already exists and holds exactly these rows (JSONL
+# chunks are only checked by row count)
+def is_chunk_complete(output_stem, chunk):
+    if artifacts.ARTIFACT_FORMAT == "jsonl":
+        return artifacts.chunk_rows(f"{output_stem}.json") == len(chunk)
+    if artifacts.chunk_rows(f"{output_stem}.npy") != len(chunk):
         return False
-    with open(output_file, "r") as f:
-        count = sum(1 for _ in f)
-    return count == expected_count
+    return pd.read_parquet(f"{output_stem}.parquet").equals(chunk.reset_index(drop=True))
 
-# Main function
-def generate(tokenizer, model, device):
-    tqdm.pandas()
-    url = "https://huggingface.co/datasets/vishnupriyavr/wiki-movie-plots-with-summaries/resolve/main/wiki_movie_plots_deduped_with_summaries.csv"
+def chunk_path(output_stem):
+    return f"{output_stem}{'.json' if artifacts.ARTIFACT_FORMAT == 'jsonl' else '.npy'}"
+
+
+# Each pool worker loads its own model (and store connection) once and
+# keeps it for every chunk
+_worker_encoder = None
+_worker_store = None
+
+def _init_worker(num_threads, store_path):
+    global _worker_encoder, _worker_store
+    import torch
+    torch.set_num_threads(num_threads)
+    _worker_encoder = load_model()
+    _worker_store = open_store(store_path)
+
+def _process_chunk_in_worker(chunk, output_stem):
+    tokenizer, model, device = _worker_encoder
+    return process_chunk(chunk, output_stem, tokenizer, model, device, progress=False, store=_worker_store)
+
+
+def fetch_dataset(path=DATASET_CACHE, refresh=False):
+    """Path of the local dataset CSV, downloading it first if needed."""
+    if refresh or not os.path.exists(path):
+        print(f"Downloading dataset to {path}...")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pd.read_csv(DATASET_URL).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    return path
+
+def load_movies(origins=BUILD_ORIGINS, min_year=BUILD_MIN_YEAR, max_year=BUILD_MAX_YEAR, refresh=False):
     try:
-        movie_df = pd.read_csv(url)
+        movie_df = pd.read_csv(fetch_dataset(refresh=refresh))
         print("DataFrame loaded successfully!")
     except Exception as e:
         print(f"An error occurred while loading the CSV: {e}")
-        return
-    
+        return None
+
     # filter out some stuff here for expedience and relevance
-    movie_df = movie_df[
-        (movie_df['Origin/Ethnicity'] == 'American') &
-        (movie_df['Release Year'] >= 1950)
-    ]
+    keep = movie_df['Release Year'] >= min_year
+    if max_year is not None:
+        keep &= movie_df['Release Year'] <= int(max_year)
+    if origins.lower() != "all":
+        keep &= movie_df['Origin/Ethnicity'].isin([origin.strip() for origin in origins.split(",")])
+    movie_df = movie_df[keep]
+    print(f"Selected {len(movie_df)} movies (origins: {origins}, years: {min_year}-{max_year or 'latest'})")
     movie_df["Plot"] = movie_df["Plot"].astype(str)
     movie_df["PlotSummary"] = movie_df["PlotSummary"].astype(str)
 
     ####### FOR TEST ONLY!!!!######
     # movie_df = movie_df.head(50)
     ###############################
+    return movie_df
 
-    chunk_size = 1000
-    num_chunks = len(movie_df) // chunk_size + int(len(movie_df) % chunk_size > 0)
-    chunks = [movie_df.iloc[i * chunk_size:(i + 1) * chunk_size] for i in range(num_chunks)]
+def dataset_fingerprint(movie_df):
+    """Hash of the rows being embedded, so shards of different data are never merged."""
+    hashed = pd.util.hash_pandas_object(movie_df[["Title", "PlotSummary"]], index=False)
+    return hashlib.sha256(hashed.values.tobytes()).hexdigest()
+
+def parse_shard(value):
+    """'i/n' -> (i, n) with 0 <= i < n."""
+    try:
+        shard, num_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/n, got {value!r}")
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Shard index must be in [0, {num_shards}), got {shard}")
+    return shard, num_shards
+
+# Main function
+def generate(movie_df, output_dir=OUTPUT_DIR, shard=0, num_shards=1, workers=BUILD_WORKERS, threads=None,
+             store_path=EMBEDDING_STORE_PATH):
+    """Embed this shard's chunks, then record them in a shard manifest.
+
+    Chunk boundaries and numbering depend only on the data, and shard i of n
+    takes every chunk whose index is i mod n, so shards can run anywhere and
+    write disjoint files. A single-shard build merges itself right away.
+    """
+    num_chunks = len(movie_df) // CHUNK_SIZE + int(len(movie_df) % CHUNK_SIZE > 0)
+    chunks = {
+        idx + 1: movie_df.iloc[idx * CHUNK_SIZE:(idx + 1) * CHUNK_SIZE]
+        for idx in range(shard, num_chunks, num_shards)
+    }
 
     # Ensure the output directory exists
-    output_dir = "/app/data/chunks"
     os.makedirs(output_dir, exist_ok=True)
+    pending = {}
+    for idx, chunk in chunks.items():
+        output_stem = artifacts.chunk_stem(output_dir, idx)
+        if is_chunk_complete(output_stem, chunk):
+            print(f"Chunk {idx} already processed and saved. Skipping...")
+        else:
+            pending[idx] = (chunk, output_stem)
+    print(f"Shard {shard}/{num_shards}: {len(chunks)} chunks, {len(pending)} left to embed")
+
+    if workers <= 1:
+        # In process: a single model copy gets all of torch's intra-op threads
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        tokenizer, model, device = load_model()
+        store = open_store(store_path)
+        for idx, (chunk, output_stem) in tqdm(pending.items(), desc="Processing Chunks"):
+            print(f"Processing chunk {idx}...")
+            process_chunk(chunk, output_stem, tokenizer, model, device, store=store)
+    elif pending:
+        # One model per worker, each with its share of the cores instead of
+        # every process oversubscribing all of them
+        threads_per_worker = max(1, (threads or os.cpu_count() or 1) // workers)
+        print(f"Embedding with {workers} workers x {threads_per_worker} threads")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads_per_worker, store_path)
+        ) as executor:
+            futures = [
+                executor.submit(_process_chunk_in_worker, chunk, output_stem)
+                for chunk, output_stem in pending.values()
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing Chunks"):
+                future.result()
+
+    artifacts.write_shard_manifest(output_dir, {
+        "shard": shard,
+        "num_shards": num_shards,
+        "num_chunks": num_chunks,
+        "dataset": dataset_fingerprint(movie_df),
+        "model": os.getenv("EMBEDDING_MODEL"),
+        "chunks": [
+            {"index": idx, "file": os.path.basename(chunk_path(artifacts.chunk_stem(output_dir, idx))), "rows": len(chunk)}
+            for idx, chunk in chunks.items()
+        ],
+        "created_at": time.time(),
+    })
+    if num_shards == 1:
+        merge_shards(output_dir)
+    else:
+        print(f"Shard {shard}/{num_shards} done. Once every shard's files are in {output_dir}, run build.py --merge.")
+
+def merge_shards(output_dir=OUTPUT_DIR):
+    """Check that the newest shard set is complete and write the combined manifest.
+
+    Chunk files numbered past the dataset's last chunk (left by an earlier,
+    larger build) are deleted so ingest.py only sees the merged set.
+    """
+    manifests = artifacts.read_shard_manifests(output_dir)
+    if not manifests:
+        raise ValueError(f"No shard manifests in {output_dir}")
+    newest = max(manifests, key=lambda manifest: manifest["created_at"])
+    key = ("num_shards", "num_chunks", "dataset", "model")
+    current = [manifest for manifest in manifests if all(manifest[k] == newest[k] for k in key)]
+    ignored = len(manifests) - len(current)
+    if ignored:
+        print(f"Ignoring {ignored} shard manifests from a different build")
+
+    missing_shards = set(range(newest["num_shards"])) - {manifest["shard"] for manifest in current}
+    if missing_shards:
+        raise ValueError(f"Missing shards: {', '.join(str(shard) for shard in sorted(missing_shards))}")
+    chunks = {chunk["index"]: chunk for manifest in current for chunk in manifest["chunks"]}
+    missing_chunks = set(range(1, newest["num_chunks"] + 1)) - set(chunks)
+    if missing_chunks:
+        raise ValueError(f"Missing chunks: {', '.join(str(idx) for idx in sorted(missing_chunks))}")
+    paths = []
+    for idx in sorted(chunks):
+        path = os.path.join(output_dir, chunks[idx]["file"])
+        if artifacts.chunk_rows(path) != chunks[idx]["rows"]:
+            raise ValueError(f"Chunk {idx} ({path}) is missing or does not have {chunks[idx]['rows']} rows")
+        paths.append(path)
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = []
-        for idx, chunk in enumerate(chunks):
-            output_file = os.path.join(output_dir, f"movie_embeddings_chunk_{idx + 1}.json")
-            if not is_chunk_complete(output_file, len(chunk)):
-                print(f"Processing chunk {idx + 1}...")
-                futures.append(executor.submit(process_chunk, chunk, output_file, tokenizer, model, device))
-            else:
-                print(f"Chunk {idx + 1} already processed and saved. Skipping...")
+    for path in artifacts.list_chunks(output_dir):
+        if artifacts.chunk_index(path) > newest["num_chunks"]:
+            print(f"Removing stale chunk {path}")
+            stem = os.path.splitext(path)[0]
+            for extension in (".npy", ".parquet", ".json"):
+                if os.path.exists(f"{stem}{extension}"):
+                    os.remove(f"{stem}{extension}")
 
-        for future in tqdm(futures, desc="Processing Chunks"):
-            future.result()
+    manifest = artifacts.write_manifest(output_dir, model_name=newest["model"], paths=paths)
+    print(f"Wrote manifest for {manifest['total_rows']} rows in {len(manifest['chunks'])} chunks")
+    return manifest
 
 
 if __name__ == "__main__":
-    tokenizer, model, device = load_model()
-    print("Getting data...")
-    generate(tokenizer, model, device)
+    parser = argparse.ArgumentParser(description="Embed the movie plots into chunk artifacts.")
+    parser.add_argument("--shard", default="0/1", help="Build only shard i of n (e.g. 2/4); chunks are split round-robin.")
+    parser.add_argument("--workers", type=int, default=BUILD_WORKERS, help="Worker processes, each with its own model copy.")
+    parser.add_argument("--threads", type=int, help="Total torch threads, split evenly across workers (default: all cores).")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Directory the chunk files and manifests go to.")
+    parser.add_argument("--merge", action="store_true", help="Only check the shard manifests and write the combined manifest.")
+    parser.add_argument("--origins", default=BUILD_ORIGINS, help="Comma-separated Origin/Ethnicity values to keep, or 'all'.")
+    parser.add_argument("--min-year", type=int, default=BUILD_MIN_YEAR, help="Earliest release year to keep.")
+    parser.add_argument("--max-year", type=int, default=BUILD_MAX_YEAR, help="Latest release year to keep (default: no limit).")
+    parser.add_argument("--refresh-data", action="store_true", help="Download the dataset again instead of using DATASET_CACHE.")
+    parser.add_argument("--store", default=EMBEDDING_STORE_PATH, help="Embedding store to reuse vectors from ('' disables it).")
+    args = parser.parse_args()
+    if args.merge:
+        merge_shards(args.output_dir)
+    else:
+        shard, num_shards = parse_shard(args.shard)
+        print("Getting data...")
+        movie_df = load_movies(args.origins, args.min_year, args.max_year, args.refresh_data)
+        if movie_df is not None:
+            generate(movie_df, args.output_dir, shard, num_shards, args.workers, args.threads, args.store)
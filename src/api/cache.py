@@ -0,0 +1,143 @@
+import atexit
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from logger import logger
+
+
+class LRUCache:
+    """Thread-safe LRU cache with optional TTL and an optional on-disk spill file.
+
+    Expiry times are wall-clock so entries spilled to disk keep their TTL
+    across restarts. The spill file is read on construction and rewritten
+    at interpreter exit. With a weigher, maxsize bounds the summed weight of
+    the entries (e.g. bytes) instead of their count.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, spill_path=None, weigher=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be greater than 0")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.spill_path = spill_path
+        self.weigher = weigher
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if spill_path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, weight = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.weight -= weight
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._insert(key, value, expires_at)
+
+    def _insert(self, key, value, expires_at):
+        weight = self.weigher(value) if self.weigher else 1
+        if weight > self.maxsize:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.weight -= old[2]
+        self._data[key] = (value, expires_at, weight)
+        self.weight += weight
+        while self.weight > self.maxsize:
+            _, (_, _, evicted_weight) = self._data.popitem(last=False)
+            self.weight -= evicted_weight
+            self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return False
+            self.weight -= entry[2]
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "weight": self.weight,
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "spill_path": self.spill_path,
+            }
+
+    def load(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        try:
+            with open(self.spill_path, "rb") as f:
+                items = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache spill file {self.spill_path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, (value, expires_at) in items:
+                if expires_at is None or expires_at > now:
+                    self._insert(key, value, expires_at)
+        logger.info(f"Loaded {len(self._data)} cache entries from {self.spill_path}")
+
+    def save(self):
+        if not self.spill_path:
+            return
+        now = time.time()
+        with self._lock:
+            items = [
+                (key, (value, expires_at)) for key, (value, expires_at, _) in self._data.items()
+                if expires_at is None or expires_at > now
+            ]
+        directory = os.path.dirname(self.spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.spill_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.spill_path)
+        except Exception as e:
+            logger.error(f"Failed to spill cache to {self.spill_path}: {e}")
@@ -1,7 +1,20 @@
+import os
+import json
+import base64
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 from model_utils import normalize_query_embedding, format_vector_for_postgres
+import vector_index
+from projection import load_projection
+from result_cache import create_result_cache, result_key, read_generation
+from filters import filter_clause, filter_shape
+from cache import LRUCache
 from logger import logger
+from metrics import span
 
 # Database connection settings
 DB_CONFIG = {
@@ -12,6 +25,12 @@ DB_CONFIG = {
     "port": 5432,
 }
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Idle connections older than this are pinged before being handed out
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
+
 def get_db_connection():
     try:
         return psycopg2.connect(**DB_CONFIG)
@@ -19,98 +38,410 @@ def get_db_connection():
         print(f"Error connecting to database: {e}")
         raise
 
-def fetch_movies(limit=10, title_filter="", offset=0):
-    """Fetch movies with optional fuzzy title matching and pagination."""
-    conn = get_db_connection()
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that remembers which statements it has already PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 pool with a checkout timeout and health checks."""
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT, **config):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool size must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.config = config
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._idle = []
+        self._prefilled = False
+
+    def _connect(self):
+        return psycopg2.connect(connection_factory=PooledConnection, **self.config)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < DB_POOL_HEALTHCHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _prefill(self):
+        with self._lock:
+            if self._prefilled:
+                return
+            self._prefilled = True
+            for _ in range(self.minconn):
+                self._idle.append(self._connect())
+
+    def getconn(self):
+        # Connections are not shareable across fork; start over in the child
+        if self._pid != os.getpid():
+            self._reset()
+        if not self._prefilled:
+            self._prefill()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if self._is_healthy(conn):
+                    return conn
+                logger.warning("Discarding unhealthy pooled database connection")
+                conn.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            if not conn.closed:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+        except psycopg2.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "idle": len(self._idle),
+                "timeout": self.timeout,
+            }
+
+
+pool = ConnectionPool(**DB_CONFIG)
+
+@contextmanager
+def pooled_connection():
+    """Check a connection out of the process-wide pool for the block."""
+    with span("db_checkout"):
+        conn = pool.getconn()
     try:
-        with conn.cursor() as cursor:
-            # Ensure pg_trgm extension
-            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
-            conn.commit()
+        yield conn
+    finally:
+        pool.putconn(conn)
 
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            # 1) Query for total count (no LIMIT/OFFSET)
-            count_query = """
-                SELECT 
-                    COUNT(*) AS total
-                FROM movies
-                WHERE
-                    CASE 
-                        WHEN %s != '' THEN 
-                            title ILIKE %s
-                            OR similarity(lower(title), lower(%s)) > 0.3
-                        ELSE TRUE
-                    END
-            """
-            like_pattern = f"%{title_filter}%" if title_filter else ""
-            cursor.execute(
-                count_query,
-                (title_filter, like_pattern, title_filter)
-            )
-            total_count = cursor.fetchone()['total']
-
-            # 2) Query for actual data with pagination
-            data_query = """
-                SELECT 
-                    id,
-                    title,
-                    release_year,
-                    director,
-                    origin_ethnicity,
-                    plot_summary,
-                    genre,
-                    "cast"
-                FROM movies
-                WHERE 
-                    CASE 
-                        WHEN %s != '' THEN 
-                            title ILIKE %s
-                            OR similarity(lower(title), lower(%s)) > 0.3
-                        ELSE TRUE
-                    END
-                ORDER BY 
-                    CASE 
-                        WHEN %s != '' THEN similarity(lower(title), lower(%s))
-                        ELSE release_year 
-                    END DESC
-                OFFSET %s
-                LIMIT %s
-            """
-            cursor.execute(
-                data_query,
-                (title_filter, like_pattern, title_filter,
-                 title_filter, title_filter,
-                 offset, limit)
+def execute_prepared(cursor, name, sql, params, types):
+    """Run sql as a server-side prepared statement, preparing it once per connection."""
+    conn = cursor.connection
+    if name not in conn.prepared:
+        signature = f" ({', '.join(types)})" if types else ""
+        cursor.execute(f"PREPARE {name}{signature} AS {sql}")
+        conn.prepared.add(name)
+    placeholders = f" ({', '.join(['%s'] * len(params))})" if params else ""
+    cursor.execute(f"EXECUTE {name}{placeholders}", params)
+
+TITLE_SIMILARITY_THRESHOLD = 0.3
+MAX_INTEGER = 2 ** 31 - 1
+MOVIES_COUNT_TTL = float(os.getenv("MOVIES_COUNT_TTL", "300"))
+movie_count_cache = LRUCache(maxsize=1024, ttl=MOVIES_COUNT_TTL)
+
+# Rows fetched per round trip when streaming through a server-side cursor
+STREAM_ITERSIZE = int(os.getenv("STREAM_ITERSIZE", "2000"))
+
+MOVIE_FIELDS = ("id", "title", "release_year", "director", "origin_ethnicity", "plot_summary", "genre", "cast")
+MOVIE_COLUMNS = """
+    id,
+    title,
+    release_year,
+    director,
+    origin_ethnicity,
+    plot_summary,
+    genre,
+    "cast"
+"""
+# LIKE on lower(title) and the % operator (rather than similarity() > x)
+# are what the idx_title_trgm GIN index on lower(title) can serve
+TITLE_FILTER = "(lower(title) LIKE $2 OR lower(title) % lower($1))"
+TITLE_SORT_KEY = "similarity(lower(title), lower($1))"
+# Matches the idx_release_year_id expression index
+YEAR_SORT_KEY = "COALESCE(release_year, 0)"
+
+def movies_count_query(filtered):
+    where_clause = f"WHERE {TITLE_FILTER}" if filtered else ""
+    return f"""
+        SELECT 
+            COUNT(*) AS total
+        FROM movies
+        {where_clause}
+    """
+
+def movies_page_query(filtered, keyset):
+    """Page query; filtered queries take ($1 filter, $2 lower LIKE pattern) first.
+
+    Offset pages then take (offset, limit); keyset pages take
+    (last sort key, last id, limit) and seek past that row.
+    """
+    if filtered:
+        sort_key, conditions, param = TITLE_SORT_KEY, [TITLE_FILTER], 3
+    else:
+        sort_key, conditions, param = YEAR_SORT_KEY, [], 1
+    if keyset:
+        conditions.append(f"({sort_key}, id) < (${param}, ${param + 1})")
+        paging = f"LIMIT ${param + 2}"
+    else:
+        paging = f"OFFSET ${param} LIMIT ${param + 1}"
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+        SELECT {MOVIE_COLUMNS},
+            {sort_key} AS sort_key
+        FROM movies
+        {where_clause}
+        ORDER BY {sort_key} DESC, id DESC
+        {paging}
+    """
+
+def encode_cursor(sort_key, movie_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_key, movie_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        sort_key, movie_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(sort_key), int(movie_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def count_movies(cursor, title_filter, like_pattern):
+    """Total matches for a filter, cached for MOVIES_COUNT_TTL seconds."""
+    key = title_filter.lower()
+    total = movie_count_cache.get(key)
+    if total is None:
+        if title_filter:
+            execute_prepared(
+                cursor, "movies_count_filtered", movies_count_query(True),
+                (title_filter, like_pattern), ("text", "text")
             )
-            rows = cursor.fetchall()
+        else:
+            execute_prepared(cursor, "movies_count_all", movies_count_query(False), (), ())
+        total = cursor.fetchone()['total']
+        movie_count_cache.set(key, total)
+    return total
+
+def fetch_movies(limit=10, title_filter="", offset=0, cursor=None):
+    """Fetch movies with optional fuzzy title matching and pagination.
+
+    Passing cursor (None for offset paging, "" for the first keyset page, or a
+    previous next_cursor) switches to keyset pagination, which seeks straight
+    to the next page instead of rescanning every skipped row.
+    """
+    keyset = cursor is not None
+    after = decode_cursor(cursor) if cursor else None
+    filtered = bool(title_filter)
+    like_pattern = f"%{title_filter.lower()}%" if filtered else ""
+    base_params, base_types = ((title_filter, like_pattern), ("text", "text")) if filtered else ((), ())
+    sort_type = "real" if filtered else "integer"
+    if keyset:
+        # The first keyset page starts past the largest possible sort key
+        sort_key, last_id = after if after else (float("inf"), MAX_INTEGER)
+        if not filtered:
+            sort_key = int(min(sort_key, MAX_INTEGER))
+        page_params = (sort_key, last_id, limit)
+        page_types = (sort_type, "integer", "integer")
+    else:
+        page_params = (offset, limit)
+        page_types = ("integer", "integer")
+    name = f"movies_{'after' if keyset else 'page'}_{'filtered' if filtered else 'all'}"
+
+    with pooled_connection() as conn:
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as db_cursor:
+                if filtered:
+                    db_cursor.execute(
+                        "SELECT set_config('pg_trgm.similarity_threshold', %s, true);",
+                        [str(TITLE_SIMILARITY_THRESHOLD)]
+                    )
+                # 1) Total count, cached rather than recomputed for every page
+                with span("db_count"):
+                    total_count = count_movies(db_cursor, title_filter, like_pattern)
+
+                # 2) Query for actual data with pagination
+                with span("db_query"):
+                    execute_prepared(
+                        db_cursor, name, movies_page_query(filtered, keyset),
+                        base_params + page_params, base_types + page_types
+                    )
+                    rows = db_cursor.fetchall()
+
+            next_cursor = None
+            if rows and len(rows) == limit:
+                next_cursor = encode_cursor(rows[-1]['sort_key'], rows[-1]['id'])
+            for row in rows:
+                del row['sort_key']
 
             # Return both data and total_count
             return {
                 "movies": rows,
-                "total_count": total_count
+                "total_count": total_count,
+                "next_cursor": next_cursor
             }
 
-    except Exception as e:
-        print(f"Error fetching movies: {e}")
-        raise
-    finally:
-        conn.close()
+        except Exception as e:
+            print(f"Error fetching movies: {e}")
+            raise
 
+def movie_columns(fields=None):
+    """SELECT list for the requested movie fields (all of them by default)."""
+    if not fields:
+        return MOVIE_COLUMNS
+    unknown = [field for field in fields if field not in MOVIE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return ", ".join(f'"{field}"' for field in fields)
 
-def fetch_similar_movies(embedding, num_neighbors=5, metric='cosine'):
-    conn = get_db_connection()
-    try:
-        if metric == 'cosine':
-            embedding = normalize_query_embedding(embedding)
-            embedding_column = "embedding_normalized"
-            similarity_calc = f"1 - ({embedding_column} <=> %s::vector)"
-        elif metric == 'euclidean':
-            embedding_column = "embedding_original"
-            similarity_calc = f"-({embedding_column} <-> %s::vector)"
-        else:
-            raise ValueError("Metric must be either 'cosine' or 'euclidean'")
-        query = f"""
-            SELECT 
+def movies_stream_query(fields, filtered, keyset, limited):
+    """movies_page_query's filter and order with psycopg2 placeholders.
+
+    Server-side (named) cursors can't DECLARE over EXECUTE, so the stream
+    is a plain statement instead of a prepared one.
+    """
+    if filtered:
+        sort_key = "similarity(lower(title), lower(%(title)s))"
+        conditions = ["(lower(title) LIKE %(pattern)s OR lower(title) %% lower(%(title)s))"]
+    else:
+        sort_key, conditions = YEAR_SORT_KEY, []
+    if keyset:
+        conditions.append(f"({sort_key}, id) < (%(after_key)s, %(after_id)s)")
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+        SELECT {movie_columns(fields)}
+        FROM movies
+        {where_clause}
+        ORDER BY {sort_key} DESC, id DESC
+        OFFSET %(offset)s
+        {"LIMIT %(limit)s" if limited else ""}
+    """
+
+def stream_movies(title_filter="", fields=None, limit=None, offset=0, cursor=None):
+    """Every movie /movies would page through, as a lazily fetched row iterator.
+
+    Bad fields or cursors raise here rather than once streaming has begun.
+    The pooled connection is held until the iterator is exhausted or closed.
+    """
+    filtered = bool(title_filter)
+    query = movies_stream_query(fields, filtered, bool(cursor), limit is not None)
+    params = {"title": title_filter, "pattern": f"%{title_filter.lower()}%", "limit": limit, "offset": offset}
+    if cursor:
+        sort_key, params["after_id"] = decode_cursor(cursor)
+        params["after_key"] = sort_key if filtered else int(min(sort_key, MAX_INTEGER))
+    return _stream_rows(query, params, filtered)
+
+def _stream_rows(query, params, filtered):
+    with pooled_connection() as conn:
+        if filtered:
+            with conn.cursor() as setup:
+                setup.execute(
+                    "SELECT set_config('pg_trgm.similarity_threshold', %s, true);",
+                    [str(TITLE_SIMILARITY_THRESHOLD)]
+                )
+        with conn.cursor(name="movies_stream", cursor_factory=RealDictCursor) as db_cursor:
+            db_cursor.itersize = STREAM_ITERSIZE
+            db_cursor.execute(query, params)
+            yield from db_cursor
+
+
+def apply_search_settings(cursor, probes=None, exact=False):
+    """Scope ANN recall/latency settings to the current transaction."""
+    if exact:
+        # Disabling index scans forces an exact sequential scan + sort
+        cursor.execute("SET LOCAL enable_indexscan = off;")
+    elif probes is not None:
+        cursor.execute("SELECT set_config('ivfflat.probes', %s, true);", [str(int(probes))])
+
+def _knn_expressions(metric, vector="$1"):
+    """(column, similarity expression, index-friendly distance expression) for a k-NN search."""
+    if metric == 'cosine':
+        embedding_column = "embedding_normalized"
+        similarity_calc = f"1 - ({embedding_column} <=> {vector})"
+        # Both sides are unit length, so L2 order == cosine order and the
+        # default (vector_l2_ops) ivfflat index can serve the ORDER BY
+        distance_calc = f"{embedding_column} <-> {vector}"
+    elif metric == 'euclidean':
+        embedding_column = "embedding_original"
+        similarity_calc = f"-({embedding_column} <-> {vector})"
+        distance_calc = f"{embedding_column} <-> {vector}"
+    else:
+        raise ValueError("Metric must be either 'cosine' or 'euclidean'")
+    return embedding_column, similarity_calc, distance_calc
+
+def similar_movies_query(metric):
+    """SQL (with $1 vector, $2 limit) for a k-NN search using the given metric."""
+    embedding_column, similarity_calc, distance_calc = _knn_expressions(metric)
+    return f"""
+        SELECT 
+            title,
+            release_year,
+            plot_summary,
+            director,
+            origin_ethnicity,
+            genre,
+            "cast",
+            {similarity_calc} as similarity
+        FROM movies
+        WHERE {embedding_column} IS NOT NULL
+        ORDER BY {distance_calc}
+        LIMIT $2
+    """
+
+def similar_movies_batch_query(metric):
+    """SQL (with $1 vector[], $2 integer[] limits) running one k-NN search per array element.
+
+    Each query vector drives its own index-ordered LATERAL scan; rows come
+    back tagged with the 1-based position of their query.
+    """
+    embedding_column, similarity_calc, distance_calc = _knn_expressions(metric, vector="q.embedding")
+    return f"""
+        SELECT
+            q.query_index,
+            m.title,
+            m.release_year,
+            m.plot_summary,
+            m.director,
+            m.origin_ethnicity,
+            m.genre,
+            m."cast",
+            m.similarity
+        FROM unnest($1, $2) WITH ORDINALITY AS q(embedding, k, query_index)
+        CROSS JOIN LATERAL (
+            SELECT
                 title,
                 release_year,
                 plot_summary,
@@ -118,93 +449,745 @@ def fetch_similar_movies(embedding, num_neighbors=5, metric='cosine'):
                 origin_ethnicity,
                 genre,
                 "cast",
-                {similarity_calc} as similarity
+                {similarity_calc} AS similarity,
+                {distance_calc} AS distance
             FROM movies
             WHERE {embedding_column} IS NOT NULL
-            ORDER BY similarity DESC
-            LIMIT %s;
-        """
+            ORDER BY {distance_calc}
+            LIMIT q.k
+        ) m
+        ORDER BY q.query_index, m.distance
+    """
+
+def format_vector_array_for_postgres(embeddings):
+    """Postgres array literal of vectors, e.g. '{"[1,2]","[3,4]"}', for a vector[] parameter."""
+    return "{" + ",".join(f'"{format_vector_for_postgres(embedding)}"' for embedding in embeddings) + "}"
+
+# Cosine searches can take a first pass over the PCA-compact column and
+# re-rank the over-fetched candidates exactly on embedding_normalized
+COMPACT_SEARCH = os.getenv("COMPACT_SEARCH", "false").lower() == "true"
+COMPACT_OVERFETCH = int(os.getenv("COMPACT_OVERFETCH", "10"))
+PROJECTION_TTL = float(os.getenv("PROJECTION_TTL", "60"))
+projection_cache = LRUCache(maxsize=1, ttl=PROJECTION_TTL)
+
+def get_projection():
+    """Projection of the live table, re-read at most every PROJECTION_TTL seconds (None if absent)."""
+    projection = projection_cache.get("movies")
+    if projection is None:
+        with pooled_connection() as conn:
+            with conn.cursor() as cursor:
+                projection = load_projection(cursor, "movies")
+        if projection is not None:
+            projection_cache.set("movies", projection)
+    return projection
+
+# $1 compact query vector, $2 full query vector, $3 candidate count, $4 limit
+COMPACT_SIMILAR_MOVIES_QUERY = """
+    WITH candidates AS (
+        SELECT id
+        FROM movies
+        WHERE embedding_compact IS NOT NULL
+        ORDER BY embedding_compact <-> $1
+        LIMIT $3
+    )
+    SELECT
+        m.title,
+        m.release_year,
+        m.plot_summary,
+        m.director,
+        m.origin_ethnicity,
+        m.genre,
+        m."cast",
+        1 - (m.embedding_normalized <=> $2) AS similarity
+    FROM candidates c
+    JOIN movies m ON m.id = c.id
+    ORDER BY m.embedding_normalized <-> $2
+    LIMIT $4
+"""
+
+MOVIES_BY_ID_QUERY = """
+    SELECT 
+        id,
+        title,
+        release_year,
+        plot_summary,
+        director,
+        origin_ethnicity,
+        genre,
+        "cast"
+    FROM movies
+    WHERE id = ANY($1)
+"""
+
+def fetch_movies_by_ids(ids):
+    """Metadata rows for the given ids, returned in the order of ids."""
+    with pooled_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor, span("db_query"):
+            execute_prepared(cursor, "movies_by_id", MOVIES_BY_ID_QUERY, ([int(i) for i in ids],), ("integer[]",))
+            rows = {row["id"]: row for row in cursor.fetchall()}
+    return [rows[i] for i in ids if i in rows]
+
+def _numpy_results(ids, similarities, rows):
+    results = []
+    for movie_id, similarity in zip(ids.tolist(), similarities.tolist()):
+        row = rows.get(movie_id)
+        if row is None:
+            continue
+        row = dict(row)
+        row.pop("id")
+        row["similarity"] = similarity
+        results.append(row)
+    return results
+
+def _fetch_similar_movies_numpy(embedding, num_neighbors, metric):
+    with span("vector_index_search"):
+        ids, similarities = vector_index.get_index().search(embedding, num_neighbors, metric)
+    rows = {row["id"]: row for row in fetch_movies_by_ids(ids.tolist())}
+    return _numpy_results(ids, similarities, rows)
+
+def _fetch_similar_movies_compact(embedding, projection, num_neighbors, probes):
+    candidates = max(num_neighbors * COMPACT_OVERFETCH, num_neighbors)
+    with pooled_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, [embedding.tolist(), num_neighbors])
-            return cursor.fetchall()
-    finally:
-        conn.close()
+            with span("db_query"):
+                apply_search_settings(cursor, probes=probes)
+                execute_prepared(
+                    cursor, "similar_compact", COMPACT_SIMILAR_MOVIES_QUERY,
+                    (
+                        format_vector_for_postgres(projection.apply(embedding)),
+                        format_vector_for_postgres(embedding),
+                        candidates,
+                        num_neighbors,
+                    ),
+                    ("vector", "vector", "integer", "integer")
+                )
+                return cursor.fetchall()
 
-def search_movies_hybrid(embedding, text_query="", num_neighbors=5, metric='cosine', 
-                        use_normalized=True, embedding_weight=0.7, min_similarity=0.0):
-    """Search movies using both embedding similarity and text matching."""
-    if not 0 <= embedding_weight <= 1:
-        raise ValueError("embedding_weight must be between 0 and 1")
-    conn = get_db_connection()
-    try:
-        embedding_to_use = normalize_query_embedding(embedding) if metric == 'cosine' else embedding
-        pg_vector = format_vector_for_postgres(embedding_to_use)
-        embedding_column = "embedding_normalized" if use_normalized else "embedding_original"
-        if metric == 'cosine':
-            similarity_calc = f"1 - ({embedding_column} <=> '{pg_vector}'::vector)"
-        else:
-            similarity_calc = f"exp(-0.1 * ({embedding_column} <-> '{pg_vector}'::vector))"
-        text_match = """
-            to_tsvector('english', coalesce(title, '') || ' ' || coalesce(plot_summary, ''))
-        """
-        query = f"""
-            WITH similarity_scores AS (
-                SELECT 
-                    *,
-                    {similarity_calc} as embedding_similarity,
-                    CASE 
-                        WHEN %s != '' THEN 
-                            ts_rank_cd(
-                                {text_match},
-                                plainto_tsquery('english', %s)
-                            )
-                        ELSE 0
-                    END as text_similarity
-                FROM movies
-                WHERE {embedding_column} IS NOT NULL
-                AND CASE 
-                    WHEN %s != '' THEN 
-                        {text_match} @@ plainto_tsquery('english', %s)
-                    ELSE TRUE
-                END
+# Readers re-check the corpus generation at most every CORPUS_GENERATION_TTL
+# seconds, so results cached before an ingest are served for at most that long
+CORPUS_GENERATION_TTL = float(os.getenv("CORPUS_GENERATION_TTL", "5"))
+corpus_generation_cache = LRUCache(maxsize=1, ttl=CORPUS_GENERATION_TTL)
+result_cache = create_result_cache()
+
+def get_corpus_generation():
+    generation = corpus_generation_cache.get("movies")
+    if generation is None:
+        with pooled_connection() as conn:
+            with conn.cursor() as cursor:
+                generation = read_generation(cursor)
+        corpus_generation_cache.set("movies", generation)
+    return generation
+
+def cached_results(kind, embedding, params, search):
+    """search() through result_cache, keyed on the query vector and params."""
+    if result_cache is None:
+        return search()
+    generation = get_corpus_generation()
+    key = result_key(kind, embedding, params)
+    rows = result_cache.get(key, generation)
+    if rows is None:
+        rows = search()
+        result_cache.set(key, generation, rows)
+    return rows
+
+def cached_batch_results(kind, queries, params_of, search_many):
+    """search_many() over only the queries result_cache can't answer, in order."""
+    if result_cache is None:
+        return search_many(queries)
+    generation = get_corpus_generation()
+    keys = [result_key(kind, query["embedding"], params_of(query)) for query in queries]
+    results = [result_cache.get(key, generation) for key in keys]
+    missing = [position for position, rows in enumerate(results) if rows is None]
+    if missing:
+        for position, rows in zip(missing, search_many([queries[i] for i in missing])):
+            result_cache.set(keys[position], generation, rows)
+            results[position] = rows
+    return results
+
+def _similar_params(num_neighbors, metric, probes, exact, compact, filters=None):
+    return {
+        "backend": vector_index.VECTOR_BACKEND,
+        "num_neighbors": int(num_neighbors),
+        "metric": metric,
+        "probes": probes,
+        "exact": bool(exact),
+        "compact": COMPACT_SEARCH if compact is None else bool(compact),
+        "filters": filters,
+    }
+
+def fetch_similar_movies(embedding, num_neighbors=5, metric='cosine', probes=None, exact=False, compact=None,
+                         filters=None):
+    """k-NN search; filters (see filters.parse_filters) restrict which movies qualify."""
+    return cached_results(
+        "similar", embedding, _similar_params(num_neighbors, metric, probes, exact, compact, filters),
+        lambda: _fetch_similar_movies(embedding, num_neighbors, metric, probes, exact, compact, filters)
+    )
+
+# Filtered k-NN planning. Filters the planner expects to match at most
+# FILTER_EXACT_ROWS rows are answered exactly over that subset, found
+# through the filter indexes. Otherwise the ANN index is over-fetched
+# (k / selectivity candidates, at FILTER_PROBES or more probes) and
+# post-filtered, growing the fetch until k rows pass or FILTER_MAX_FETCH
+# is reached, at which point the exact subset search takes over.
+FILTER_EXACT_ROWS = int(os.getenv("FILTER_EXACT_ROWS", "5000"))
+FILTER_MAX_FETCH = int(os.getenv("FILTER_MAX_FETCH", "10000"))
+FILTER_PROBES = int(os.getenv("FILTER_PROBES", "10"))
+FILTER_FETCH_GROWTH = 4
+filter_estimate_cache = LRUCache(maxsize=1024, ttl=MOVIES_COUNT_TTL)
+
+def estimate_filtered_rows(cursor, filters):
+    """(planner estimate of movies matching filters, estimated table size), cached."""
+    key = tuple(sorted((name, str(value)) for name, value in filters.items()))
+    estimate = filter_estimate_cache.get(key)
+    if estimate is None:
+        condition, params, _ = filter_clause(filters)
+        cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT id FROM movies WHERE {condition}", params)
+        matching = cursor.fetchone()["QUERY PLAN"][0]["Plan"]["Plan Rows"]
+        cursor.execute("SELECT reltuples::bigint AS total FROM pg_class WHERE oid = 'movies'::regclass;")
+        estimate = (matching, max(cursor.fetchone()["total"], 1))
+        filter_estimate_cache.set(key, estimate)
+    return estimate
+
+def filtered_exact_query(metric, condition):
+    """Exact k-NN over the rows matching condition ($1 vector, $2 limit, filter params from $3).
+
+    The MATERIALIZED subset keeps the ANN index out of it: the filter
+    indexes find the rows and only those are sorted by distance.
+    """
+    embedding_column, similarity_calc, distance_calc = _knn_expressions(metric)
+    return f"""
+        WITH matching AS MATERIALIZED (
+            SELECT {MOVIE_COLUMNS}, {embedding_column}
+            FROM movies
+            WHERE {embedding_column} IS NOT NULL AND {condition}
+        )
+        SELECT
+            title,
+            release_year,
+            plot_summary,
+            director,
+            origin_ethnicity,
+            genre,
+            "cast",
+            {similarity_calc} as similarity
+        FROM matching
+        ORDER BY {distance_calc}
+        LIMIT $2
+    """
+
+def filtered_ann_query(metric, condition):
+    """ANN top-$3 candidates post-filtered to $2 results ($1 vector, filter params from $4)."""
+    embedding_column, similarity_calc, distance_calc = _knn_expressions(metric)
+    return f"""
+        SELECT
+            title,
+            release_year,
+            plot_summary,
+            director,
+            origin_ethnicity,
+            genre,
+            "cast",
+            {similarity_calc} as similarity
+        FROM (
+            SELECT *
+            FROM movies
+            WHERE {embedding_column} IS NOT NULL
+            ORDER BY {distance_calc}
+            LIMIT $3
+        ) candidates
+        WHERE {condition}
+        ORDER BY {distance_calc}
+        LIMIT $2
+    """
+
+def _fetch_similar_movies_filtered(embedding, filters, num_neighbors, metric, probes, exact):
+    if metric == 'cosine':
+        embedding = normalize_query_embedding(embedding)
+    vector = format_vector_for_postgres(embedding)
+    shape = filter_shape(filters)
+    with pooled_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            with span("db_query"):
+                matching, total = estimate_filtered_rows(cursor, filters)
+                if not exact and matching > FILTER_EXACT_ROWS:
+                    condition, params, types = filter_clause(filters, first_param=4)
+                    selectivity = matching / total
+                    fetch = min(FILTER_MAX_FETCH, max(2 * num_neighbors, int(2 * num_neighbors / selectivity)))
+                    probes = max(probes or 0, FILTER_PROBES)
+                    while True:
+                        apply_search_settings(cursor, probes=probes)
+                        execute_prepared(
+                            cursor, f"filtered_ann_{metric}_{shape}", filtered_ann_query(metric, condition),
+                            [vector, num_neighbors, fetch] + params, ["vector", "integer", "integer"] + types
+                        )
+                        rows = cursor.fetchall()
+                        if len(rows) >= num_neighbors:
+                            return rows
+                        if fetch >= FILTER_MAX_FETCH:
+                            break
+                        # More candidates need more lists scanned to exist at all
+                        fetch = min(FILTER_MAX_FETCH, fetch * FILTER_FETCH_GROWTH)
+                        probes *= FILTER_FETCH_GROWTH
+                condition, params, types = filter_clause(filters, first_param=3)
+                execute_prepared(
+                    cursor, f"filtered_exact_{metric}_{shape}", filtered_exact_query(metric, condition),
+                    [vector, num_neighbors] + params, ["vector", "integer"] + types
+                )
+                return cursor.fetchall()
+
+def _fetch_similar_movies(embedding, num_neighbors, metric, probes, exact, compact, filters=None):
+    if filters:
+        # Filters always run in Postgres, at full precision, whatever the backend
+        return _fetch_similar_movies_filtered(embedding, filters, num_neighbors, metric, probes, exact)
+    if vector_index.VECTOR_BACKEND == 'numpy':
+        # Always exact; probes/exact only tune the Postgres ANN path
+        return _fetch_similar_movies_numpy(embedding, num_neighbors, metric)
+    query = similar_movies_query(metric)
+    if metric == 'cosine':
+        embedding = normalize_query_embedding(embedding)
+        # The projection is fitted on unit vectors, so only cosine gets the compact pass
+        if (COMPACT_SEARCH if compact is None else compact) and not exact:
+            projection = get_projection()
+            if projection is not None:
+                return _fetch_similar_movies_compact(embedding, projection, num_neighbors, probes)
+    with pooled_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            with span("db_query"):
+                apply_search_settings(cursor, probes=probes, exact=exact)
+                execute_prepared(
+                    cursor, f"similar_{metric}", query,
+                    (format_vector_for_postgres(embedding), num_neighbors),
+                    ("vector", "integer")
+                )
+                return cursor.fetchall()
+
+def _group_queries(queries, key):
+    groups = {}
+    for position, query in enumerate(queries):
+        groups.setdefault(key(query), []).append(position)
+    return groups
+
+def _fetch_similar_movies_batch_numpy(queries):
+    index = vector_index.get_index()
+    hits = [None] * len(queries)
+    for metric, positions in _group_queries(queries, lambda q: q.get("metric", "cosine")).items():
+        with span("vector_index_search"):
+            group = index.search_many(
+                [queries[i]["embedding"] for i in positions],
+                [queries[i].get("num_neighbors", 5) for i in positions],
+                metric
+            )
+        for position, hit in zip(positions, group):
+            hits[position] = hit
+    # One metadata lookup for every neighbor of every query
+    ids = list({movie_id for hit_ids, _ in hits for movie_id in hit_ids.tolist()})
+    rows = {row["id"]: row for row in fetch_movies_by_ids(ids)}
+    return [_numpy_results(hit_ids, similarities, rows) for hit_ids, similarities in hits]
+
+def fetch_similar_movies_batch(queries):
+    """Run many k-NN searches at once; returns one result list per query, in order.
+
+    Each query is a dict with an embedding and optional num_neighbors, metric,
+    probes, exact and filters (the fetch_similar_movies arguments). Unfiltered
+    queries sharing a metric and search settings are answered by a single SQL
+    statement.
+    """
+    for query in queries:
+        if query.get("metric", "cosine") not in ('cosine', 'euclidean'):
+            raise ValueError("Metric must be either 'cosine' or 'euclidean'")
+    return cached_batch_results(
+        "similar", queries,
+        # Batches never take the compact pass, so they share entries with compact=False searches
+        lambda q: _similar_params(q.get("num_neighbors", 5), q.get("metric", "cosine"), q.get("probes"), q.get("exact", False), False, q.get("filters")),
+        _fetch_similar_movies_batch
+    )
+
+def _fetch_similar_movies_batch(queries):
+    filtered = [position for position, query in enumerate(queries) if query.get("filters")]
+    if filtered:
+        # Filtered queries each get their own plan; the rest still share statements
+        results = [None] * len(queries)
+        for position in filtered:
+            query = queries[position]
+            results[position] = _fetch_similar_movies_filtered(
+                query["embedding"], query["filters"], query.get("num_neighbors", 5),
+                query.get("metric", "cosine"), query.get("probes"), query.get("exact", False)
             )
+        rest = [position for position, query in enumerate(queries) if not query.get("filters")]
+        if rest:
+            for position, rows in zip(rest, _fetch_similar_movies_batch([queries[i] for i in rest])):
+                results[position] = rows
+        return results
+    if vector_index.VECTOR_BACKEND == 'numpy':
+        return _fetch_similar_movies_batch_numpy(queries)
+    results = [[] for _ in queries]
+    groups = _group_queries(
+        queries, lambda q: (q.get("metric", "cosine"), q.get("probes"), bool(q.get("exact", False)))
+    )
+    with pooled_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            for (metric, probes, exact), positions in groups.items():
+                embeddings = [queries[i]["embedding"] for i in positions]
+                if metric == 'cosine':
+                    embeddings = [normalize_query_embedding(embedding) for embedding in embeddings]
+                with span("db_query"):
+                    apply_search_settings(cursor, probes=probes, exact=exact)
+                    execute_prepared(
+                        cursor, f"similar_batch_{metric}", similar_movies_batch_query(metric),
+                        (format_vector_array_for_postgres(embeddings), [int(queries[i].get("num_neighbors", 5)) for i in positions]),
+                        ("vector[]", "integer[]")
+                    )
+                    rows = cursor.fetchall()
+                for row in rows:
+                    results[positions[row.pop("query_index") - 1]].append(row)
+                # End the transaction so SET LOCAL settings don't leak into the next group
+                conn.commit()
+    return results
+
+# $1 movie id, $2 limit. Lists computed for an older corpus generation name
+# ids that may since have been reassigned, so they match nothing until
+# neighbors.py runs again
+PRECOMPUTED_NEIGHBORS_QUERY = """
+    SELECT
+        m.id,
+        m.title,
+        m.release_year,
+        m.plot_summary,
+        m.director,
+        m.origin_ethnicity,
+        m.genre,
+        m."cast",
+        n.similarity
+    FROM movie_neighbors n
+    JOIN movies m ON m.id = n.neighbor_id
+    WHERE n.movie_id = $1
+    AND n.rank <= $2
+    AND EXISTS (
+        SELECT 1
+        FROM movie_neighbors_state s
+        JOIN corpus_generation g ON g.generation = s.generation
+    )
+    ORDER BY n.rank
+"""
+
+MOVIE_HAS_EMBEDDING_QUERY = "SELECT embedding_normalized IS NOT NULL AS has_embedding FROM movies WHERE id = $1"
+
+# $1 movie id, $2 limit; the scalar subquery runs once, so the ivfflat index
+# can serve the ORDER BY like it does for a query vector
+LIVE_NEIGHBORS_QUERY = """
+    SELECT
+        id,
+        title,
+        release_year,
+        plot_summary,
+        director,
+        origin_ethnicity,
+        genre,
+        "cast",
+        1 - (embedding_normalized <=> (SELECT embedding_normalized FROM movies WHERE id = $1)) AS similarity
+    FROM movies
+    WHERE embedding_normalized IS NOT NULL AND id <> $1
+    ORDER BY embedding_normalized <-> (SELECT embedding_normalized FROM movies WHERE id = $1)
+    LIMIT $2
+"""
+
+neighbors_table_cache = LRUCache(maxsize=1, ttl=CORPUS_GENERATION_TTL)
+
+def _neighbors_table_exists(cursor):
+    exists = neighbors_table_cache.get("movie_neighbors")
+    if exists is None:
+        cursor.execute("SELECT to_regclass('movie_neighbors_state') IS NOT NULL AS exists;")
+        exists = cursor.fetchone()["exists"]
+        neighbors_table_cache.set("movie_neighbors", exists)
+    return exists
+
+def fetch_similar_to_movie(movie_id, num_neighbors=10, probes=None):
+    """Cosine neighbors of a stored movie, best first; None if there is no such movie.
+
+    Served from the precomputed movie_neighbors lists when they are current
+    and long enough, otherwise by an ANN search on the movie's stored vector.
+    No query embedding is computed either way.
+    """
+    with pooled_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            with span("db_query"):
+                if _neighbors_table_exists(cursor):
+                    execute_prepared(
+                        cursor, "movie_neighbors", PRECOMPUTED_NEIGHBORS_QUERY,
+                        (movie_id, num_neighbors), ("integer", "integer")
+                    )
+                    rows = cursor.fetchall()
+                    if len(rows) >= num_neighbors:
+                        return rows
+                execute_prepared(cursor, "movie_has_embedding", MOVIE_HAS_EMBEDDING_QUERY, (movie_id,), ("integer",))
+                source = cursor.fetchone()
+                if source is None:
+                    return None
+                if not source["has_embedding"]:
+                    return []
+                apply_search_settings(cursor, probes=probes)
+                execute_prepared(
+                    cursor, "movie_neighbors_live", LIVE_NEIGHBORS_QUERY,
+                    (movie_id, num_neighbors), ("integer", "integer")
+                )
+                return cursor.fetchall()
+
+FUSION_METHODS = ('weighted', 'rrf')
+# Standard reciprocal-rank-fusion damping constant
+RRF_K = 60
+DEFAULT_CANDIDATE_K = int(os.getenv("HYBRID_CANDIDATE_K", "100"))
+
+def _embedding_scoring(metric, embedding_column, alias=""):
+    """(similarity expression, index-friendly distance expression) for $1."""
+    column = f"{alias}{embedding_column}"
+    if metric == 'cosine':
+        similarity_calc = f"1 - ({column} <=> $1)"
+        # L2 order equals cosine order on unit vectors, which the ivfflat
+        # (vector_l2_ops) index can serve; raw vectors need <=> itself
+        distance_calc = f"{column} <-> $1" if embedding_column == "embedding_normalized" else f"{column} <=> $1"
+    else:
+        similarity_calc = f"exp(-0.1 * ({column} <-> $1))"
+        distance_calc = f"{column} <-> $1"
+    return similarity_calc, distance_calc
+
+def hybrid_search_query(metric, embedding_column, condition="TRUE"):
+    """SQL (with $1 vector, $2 text query, $3 weight, $4 min score, $5 limit) for hybrid search.
+
+    condition (see filters.filter_clause) takes its parameters from $6.
+    """
+    similarity_calc, _ = _embedding_scoring(metric, embedding_column)
+    return f"""
+        WITH similarity_scores AS (
             SELECT 
-                title,
-                release_year,
-                plot_summary,
-                director,
-                origin_ethnicity,
-                genre,
-                "cast",
-                embedding_similarity,
-                text_similarity,
-                (%s * embedding_similarity + (1 - %s) * NULLIF(text_similarity, 0)) as combined_similarity
-            FROM similarity_scores
-            WHERE (%s * embedding_similarity + (1 - %s) * NULLIF(text_similarity, 0)) >= %s
-            ORDER BY combined_similarity DESC NULLS LAST
-            LIMIT %s;
+                *,
+                {similarity_calc} as embedding_similarity,
+                CASE 
+                    WHEN $2 != '' THEN 
+                        ts_rank_cd(
+                            document,
+                            plainto_tsquery('english', $2)
+                        )
+                    ELSE 0
+                END as text_similarity
+            FROM movies
+            WHERE {embedding_column} IS NOT NULL
+            AND {condition}
+            AND CASE 
+                WHEN $2 != '' THEN 
+                    document @@ plainto_tsquery('english', $2)
+                ELSE TRUE
+            END
+        )
+        SELECT 
+            title,
+            release_year,
+            plot_summary,
+            director,
+            origin_ethnicity,
+            genre,
+            "cast",
+            embedding_similarity,
+            text_similarity,
+            ($3 * embedding_similarity + (1 - $3) * NULLIF(text_similarity, 0)) as combined_similarity
+        FROM similarity_scores
+        WHERE ($3 * embedding_similarity + (1 - $3) * NULLIF(text_similarity, 0)) >= $4
+        ORDER BY combined_similarity DESC NULLS LAST
+        LIMIT $5
+    """
+
+def hybrid_candidates_query(metric, embedding_column, fusion, condition="TRUE"):
+    """Two-stage hybrid SQL: ANN top-K and full-text top-K ($6) fused by weight or RRF.
+
+    Same parameters as hybrid_search_query plus $6, the per-source candidate count,
+    with condition's parameters from $7. Candidates from either source are
+    rescored exactly on both signals.
+    """
+    similarity_calc, distance_calc = _embedding_scoring(metric, embedding_column)
+    m_similarity_calc, _ = _embedding_scoring(metric, embedding_column, alias="m.")
+    if fusion == 'rrf':
+        combined = f"""
+            COALESCE($3 / ({RRF_K} + c.vector_rank), 0)
+            + COALESCE((1 - $3) / ({RRF_K} + c.text_rank), 0)
         """
-        params = [
-            text_query,                # For CASE WHEN check
-            text_query,                # For plainto_tsquery in ts_rank_cd
-            text_query,                # For CASE WHEN in WHERE clause
-            text_query,                # For plainto_tsquery in WHERE clause
-            embedding_weight,          # For similarity calculation
-            embedding_weight,          # For similarity calculation (1 - weight)
-            embedding_weight,          # For WHERE clause
-            embedding_weight,          # For WHERE clause (1 - weight)
-            min_similarity,            # For minimum similarity threshold
-            num_neighbors             # For LIMIT
-        ]
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, params)
-            return cursor.fetchall()
-    except Exception as e:
-        print(f"Error in hybrid search: {e}")
-        raise
-    finally:
-        conn.close()
+    else:
+        combined = "$3 * embedding_similarity + (1 - $3) * text_similarity"
+    return f"""
+        WITH query AS (
+            SELECT plainto_tsquery('english', $2) AS q
+        ),
+        vector_candidates AS (
+            SELECT id, row_number() OVER (ORDER BY distance) AS vector_rank
+            FROM (
+                SELECT id, {distance_calc} AS distance
+                FROM movies
+                WHERE {embedding_column} IS NOT NULL AND {condition}
+                ORDER BY {distance_calc}
+                LIMIT $6
+            ) v
+        ),
+        text_candidates AS (
+            SELECT id, row_number() OVER (ORDER BY rank DESC) AS text_rank
+            FROM (
+                SELECT id, ts_rank_cd(document, query.q) AS rank
+                FROM movies, query
+                WHERE $2 != '' AND document @@ query.q AND {condition}
+                ORDER BY rank DESC
+                LIMIT $6
+            ) t
+        ),
+        candidates AS (
+            SELECT
+                COALESCE(v.id, t.id) AS id,
+                v.vector_rank,
+                t.text_rank
+            FROM vector_candidates v
+            FULL OUTER JOIN text_candidates t ON v.id = t.id
+        ),
+        scored AS (
+            SELECT
+                m.title,
+                m.release_year,
+                m.plot_summary,
+                m.director,
+                m.origin_ethnicity,
+                m.genre,
+                m."cast",
+                c.vector_rank,
+                c.text_rank,
+                {m_similarity_calc} AS embedding_similarity,
+                CASE WHEN m.document @@ query.q THEN ts_rank_cd(m.document, query.q) ELSE 0 END AS text_similarity
+            FROM candidates c
+            JOIN movies m ON m.id = c.id
+            CROSS JOIN query
+        )
+        SELECT
+            title,
+            release_year,
+            plot_summary,
+            director,
+            origin_ethnicity,
+            genre,
+            "cast",
+            embedding_similarity,
+            text_similarity,
+            ({combined}) AS combined_similarity
+        FROM scored c
+        WHERE ({combined}) >= $4
+        ORDER BY combined_similarity DESC
+        LIMIT $5
+    """
+
+def _search_movies_hybrid(cursor, embedding, text_query="", num_neighbors=5, metric='cosine',
+                          use_normalized=True, embedding_weight=0.7, min_similarity=0.0,
+                          fusion=None, candidate_k=None, probes=None, exact=False, filters=None):
+    if not 0 <= embedding_weight <= 1:
+        raise ValueError("embedding_weight must be between 0 and 1")
+    if fusion is not None and fusion not in FUSION_METHODS:
+        raise ValueError(f"fusion must be one of {', '.join(FUSION_METHODS)}")
+    embedding_to_use = normalize_query_embedding(embedding) if metric == 'cosine' else embedding
+    pg_vector = format_vector_for_postgres(embedding_to_use)
+    embedding_column = "embedding_normalized" if use_normalized else "embedding_original"
+    metric_name = 'cosine' if metric == 'cosine' else 'euclidean'
+    params = [
+        pg_vector,                 # $1 query embedding
+        text_query,                # $2 full-text query
+        embedding_weight,          # $3 embedding weight (1 - weight for text)
+        min_similarity,            # $4 minimum combined similarity
+        num_neighbors              # $5 LIMIT
+    ]
+    types = ["vector", "text", "float8", "float8", "integer"]
+    shape = f"_{filter_shape(filters)}" if filters else ""
+    candidate_k = max(candidate_k or DEFAULT_CANDIDATE_K, num_neighbors)
+    if filters and fusion is not None:
+        matching, total = estimate_filtered_rows(cursor, filters)
+        if matching <= FILTER_EXACT_ROWS:
+            # Scoring every matching row exactly is cheaper than fusing
+            # candidates the filter would mostly throw away
+            fusion = None
+        else:
+            # The ANN scan post-filters, so widen it by the filter's selectivity
+            candidate_k = min(FILTER_MAX_FETCH, max(candidate_k, int(candidate_k * total / matching)))
+            probes = max(probes or 0, FILTER_PROBES)
+    if fusion is None:
+        condition, filter_params, filter_types = filter_clause(filters or {}, first_param=6)
+        name = f"hybrid_{metric_name}_{embedding_column}{shape}"
+        query = hybrid_search_query(metric_name, embedding_column, condition)
+    else:
+        apply_search_settings(cursor, probes=probes, exact=exact)
+        condition, filter_params, filter_types = filter_clause(filters or {}, first_param=7)
+        name = f"hybrid_{fusion}_{metric_name}_{embedding_column}{shape}"
+        query = hybrid_candidates_query(metric_name, embedding_column, fusion, condition)
+        params.append(candidate_k)  # $6
+        types.append("integer")
+    params += filter_params
+    types += filter_types
+    with span("db_query"):
+        execute_prepared(cursor, name, query, params, types)
+        return cursor.fetchall()
 
+def search_movies_hybrid(embedding, text_query="", num_neighbors=5, metric='cosine', 
+                        use_normalized=True, embedding_weight=0.7, min_similarity=0.0,
+                        fusion=None, candidate_k=None, probes=None, exact=False, filters=None):
+    """Search movies using both embedding similarity and text matching.
+
+    With fusion=None every row is scored (exact, slow). With fusion='weighted'
+    or 'rrf', the ANN and full-text indexes each contribute candidate_k
+    candidates, which are then fused by weighted score or reciprocal rank.
+    filters restrict both sources; a selective filter scores its matches exactly.
+    """
+    params = _hybrid_params(
+        text_query, num_neighbors, metric, use_normalized, embedding_weight,
+        min_similarity, fusion, candidate_k, probes, exact, filters
+    )
+    return cached_results("hybrid", embedding, params, lambda: _search_movies_hybrid_pooled(embedding, **params))
+
+def _hybrid_params(text_query="", num_neighbors=5, metric='cosine', use_normalized=True, embedding_weight=0.7,
+                   min_similarity=0.0, fusion=None, candidate_k=None, probes=None, exact=False, filters=None):
+    return {
+        "text_query": text_query,
+        "num_neighbors": num_neighbors,
+        "metric": metric,
+        "use_normalized": use_normalized,
+        "embedding_weight": embedding_weight,
+        "min_similarity": min_similarity,
+        "fusion": fusion,
+        "candidate_k": candidate_k,
+        "probes": probes,
+        "exact": exact,
+        "filters": filters,
+    }
+
+def _search_movies_hybrid_pooled(embedding, **params):
+    with pooled_connection() as conn:
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                return _search_movies_hybrid(cursor, embedding, **params)
+        except Exception as e:
+            print(f"Error in hybrid search: {e}")
+            raise
+
+def search_movies_hybrid_batch(queries):
+    """Run many hybrid searches over one pooled connection; one result list per query.
+
+    Each query is a dict of search_movies_hybrid keyword arguments. The
+    prepared statements are reused across the batch, so only the per-query
+    execution round trip remains.
+    """
+    return cached_batch_results(
+        "hybrid", queries,
+        lambda q: _hybrid_params(**{key: value for key, value in q.items() if key != "embedding"}),
+        _search_movies_hybrid_batch
+    )
+
+def _search_movies_hybrid_batch(queries):
+    results = []
+    with pooled_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            for query in queries:
+                results.append(_search_movies_hybrid(cursor, **query))
+                # Each query gets its own transaction for its SET LOCAL settings
+                conn.commit()
+    return results
 
 if __name__ == "__main__":
     example_embedding = [0.1, 0.2, 0.3, 0.4]  # truncated for brevity
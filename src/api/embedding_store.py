@@ -0,0 +1,134 @@
+# embedding_store.py
+# Content-addressed store of document embeddings in a single SQLite file.
+# A vector is filed under hash(model, max_length, pooling, text), so any
+# build that embeds the same text the same way - a re-run, a corpus with
+# different filters, a shard on another process - reuses it instead of
+# running the model again.
+#   python embedding_store.py --stats
+#   python embedding_store.py --import ./data/artifacts/<model>   # seed from old chunks
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+import numpy as np
+import artifacts
+
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "/app/data/embedding_store.sqlite3")
+# Keys per SELECT ... IN (...) lookup, below SQLite's bound-parameter limit
+LOOKUP_BATCH = 500
+
+
+def model_identity(model_name, quantize="", dtype="float32"):
+    """Model name as it shapes the vectors: other weight dtypes and int8 output are filed separately.
+
+    float32 keeps the bare name, so vectors stored before the dtype was part
+    of the key stay reachable.
+    """
+    identity = model_name if dtype == "float32" else f"{model_name}@{dtype}"
+    return f"{identity}+{quantize}" if quantize else identity
+
+def store_key(model, max_length, pooling, text):
+    return hashlib.sha256(f"{model}\0{max_length}\0{pooling}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """float32 vectors by content key; safe to share between processes (WAL mode)."""
+
+    def __init__(self, path=EMBEDDING_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """key -> vector for every key already stored."""
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[start:start + LOOKUP_BATCH]
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))});", batch
+            )
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype="<f4")
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs; keys already present are left as they are."""
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (key, dim, vector) VALUES (?, ?, ?);",
+            [
+                (key, len(vector), np.asarray(vector, dtype="<f4").tobytes())
+                for key, vector in items
+            ]
+        )
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings;").fetchone()[0]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "vectors": len(self),
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+def import_chunks(store, chunk_dir, model, max_length, pooling, text_field="PlotSummary"):
+    """File every vector in chunk_dir under the given model settings; returns rows imported."""
+    imported = 0
+    for path in artifacts.list_chunks(chunk_dir):
+        records, embeddings = artifacts.read_chunk(path)
+        items = [
+            (store_key(model, max_length, pooling, str(record.get(text_field))), embedding)
+            for record, embedding in zip(records, embeddings)
+            if embedding is not None
+        ]
+        store.put_many(items)
+        imported += len(items)
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or seed the content-addressed embedding store.")
+    parser.add_argument("--path", default=EMBEDDING_STORE_PATH, help="SQLite file holding the store.")
+    parser.add_argument("--stats", action="store_true", help="Print the store's size.")
+    parser.add_argument("--import", dest="import_dir", help="Add the vectors from the chunk files in this directory.")
+    parser.add_argument("--model", default=model_identity(
+                            os.getenv("EMBEDDING_MODEL"), os.getenv("EMBEDDING_QUANTIZE", "").lower(),
+                            os.getenv("MODEL_DTYPE", "float32")
+                        ),
+                        help="Model identity the imported chunks were embedded with "
+                             "(default: EMBEDDING_MODEL with MODEL_DTYPE and EMBEDDING_QUANTIZE).")
+    parser.add_argument("--max-length", type=int, default=512, help="max_length the imported chunks were embedded with.")
+    parser.add_argument("--pooling", default="mean", help="Pooling the imported chunks were embedded with.")
+    args = parser.parse_args()
+    store = EmbeddingStore(args.path)
+    if args.import_dir:
+        count = import_chunks(store, args.import_dir, args.model, args.max_length, args.pooling)
+        print(f"Imported {count} vectors for {args.model} from {args.import_dir}")
+    if args.stats or not args.import_dir:
+        print(json.dumps(store.stats(), indent=2))
+    store.close()
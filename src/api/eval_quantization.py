@@ -0,0 +1,84 @@
+# eval_quantization.py
+# Measures what EMBEDDING_QUANTIZE=int8 costs in search quality and buys in
+# speed: query texts drawn from the stored corpus are embedded by both the
+# float model and the quantized one, and their top-k neighbors over the
+# stored (float) corpus embeddings are compared.
+#   python eval_quantization.py --samples 500 --k 10
+import os
+import json
+import time
+import argparse
+import numpy as np
+import artifacts
+from model_utils import load_model, get_embeddings
+
+
+def load_corpus(chunk_dir):
+    """(texts, unit-length embedding matrix) for every stored movie."""
+    texts = []
+    blocks = []
+    for path in artifacts.list_chunks(chunk_dir):
+        records, embeddings = artifacts.read_chunk(path)
+        for record, embedding in zip(records, embeddings):
+            if embedding is None:
+                continue
+            texts.append(record.get("PlotSummary") or "")
+            blocks.append(np.asarray(embedding, dtype=np.float32))
+    corpus = np.vstack(blocks)
+    return texts, corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+
+def embed_all(texts, encoder, batch_size):
+    tokenizer, model, device = encoder
+    started = time.perf_counter()
+    embeddings = np.vstack([
+        get_embeddings(texts[i:i + batch_size], tokenizer, model, device)
+        for i in range(0, len(texts), batch_size)
+    ])
+    return embeddings, len(texts) / (time.perf_counter() - started)
+
+def top_k(queries, corpus, k):
+    scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def evaluate(chunk_dir, samples=500, k=10, query_words=12, batch_size=16, seed=0):
+    texts, corpus = load_corpus(chunk_dir)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(texts), size=min(samples, len(texts)), replace=False)
+    # Short prefixes of stored plots stand in for search queries
+    queries = [" ".join(texts[i].split()[:query_words]) for i in picks]
+
+    reference, float_rate = embed_all(queries, load_model(quantize=""), batch_size)
+    quantized, int8_rate = embed_all(queries, load_model(quantize="int8"), batch_size)
+
+    reference_top = top_k(reference, corpus, k)
+    quantized_top = top_k(quantized, corpus, k)
+    overlap = np.array([len(set(a) & set(b)) / k for a, b in zip(reference_top, quantized_top)])
+    cosine = np.einsum("ij,ij->i", reference, quantized) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(quantized, axis=1)
+    )
+    return {
+        "model": os.getenv("EMBEDDING_MODEL"),
+        "corpus_size": len(texts),
+        "samples": len(queries),
+        "k": k,
+        "mean_overlap_at_k": float(overlap.mean()),
+        "min_overlap_at_k": float(overlap.min()),
+        "top1_agreement": float(np.mean(reference_top[:, 0] == quantized_top[:, 0])),
+        "mean_embedding_cosine": float(cosine.mean()),
+        "float_texts_per_s": float_rate,
+        "int8_texts_per_s": int8_rate,
+        "speedup": int8_rate / float_rate,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare int8-quantized query embeddings against the float model.")
+    parser.add_argument("--chunk-dir", default="./data/chunks", help="Directory holding the stored embedding chunks.")
+    parser.add_argument("--samples", type=int, default=500, help="Number of query texts to compare.")
+    parser.add_argument("--k", type=int, default=10, help="Neighbors compared per query.")
+    parser.add_argument("--query-words", type=int, default=12, help="Words of each sampled plot used as the query.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Texts per forward pass when timing.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for sampling query texts.")
+    args = parser.parse_args()
+    report = evaluate(args.chunk_dir, args.samples, args.k, args.query_words, args.batch_size, args.seed)
+    print(json.dumps(report, indent=2))
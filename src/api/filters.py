@@ -0,0 +1,90 @@
+# filters.py
+# Structured filters for vector and hybrid search:
+#   {"year_min": 1980, "year_max": 1989, "genres": ["comedy", "horror"], "director": "John Carpenter"}
+# "year" is shorthand for year_min == year_max and "genre" for a one-element
+# genres list. Genres match if the movie has any of them; they are compared
+# against the movies.genres column, which ingest.py derives from genre by
+# lower-casing and splitting on , / ; |. Directors match case-insensitively.
+import re
+
+FILTER_FIELDS = ("year", "year_min", "year_max", "genre", "genres", "director")
+GENRE_SEPARATORS = re.compile(r"\s*[,/;|]\s*")
+
+
+def _year(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer year")
+
+def normalize_genres(value):
+    """Genre names as stored in movies.genres: lower-cased, trimmed, split on separators."""
+    values = [value] if isinstance(value, str) else value
+    if not isinstance(values, list):
+        raise ValueError("genres must be a string or a list of strings")
+    genres = set()
+    for item in values:
+        genres.update(part for part in GENRE_SEPARATORS.split(str(item).strip().lower()) if part)
+    return sorted(genres)
+
+def parse_filters(filters):
+    """Validated, normalized filters (None when there are none)."""
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}; expected {', '.join(FILTER_FIELDS)}")
+    parsed = {}
+    if filters.get("year") is not None:
+        parsed["year_min"] = parsed["year_max"] = _year(filters["year"], "year")
+    for name in ("year_min", "year_max"):
+        if filters.get(name) is not None:
+            parsed[name] = _year(filters[name], name)
+    if parsed.get("year_min") is not None and parsed.get("year_max") is not None and parsed["year_min"] > parsed["year_max"]:
+        raise ValueError("year_min must not be after year_max")
+    genres = []
+    for name in ("genre", "genres"):
+        if filters.get(name) is not None:
+            genres += normalize_genres(filters[name])
+    if genres:
+        parsed["genres"] = sorted(set(genres))
+    director = filters.get("director")
+    if director is not None and str(director).strip():
+        parsed["director"] = str(director).strip()
+    return parsed or None
+
+def filter_shape(filters):
+    """Which filters are set, e.g. 'year_min_genres'; names one prepared statement per shape."""
+    return "_".join(name for name in ("year_min", "year_max", "genres", "director") if name in filters)
+
+def filter_clause(filters, first_param=None, alias=""):
+    """(SQL condition, params, types) for filters.
+
+    Parameters are numbered $first_param, $first_param + 1, ... for
+    prepared statements, or use psycopg2's %s when first_param is None.
+    """
+    conditions, params, types = [], [], []
+
+    def placeholder():
+        return "%s" if first_param is None else f"${first_param + len(params) - 1}"
+
+    if "year_min" in filters:
+        params.append(filters["year_min"])
+        types.append("integer")
+        conditions.append(f"{alias}release_year >= {placeholder()}")
+    if "year_max" in filters:
+        params.append(filters["year_max"])
+        types.append("integer")
+        conditions.append(f"{alias}release_year <= {placeholder()}")
+    if "genres" in filters:
+        # && (overlap) is what the GIN index on genres serves
+        params.append(filters["genres"])
+        types.append("text[]")
+        conditions.append(f"{alias}genres && {placeholder()}")
+    if "director" in filters:
+        params.append(filters["director"])
+        types.append("text")
+        conditions.append(f"lower({alias}director) = lower({placeholder()})")
+    return " AND ".join(conditions) or "TRUE", params, types
@@ -1,32 +1,160 @@
 import os
-import pandas as pd
+import struct
+import hashlib
+import argparse
 import numpy as np
 from tqdm.auto import tqdm
-from concurrent.futures import ThreadPoolExecutor
 import psycopg2
 from psycopg2.extras import execute_values
-import json
-
-def load_all_records(chunk_files):
-    all_records = []
-    for chunk_file in tqdm(sorted(chunk_files), desc="Loading chunks"):
-        with open(chunk_file, "r") as f:
-            for line in f:
-                record = json.loads(line)
-                if record.get('embedding') is not None:
-                    all_records.append(record)
-    return all_records
-
-def ingest():
-    vector_length = os.getenv("VECTOR_LENGTH", "768")
-    conn = psycopg2.connect("dbname='movie_recco' user='user' password='password' host='db'")
-    cur = conn.cursor()
-    
-    cur.execute("DROP TABLE IF EXISTS movies;")
-    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
-    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+import artifacts
+import vector_index
+import neighbors
+from projection import COMPACT_DIM, fit_projection, create_projection_table, save_projection, load_projection
+from result_cache import bump_generation
+
+BLOCK_SIZE = int(os.getenv("INGEST_BLOCK_SIZE", "1000"))
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
+SHADOW_TABLE = "movies_shadow"
+
+COLUMN_NAMES = [
+    "release_year", "title", "origin_ethnicity", "director", '"cast"', "genre",
+    "wiki_page", "plot", "plot_summary", "source_key", "content_hash",
+    "embedding_original", "embedding_normalized", "embedding_compact",
+]
+COPY_COLUMNS = ", ".join(COLUMN_NAMES)
+TEXT_FIELDS = ['Title', 'Origin/Ethnicity', 'Director', 'Cast', 'Genre', 'Wiki Page', 'Plot', 'PlotSummary']
+# (index name, definition) pairs; names get a suffix while built on the shadow table
+INDEXES = [
+    ("idx_embedding_original", "USING ivfflat (embedding_original) WITH (lists = {lists})"),
+    ("idx_embedding_normalized", "USING ivfflat (embedding_normalized) WITH (lists = {lists})"),
+    ("idx_embedding_compact", "USING ivfflat (embedding_compact) WITH (lists = {lists})"),
+    ("idx_title", "(title)"),
+    ("idx_title_trgm", "USING gin (lower(title) gin_trgm_ops)"),
+    ("idx_release_year_id", "((COALESCE(release_year, 0)), id)"),
+    ("idx_document", "USING gin (document)"),
+    # Structured search filters (see filters.py)
+    ("idx_release_year", "(release_year)"),
+    ("idx_director_lower", "(lower(director))"),
+    ("idx_genres", "USING gin (genres)"),
+]
+
+# Binary COPY framing: signature, flags, header extension length / end marker
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+NULL_FIELD = struct.pack("!i", -1)
+
+def _digest(hash_fn, *values):
+    return hash_fn("\x1f".join("" if v is None else str(v) for v in values).encode("utf-8")).hexdigest()
+
+def source_key(record):
+    """Stable identity of a movie across dataset refreshes."""
+    return _digest(hashlib.sha1, record.get('Wiki Page'), record.get('Title'), record.get('Release Year'))
+
+def content_hash(record, model_name=None):
+    """Changes whenever anything that feeds the stored embedding changes."""
+    model_name = model_name or os.getenv("EMBEDDING_MODEL")
+    return _digest(
+        hashlib.sha256,
+        record.get('Title'), record.get('Release Year'), record.get('PlotSummary'), model_name
+    )
+
+def record_fields(record):
+    """Non-vector column values of a record, in COLUMN_NAMES order."""
+    return (
+        [record.get('Release Year')]
+        + [record.get(field) for field in TEXT_FIELDS]
+        + [record['_source_key'], record['_content_hash']]
+    )
+
+def iter_records(chunk_files):
+    """Yield keyed records with embeddings one at a time, one chunk file open at a time."""
+    model_name = os.getenv("EMBEDDING_MODEL")
+    seen = set()
+    for record in artifacts.iter_chunk_records(tqdm(chunk_files, desc="Streaming chunks")):
+        key = source_key(record)
+        if key in seen:
+            continue
+        seen.add(key)
+        record['_source_key'] = key
+        record['_content_hash'] = content_hash(record, model_name)
+        yield record
+
+def iter_blocks(records, block_size=BLOCK_SIZE):
+    block = []
+    for record in records:
+        block.append(record)
+        if len(block) == block_size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+def normalize_embeddings(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+def _encode_text(value):
+    if value is None:
+        return NULL_FIELD
+    data = str(value).encode("utf-8")
+    return struct.pack("!i", len(data)) + data
+
+def _encode_int(value):
+    if value is None:
+        return NULL_FIELD
+    return struct.pack("!ii", 4, int(value))
+
+def _encode_vector(vector):
+    # pgvector binary format: int16 dim, int16 unused, big-endian float4s
+    data = struct.pack("!hh", len(vector), 0) + vector.astype(">f4").tobytes()
+    return struct.pack("!i", len(data)) + data
+
+def encode_copy_rows(records, embeddings, normalized, compact):
+    """Encode a block of records as binary COPY tuples."""
+    field_count = struct.pack("!h", len(COLUMN_NAMES))
+    parts = []
+    for record, embedding, normalized_embedding, compact_embedding in zip(records, embeddings, normalized, compact):
+        year, *texts = record_fields(record)
+        parts.append(field_count)
+        parts.append(_encode_int(year))
+        parts.extend(_encode_text(value) for value in texts)
+        parts.append(_encode_vector(embedding))
+        parts.append(_encode_vector(normalized_embedding))
+        parts.append(_encode_vector(compact_embedding))
+    return b"".join(parts)
+
+def iter_copy_data(records, projection, block_size=BLOCK_SIZE):
+    yield PGCOPY_HEADER
+    for block in iter_blocks(records, block_size):
+        embeddings = np.asarray([record['embedding'] for record in block], dtype=np.float32)
+        normalized = normalize_embeddings(embeddings)
+        yield encode_copy_rows(block, embeddings, normalized, projection.apply(normalized))
+    yield PGCOPY_TRAILER
+
+
+class CopyStream:
+    """Read-only file-like object that lets copy_expert pull from a generator."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0 or size > len(self._buffer):
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def create_table(cur, vector_length, table="movies", compact_dim=COMPACT_DIM):
     cur.execute(f"""
-    CREATE TABLE movies (
+    CREATE TABLE {table} (
         id SERIAL PRIMARY KEY,
         release_year INTEGER,
         title TEXT NOT NULL,
@@ -37,69 +165,225 @@ def ingest():
         wiki_page TEXT,
         plot TEXT,
         plot_summary TEXT,
+        source_key TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
         embedding_original vector({vector_length}),
-        embedding_normalized vector({vector_length})
+        embedding_normalized vector({vector_length}),
+        -- PCA-reduced embedding_normalized (see projection.py) for the first pass of a search
+        embedding_compact vector({compact_dim}),
+        document tsvector GENERATED ALWAYS AS (
+            to_tsvector('english', coalesce(title, '') || ' ' || coalesce(plot_summary, ''))
+        ) STORED,
+        -- genre split into lower-cased names, e.g. 'Comedy, drama' -> {{comedy,drama}}
+        genres TEXT[] GENERATED ALWAYS AS (
+            array_remove(array_remove(
+                regexp_split_to_array(lower(btrim(coalesce(genre, ''))), '\\s*[,/;|]\\s*'),
+            ''), 'unknown')
+        ) STORED
     );
     """)
-    
-    cur.execute("""
-    CREATE INDEX idx_embedding_original ON movies USING ivfflat (embedding_original) WITH (lists = 100);
-    """)
-    cur.execute("""
-    CREATE INDEX idx_embedding_normalized ON movies USING ivfflat (embedding_normalized) WITH (lists = 100);
-    """)
-    cur.execute("""
-    CREATE INDEX idx_title ON movies (title);
-    """)
-    
-    # Load and process chunks
-    chunk_dir = "./data/chunks"
-    chunk_files = [os.path.join(chunk_dir, f) for f in os.listdir(chunk_dir) if f.endswith(".json")]
-    
+
+def create_indexes(cur, table="movies", suffix=""):
+    # ivfflat picks its list centroids from the rows present at build time,
+    # so indexes are only created once the table is loaded
+    cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_source_key{suffix} ON {table} (source_key);")
+    for name, definition in INDEXES:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name}{suffix} ON {table} {definition.format(lists=IVFFLAT_LISTS)};")
+    cur.execute(f"ANALYZE {table};")
+
+def swap_in_shadow(cur):
+    """Atomically replace movies with the fully built shadow table."""
+    suffix = f"_{SHADOW_TABLE}"
+    cur.execute("DROP TABLE IF EXISTS movies_old;")
+    cur.execute("ALTER TABLE IF EXISTS movies RENAME TO movies_old;")
+    cur.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO movies;")
+    # The compact vectors are only comparable under the projection they were built with
+    cur.execute("DELETE FROM vector_projections WHERE name = 'movies';")
+    cur.execute(f"UPDATE vector_projections SET name = 'movies' WHERE name = '{SHADOW_TABLE}';")
+    cur.execute("DROP TABLE IF EXISTS movies_old;")
+    cur.execute(f"ALTER INDEX {SHADOW_TABLE}_pkey RENAME TO movies_pkey;")
+    cur.execute(f"ALTER SEQUENCE {SHADOW_TABLE}_id_seq RENAME TO movies_id_seq;")
+    for name in ["idx_source_key"] + [name for name, _ in INDEXES]:
+        cur.execute(f"ALTER INDEX {name}{suffix} RENAME TO {name};")
+
+def load_stream(cur, records, projection, table="movies"):
+    """Stream records into table with binary COPY in fixed-size float32 blocks."""
+    cur.copy_expert(
+        f"COPY {table} ({COPY_COLUMNS}) FROM STDIN WITH (FORMAT binary)",
+        CopyStream(iter_copy_data(records, projection))
+    )
+
+def load_bulk(cur, records, projection, table="movies"):
     # Load all records first
     print("Loading all records to process embeddings...")
-    all_records = load_all_records(chunk_files)
-    
+    all_records = list(records)
+
     print("Loading and normalizing embeddings...")
     all_embeddings = np.stack([np.array(r['embedding']) for r in all_records])
-    l2_norms = np.sqrt(np.sum(all_embeddings ** 2, axis=1, keepdims=True))
-    normalized_embeddings = all_embeddings / l2_norms
-    
+    normalized_embeddings = normalize_embeddings(all_embeddings)
+    compact_embeddings = projection.apply(normalized_embeddings)
+
     print("Preparing records for bulk insert...")
     rows = [
-        (
-            record.get('Release Year'),
-            record.get('Title'),
-            record.get('Origin/Ethnicity'),
-            record.get('Director'),
-            record.get('Cast'),
-            record.get('Genre'),
-            record.get('Wiki Page'),
-            record.get('Plot'),
-            record.get('PlotSummary'),
+        tuple(record_fields(record)) + (
             all_embeddings[i].tolist(),
-            normalized_embeddings[i].tolist()
+            normalized_embeddings[i].tolist(),
+            compact_embeddings[i].tolist()
         )
         for i, record in enumerate(all_records)
     ]
-    
+
     execute_values(
         cur,
-        """
-        INSERT INTO movies (
-            release_year, title, origin_ethnicity, director, "cast", genre, 
-            wiki_page, plot, plot_summary, embedding_original, embedding_normalized
-        ) VALUES %s
+        f"""
+        INSERT INTO {table} ({COPY_COLUMNS}) VALUES %s
         """,
         rows,
         page_size=1000
     )
+
+def table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", [table])
+    return cur.fetchone()[0]
+
+def has_current_schema(cur):
+    required = ['source_key', 'content_hash', 'document', 'embedding_compact', 'genres']
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_name = 'movies' AND column_name = ANY(%s);
+    """, [required])
+    # Upserts need the projection the live compact vectors were built with
+    return cur.fetchone()[0] == len(required) and load_projection(cur, "movies") is not None
+
+def rebuild(conn, chunk_files, vector_length, mode="stream"):
+    """Build a fresh copy of movies off to the side, then swap it in."""
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE};")
+    create_table(cur, vector_length, table=SHADOW_TABLE)
+    print(f"Fitting {COMPACT_DIM}-d projection for compact vectors...")
+    projection = fit_projection(chunk_files)
+    create_projection_table(cur)
+    save_projection(cur, projection, SHADOW_TABLE)
+    records = iter_records(chunk_files)
+    if mode == "stream":
+        print("Streaming records into PostgreSQL with binary COPY...")
+        load_stream(cur, records, projection, table=SHADOW_TABLE)
+    else:
+        load_bulk(cur, records, projection, table=SHADOW_TABLE)
+    print("Building indexes...")
+    create_indexes(cur, table=SHADOW_TABLE, suffix=f"_{SHADOW_TABLE}")
+    conn.commit()
+
+    # Searches keep hitting the old table until this short transaction commits
+    print("Swapping shadow table into place...")
+    swap_in_shadow(cur)
+    # Cached search results from the old table go stale with this commit
+    print(f"Corpus generation is now {bump_generation(cur)}.")
+    conn.commit()
+    cur.close()
+
+def upsert(conn, chunk_files, prune=False):
+    """Push only new or changed rows (by content hash) into the live table."""
+    cur = conn.cursor()
+    cur.execute("SELECT source_key, content_hash FROM movies;")
+    existing = dict(cur.fetchall())
+    seen = set()
+
+    def changed_records():
+        for record in iter_records(chunk_files):
+            seen.add(record['_source_key'])
+            if existing.get(record['_source_key']) != record['_content_hash']:
+                yield record
+
+    projection = load_projection(cur, "movies")
+    # Only the loaded columns: LIKE movies would copy id's NOT NULL but not its
+    # sequence default, so every COPYed row would fail; ids come from movies itself
+    cur.execute(f"CREATE TEMP TABLE movies_staging ON COMMIT DROP AS SELECT {COPY_COLUMNS} FROM movies WITH NO DATA;")
+    print("Streaming changed records into staging table...")
+    load_stream(cur, changed_records(), projection, table="movies_staging")
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in COLUMN_NAMES if column != "source_key")
+    cur.execute(f"""
+        INSERT INTO movies ({COPY_COLUMNS})
+        SELECT {COPY_COLUMNS} FROM movies_staging
+        ON CONFLICT (source_key) DO UPDATE SET {updates}
+        WHERE movies.content_hash IS DISTINCT FROM EXCLUDED.content_hash;
+    """)
+    print(f"Upserted {cur.rowcount} new or changed movies.")
+    if prune:
+        cur.execute("DELETE FROM movies WHERE NOT (source_key = ANY(%s));", [list(seen)])
+        print(f"Pruned {cur.rowcount} movies no longer in the dataset.")
+    # Adds any indexes introduced since the table was built, then ANALYZEs
+    create_indexes(cur)
+    print(f"Corpus generation is now {bump_generation(cur)}.")
+    conn.commit()
+    cur.close()
+
+def ingest(mode="stream", incremental=False, prune=False, export_index=False, refresh_neighbors=True):
+    vector_length = os.getenv("VECTOR_LENGTH", "768")
+    conn = psycopg2.connect("dbname='movie_recco' user='user' password='password' host='db'")
+    cur = conn.cursor()
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
     conn.commit()
-    
+
+    # Load and process chunks
+    chunk_dir = "./data/chunks"
+    chunk_files = artifacts.list_chunks(chunk_dir)
+
+    if incremental and table_exists(cur, "movies") and has_current_schema(cur):
+        upsert(conn, chunk_files, prune=prune)
+    else:
+        if incremental:
+            print("Live movies table is missing or has an older schema; doing a full rebuild instead.")
+        rebuild(conn, chunk_files, vector_length, mode=mode)
+
+    if export_index or vector_index.VECTOR_BACKEND == 'numpy':
+        print("Exporting vectors for the numpy search backend...")
+        vector_index.export_index(conn)
+        # Results cached from the previous index files in the meantime are stale too
+        bump_generation(cur)
+        conn.commit()
+
+    # Last, so the neighbor lists are tagged with the final generation
+    if refresh_neighbors and neighbors.NEIGHBORS_K > 0:
+        print(f"Precomputing the top {neighbors.NEIGHBORS_K} neighbors of every movie...")
+        neighbors.refresh_neighbors(conn)
+
     cur.close()
     conn.close()
     print("Data successfully ingested into PostgreSQL with both original and normalized embeddings!")
 
 if __name__ == "__main__":
-    ingest()
-    print("Data ingestion completed.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load chunk files into PostgreSQL.")
+    parser.add_argument(
+        "--mode",
+        choices=["stream", "bulk"],
+        default="stream",
+        help="stream: constant-memory binary COPY (default); bulk: load everything then INSERT."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Upsert only new or changed movies into the live table instead of rebuilding it."
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="With --incremental, delete movies that are no longer in the chunk files."
+    )
+    parser.add_argument(
+        "--export-index",
+        action="store_true",
+        help="Also export a memory-mapped vector index (implied when VECTOR_BACKEND=numpy)."
+    )
+    parser.add_argument(
+        "--skip-neighbors",
+        action="store_true",
+        help="Leave movie_neighbors stale; /movies/<id>/similar falls back to live search until neighbors.py runs."
+    )
+    args = parser.parse_args()
+    ingest(
+        mode=args.mode, incremental=args.incremental, prune=args.prune, export_index=args.export_index,
+        refresh_neighbors=not args.skip_neighbors
+    )
+    print("Data ingestion completed.")
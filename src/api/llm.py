@@ -0,0 +1,347 @@
+import os
+import codecs
+import asyncio
+import hashlib
+import threading
+import time
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from cache import LRUCache
+from logger import logger
+from metrics import observe_stage
+
+LLM_URL = os.getenv("LLM_URL", "http://llm:11434/api/chat")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama3")
+# Keep-alive connections kept open to the LLM per process
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+CHUNK_SIZE = 1024
+GENERATION_CACHE_BYTES = int(os.getenv("GENERATION_CACHE_BYTES", str(16 * 1024 * 1024)))
+GENERATION_CACHE_TTL = os.getenv("GENERATION_CACHE_TTL")
+
+SYSTEM_PROMPT = (
+    "The system is a movie producer who crafts creative and engaging plots. "
+    "The system creates a plot summary meant to pitch to a director. The system uses the "
+    "terms provided by the user to create a plot summary in 50 tokens or less. "
+    "No intro, just plain summary of the plot."
+)
+
+
+class LLMError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def build_chat_payload(prompt, num_ctx=512):
+    return {
+        "model": LLM_MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": f"{prompt}"
+            }
+        ],
+        "options": {
+            "num_ctx": num_ctx,
+            "temperature": 1.2,
+            "num_predict": 255,
+            "top_k": 80,
+            "top_p": 0.9,
+            "min_p": 0.7
+        }
+    }
+
+
+def decode_stream(chunks):
+    """Decode byte chunks as UTF-8 without splitting multi-byte characters."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Per-process requests session holding a keep-alive pool to the LLM."""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+def stream_chat(prompt, num_ctx=512):
+    """Start a streaming chat call and return a generator of decoded text chunks.
+
+    Raises LLMError before anything is streamed if the LLM rejects the request.
+    The pooled connection is released when the generator finishes or is closed.
+    """
+    started = time.perf_counter()
+    response = get_session().post(
+        LLM_URL,
+        json=build_chat_payload(prompt, num_ctx),
+        headers={"Content-Type": "application/json"},
+        stream=True,
+        timeout=(LLM_CONNECT_TIMEOUT, None)
+    )
+    observe_stage("llm_headers", time.perf_counter() - started)
+    if response.status_code != 200:
+        message = response.text
+        response.close()
+        raise LLMError(response.status_code, message)
+
+    def generate():
+        first = True
+        try:
+            chunks = (chunk for chunk in response.iter_content(chunk_size=CHUNK_SIZE) if chunk)
+            for text in decode_stream(chunks):
+                if first:
+                    observe_stage("llm_first_byte", time.perf_counter() - started)
+                    first = False
+                yield text
+        finally:
+            response.close()
+            observe_stage("llm_stream", time.perf_counter() - started)
+    return generate()
+
+
+_async_client = None
+
+def get_async_client():
+    """Shared httpx client for the event loop; created on first use."""
+    global _async_client
+    if _async_client is None:
+        import httpx
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+            timeout=httpx.Timeout(None, connect=LLM_CONNECT_TIMEOUT)
+        )
+    return _async_client
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+async def astream_chat(prompt, num_ctx=512):
+    """Async counterpart of stream_chat: returns an async generator of text chunks."""
+    client = get_async_client()
+    started = time.perf_counter()
+    request = client.build_request("POST", LLM_URL, json=build_chat_payload(prompt, num_ctx))
+    response = await client.send(request, stream=True)
+    observe_stage("llm_headers", time.perf_counter() - started)
+    if response.status_code != 200:
+        message = (await response.aread()).decode("utf-8", errors="replace")
+        await response.aclose()
+        raise LLMError(response.status_code, message)
+
+    async def generate():
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        first = True
+        try:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                text = decoder.decode(chunk)
+                if text:
+                    if first:
+                        observe_stage("llm_first_byte", time.perf_counter() - started)
+                        first = False
+                    yield text
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+        finally:
+            await response.aclose()
+            observe_stage("llm_stream", time.perf_counter() - started)
+    return generate()
+
+
+def generation_key(payload):
+    """Cache key over everything that shapes a generation: model, messages, options."""
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+# Finished generations, stored as the exact tuple of streamed text chunks and
+# bounded by their total encoded size
+generation_cache = LRUCache(
+    maxsize=GENERATION_CACHE_BYTES,
+    ttl=float(GENERATION_CACHE_TTL) if GENERATION_CACHE_TTL else None,
+    weigher=lambda chunks: sum(len(chunk.encode("utf-8")) for chunk in chunks)
+)
+
+
+class InFlightGeneration:
+    """One upstream generation that any number of identical requests can follow.
+
+    A single producer appends chunks as they arrive; followers (threads or
+    coroutines) replay everything produced so far and then wait for more.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._async_waiters = []
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._async_waiters = []
+
+    def append(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def wait_started(self, timeout=None):
+        """Block until the first chunk or the end; re-raise an upstream failure."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.chunks or self.done, timeout)
+            if self.error is not None and not self.chunks:
+                raise self.error
+
+    def iter_chunks(self):
+        index = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self.chunks) > index or self.done)
+                new = self.chunks[index:]
+                done, error = self.done, self.error
+            yield from new
+            index += len(new)
+            if done and not new:
+                if error is not None:
+                    raise error
+                return
+
+    async def aiter_chunks(self):
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            event = None
+            with self._cond:
+                new = self.chunks[index:]
+                done, error = self.done, self.error
+                if not new and not done:
+                    event = asyncio.Event()
+                    self._async_waiters.append((loop, event))
+            for chunk in new:
+                yield chunk
+            index += len(new)
+            if event is not None:
+                await event.wait()
+            elif done and not new:
+                if error is not None:
+                    raise error
+                return
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def _join_or_lead(key):
+    """Return (entry, is_leader) for the in-flight generation under key."""
+    with _in_flight_lock:
+        entry = _in_flight.get(key)
+        if entry is not None:
+            return entry, False
+        entry = _in_flight[key] = InFlightGeneration()
+        return entry, True
+
+def _complete(key, entry, error=None):
+    if error is None:
+        # Publish to the cache before leaving _in_flight so no request misses both
+        generation_cache.set(key, tuple(entry.chunks))
+    else:
+        logger.error(f"Generation {key[:12]} failed: {error}")
+    with _in_flight_lock:
+        _in_flight.pop(key, None)
+    entry.finish(error)
+
+def _pump(key, entry, prompt, num_ctx):
+    # Runs to completion even if the request that started it disconnects,
+    # so followers and the cache still get the full generation
+    try:
+        for text in stream_chat(prompt, num_ctx):
+            entry.append(text)
+    except Exception as e:
+        _complete(key, entry, e)
+    else:
+        _complete(key, entry)
+
+async def _apump(key, entry, prompt, num_ctx):
+    try:
+        chunks = await astream_chat(prompt, num_ctx)
+        async for text in chunks:
+            entry.append(text)
+    except Exception as e:
+        _complete(key, entry, e)
+    else:
+        _complete(key, entry)
+
+def cached_stream_chat(prompt, num_ctx=512):
+    """stream_chat with replay of cached generations and coalescing of identical requests."""
+    key = generation_key(build_chat_payload(prompt, num_ctx))
+    cached = generation_cache.get(key)
+    if cached is not None:
+        return iter(cached)
+    entry, leader = _join_or_lead(key)
+    if leader:
+        threading.Thread(target=_pump, args=(key, entry, prompt, num_ctx), daemon=True).start()
+    entry.wait_started()
+    return entry.iter_chunks()
+
+_background_tasks = set()
+
+async def acached_stream_chat(prompt, num_ctx=512):
+    """Async counterpart of cached_stream_chat; returns an async generator."""
+    key = generation_key(build_chat_payload(prompt, num_ctx))
+    cached = generation_cache.get(key)
+    if cached is not None:
+        async def replay():
+            for chunk in cached:
+                yield chunk
+        return replay()
+    entry, leader = _join_or_lead(key)
+    if leader:
+        task = asyncio.create_task(_apump(key, entry, prompt, num_ctx))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    chunks = entry.aiter_chunks()
+    # Surface an upstream rejection before any response headers go out
+    try:
+        first = [await chunks.__anext__()]
+    except StopAsyncIteration:
+        first = []
+
+    async def resume():
+        for chunk in first:
+            yield chunk
+        async for chunk in chunks:
+            yield chunk
+    return resume()
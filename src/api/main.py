@@ -1,10 +1,22 @@
+import os
+import time
+STARTED = time.perf_counter()
 from flask import Flask
 from flask_cors import CORS
 from routes import api_bp 
+import metrics
+from logger import logger
+from model_utils import MODEL_WARMUP
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS if needed
 app.register_blueprint(api_bp)
+metrics.init_app(app)
+logger.info(f"API app ready to serve in {time.perf_counter() - STARTED:.2f}s (model warm-up: {MODEL_WARMUP})")
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    if os.getenv("API_SERVER", "flask") == "asgi":
+        import uvicorn
+        uvicorn.run("asgi:app", host="0.0.0.0", port=5000)
+    else:
+        app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
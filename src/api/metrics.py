@@ -0,0 +1,178 @@
+# metrics.py
+# In-process latency histograms and counters, exported in the Prometheus
+# text format on /metrics. span("stage") times a block into the
+# movie_api_stage_seconds histogram and, when the request asked for it,
+# into a Server-Timing response header.
+# Metrics are per process: scrape each worker separately.
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Add Server-Timing to every response; otherwise only when the request sends X-Server-Timing
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+SERVER_TIMING_REQUEST_HEADER = "X-Server-Timing"
+
+_registry = []
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "movie_api_stage_seconds", "Time spent in each stage of request handling.", ["stage"]
+)
+request_seconds = Histogram(
+    "movie_api_request_seconds", "End-to-end request latency.", ["endpoint", "method"]
+)
+requests_total = Counter(
+    "movie_api_requests_total", "Requests served.", ["endpoint", "method", "status"]
+)
+errors_total = Counter(
+    "movie_api_stage_errors_total", "Stages that raised.", ["stage"]
+)
+
+
+def observe_stage(stage, seconds):
+    """Record a stage duration measured elsewhere (e.g. across a generator)."""
+    stage_seconds.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors_total.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+def start_request_timings(enabled=True):
+    """Collect this request's spans for a Server-Timing header (or stop collecting)."""
+    timings = [] if enabled else None
+    _request_timings.set(timings)
+    return timings
+
+def current_request_timings():
+    """This request's span list (None when not collected), for work done on other threads."""
+    return _request_timings.get()
+
+def server_timing_header(timings, total=None):
+    # Repeated stages (e.g. several queries) are summed into one entry
+    merged = {}
+    for stage, seconds in timings:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    if total is not None:
+        merged["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in merged.items())
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    """Time every request, add Server-Timing when asked, and serve /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        wants_timing = SERVER_TIMING or bool(request.headers.get(SERVER_TIMING_REQUEST_HEADER))
+        g.metrics_timings = start_request_timings(wants_timing)
+
+    @app.after_request
+    def _record(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        request_seconds.observe(elapsed, endpoint=endpoint, method=request.method)
+        requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        timings = g.pop("metrics_timings", None)
+        if timings is not None:
+            # Streamed bodies (/generate) only carry the stages run before the first byte
+            response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def _metrics():
+        return Response(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    return app
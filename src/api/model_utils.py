@@ -1,10 +1,21 @@
 import os
+import json
+import fcntl
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import torch
 import numpy as np
 import argparse
 from transformers import AutoTokenizer, AutoModelForSequenceClassification, ModernBertModel, ModernBertConfig
 from typing import List
+from cache import LRUCache
+from metrics import span, current_request_timings, start_request_timings
 
 
 # refactor logging
@@ -22,8 +33,75 @@ logging.basicConfig(
 def format_vector_for_postgres(embedding):
     return f"[{','.join(map(str, embedding))}]"
 
-def load_model():
+# Where a converted copy of EMBEDDING_MODEL is kept (safetensors weights
+# already in MODEL_DTYPE) so later starts skip the hub cache and conversion
+MODEL_SNAPSHOT_DIR = os.getenv("MODEL_SNAPSHOT_DIR")
+MODEL_DTYPE = os.getenv("MODEL_DTYPE", "float32")
+SNAPSHOT_INFO_FILE = "snapshot.json"
+# int8: dynamic int8 quantization of the Linear layers for CPU inference
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "").lower()
+# background: load in a thread at startup; lazy: on first embedding; eager: block at import
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "background")
+
+def snapshot_matches(snapshot_dir, model_name, dtype=MODEL_DTYPE):
+    info_path = os.path.join(snapshot_dir, SNAPSHOT_INFO_FILE)
+    if not os.path.exists(info_path):
+        return False
+    with open(info_path) as f:
+        info = json.load(f)
+    return info.get("model") == model_name and info.get("dtype") == dtype
+
+@contextmanager
+def snapshot_lock(snapshot_dir, exclusive=True):
+    """flock on <snapshot_dir>.lock: exclusive to replace the snapshot, shared to read it."""
+    snapshot_dir = snapshot_dir.rstrip("/")
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_dir)), exist_ok=True)
+    with open(f"{snapshot_dir}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def export_snapshot(tokenizer, model, snapshot_dir, model_name, dtype=MODEL_DTYPE):
+    """Save tokenizer + safetensors weights in dtype; snapshot.json marks it complete.
+
+    Workers starting together serialize on the snapshot lock; whoever comes
+    second finds the snapshot already written and leaves it alone.
+    """
+    snapshot_dir = snapshot_dir.rstrip("/")
+    parent, name = os.path.split(os.path.abspath(snapshot_dir))
+    with snapshot_lock(snapshot_dir):
+        if snapshot_matches(snapshot_dir, model_name, dtype):
+            return
+        tmp_dir = tempfile.mkdtemp(prefix=f"{name}.", suffix=".tmp", dir=parent)
+        old_dir = None
+        try:
+            model.to(getattr(torch, dtype)).save_pretrained(tmp_dir, safe_serialization=True)
+            tokenizer.save_pretrained(tmp_dir)
+            with open(os.path.join(tmp_dir, SNAPSHOT_INFO_FILE), "w") as f:
+                json.dump({"model": model_name, "dtype": dtype, "created_at": time.time()}, f)
+            # A directory can't be renamed over a non-empty one, so the old
+            # snapshot is moved aside first and removed after the swap
+            if os.path.exists(snapshot_dir):
+                old_dir = tempfile.mkdtemp(prefix=f"{name}.", suffix=".old", dir=parent)
+                os.replace(snapshot_dir, os.path.join(old_dir, name))
+            os.replace(tmp_dir, snapshot_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if old_dir:
+                shutil.rmtree(old_dir, ignore_errors=True)
+    logging.info(f"Exported {model_name} snapshot ({dtype}) to {snapshot_dir}")
+
+def quantize_model(model):
+    """int8 dynamic quantization: Linear weights stored as int8, activations quantized per batch."""
+    return torch.ao.quantization.quantize_dynamic(model.float().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_model(quantize=None):
+    quantize = EMBEDDING_QUANTIZE if quantize is None else quantize
     model_name = os.getenv("EMBEDDING_MODEL")
+    started = time.perf_counter()
+    dtype = getattr(torch, MODEL_DTYPE)
     ##### test
     # if "modernbert" in model_name.lower():
     #     config = ModernBertConfig()
@@ -33,31 +111,117 @@ def load_model():
     #     exit #### test
     #     tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
     #     model = AutoModelForSequenceClassification.from_pretrained(model_name, trust_remote_code=True)
-    config = ModernBertConfig()
-    tokenizer = AutoTokenizer.from_pretrained(model_name);
-    model = ModernBertModel.from_pretrained(model_name, trust_remote_code=True)
+    model = None
+    if MODEL_SNAPSHOT_DIR:
+        # Shared lock: a snapshot being replaced is never read half-written
+        with snapshot_lock(MODEL_SNAPSHOT_DIR, exclusive=False):
+            if snapshot_matches(MODEL_SNAPSHOT_DIR, model_name):
+                source = MODEL_SNAPSHOT_DIR
+                tokenizer = AutoTokenizer.from_pretrained(MODEL_SNAPSHOT_DIR)
+                model = ModernBertModel.from_pretrained(MODEL_SNAPSHOT_DIR, torch_dtype=dtype)
+    if model is None:
+        source = model_name
+        tokenizer = AutoTokenizer.from_pretrained(model_name);
+        model = ModernBertModel.from_pretrained(model_name, trust_remote_code=True, torch_dtype=dtype)
+        if MODEL_SNAPSHOT_DIR:
+            try:
+                export_snapshot(tokenizer, model, MODEL_SNAPSHOT_DIR, model_name)
+            except Exception as e:
+                logging.warning(f"Could not write model snapshot to {MODEL_SNAPSHOT_DIR}: {e}")
     #######
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    precision = MODEL_DTYPE
+    if quantize == "int8":
+        # Quantized kernels are CPU-only; the snapshot stays float so it can be reused
+        device = torch.device("cpu")
+        model = quantize_model(model)
+        precision = "int8"
+    elif quantize:
+        raise ValueError(f"Unsupported EMBEDDING_QUANTIZE value: {quantize}")
     model.to(device)
     model.eval()
+    logging.info(f"Loaded {model_name} from {source} ({precision}, {device}) in {time.perf_counter() - started:.2f}s")
     return tokenizer, model, device
 
-def get_embedding(text: str, tokenizer, model, device):
-    try:
+
+class ModelHandle:
+    """(tokenizer, model, device), loaded once on first use or by warm_up().
+
+    Lets the app start serving before the model is in memory; callers that
+    need it block in get() until the load finishes.
+    """
+
+    def __init__(self, loader=None):
+        self.loader = loader
+        self.load_seconds = None
+        self.error = None
+        self._loaded = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._loaded is not None
+
+    def get(self):
+        if self._loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    started = time.perf_counter()
+                    try:
+                        self._loaded = (self.loader or load_model)()
+                    except Exception as e:
+                        self.error = str(e)
+                        raise
+                    self.error = None
+                    self.load_seconds = time.perf_counter() - started
+        return self._loaded
+
+    def warm_up(self):
+        """Start loading in a background thread."""
+        def run():
+            try:
+                self.get()
+            except Exception as e:
+                logging.error(f"Model warm-up failed: {e}", exc_info=True)
+        self._thread = threading.Thread(target=run, name="model-warmup", daemon=True)
+        self._thread.start()
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "loading": self._thread is not None and self._thread.is_alive(),
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+# How get_embeddings pools token states; part of every embedding_store key
+POOLING = "mean"
+
+def get_embeddings(texts: List[str], tokenizer, model, device, max_length=512):
+    """Embed a batch of texts in one padded forward pass (masked mean pooling)."""
+    with span("tokenize"):
         inputs = tokenizer(
-            text,
+            texts,
             add_special_tokens=True,
-            max_length=512,
+            max_length=max_length,
             padding=True,
             truncation=True,
             return_tensors='pt'
         ).to(device)
-        
-        with torch.no_grad():
-            outputs = model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)
 
-        embedding = embeddings[0].cpu().numpy()
+    with span("forward"), torch.no_grad():
+        outputs = model(**inputs)
+        hidden = outputs.last_hidden_state
+        # Padding positions must not leak into the mean
+        mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+        embeddings = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+    return embeddings.float().cpu().numpy()
+
+def get_embedding(text: str, tokenizer, model, device):
+    try:
+        embedding = get_embeddings([text], tokenizer, model, device)[0]
         if embedding.size == 0:
             raise ValueError("Generated embedding is empty")
         return embedding
@@ -66,6 +230,171 @@ def get_embedding(text: str, tokenizer, model, device):
         logging.error(f"Error in get_embedding: {str(e)}", exc_info=True)
         raise
 
+
+def embedding_cache_key(text: str):
+    """Cache key for a query: the active model, weight dtype and quantization plus case/whitespace-folded text."""
+    return (os.getenv("EMBEDDING_MODEL"), MODEL_DTYPE, EMBEDDING_QUANTIZE, " ".join(text.lower().split()))
+
+def create_embedding_cache():
+    """Build the query-embedding cache from env, or None when disabled."""
+    maxsize = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+    if maxsize <= 0:
+        return None
+    ttl = os.getenv("EMBEDDING_CACHE_TTL")
+    return LRUCache(
+        maxsize=maxsize,
+        ttl=float(ttl) if ttl else None,
+        spill_path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+    )
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent get_embedding calls into batched forward passes.
+
+    Callers block in embed() while a single worker thread collects queued
+    texts for up to max_wait_ms (or until max_batch_size is reached), runs
+    one padded forward pass and hands every caller its own vector. When a
+    cache is given, hits skip the queue entirely. The model comes from a
+    ModelHandle, so the first batch waits for a model that is still loading.
+    """
+
+    def __init__(self, models, max_batch_size=None, max_wait_ms=None, cache=None):
+        self.cache = cache
+        self.models = models
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBED_MAX_BATCH_SIZE", "16"))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+        self._total_wait = 0.0
+        self._total_forward = 0.0
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def embed(self, text: str, timeout=None):
+        key = embedding_cache_key(text) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter(), current_request_timings()))
+        # Queue wait plus this caller's share of a batched forward pass
+        with span("embed"):
+            embedding = future.result(timeout)
+        if key is not None:
+            embedding.setflags(write=False)
+            self.cache.set(key, embedding)
+        return embedding
+
+    def embed_many(self, texts: List[str], timeout=None):
+        """Embed a list of texts, queueing every cache miss at once.
+
+        The worker packs the misses into full batches, so a bulk call costs
+        ceil(misses / max_batch_size) forward passes. Repeated texts are embedded once.
+        """
+        embeddings = [None] * len(texts)
+        pending = {}
+        for position, text in enumerate(texts):
+            key = embedding_cache_key(text)
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                embeddings[position] = cached
+            else:
+                pending.setdefault(key, (text, []))[1].append(position)
+        if pending:
+            self._ensure_worker()
+            futures = {}
+            enqueued = time.perf_counter()
+            timings = current_request_timings()
+            for key, (text, _) in pending.items():
+                futures[key] = Future()
+                self._queue.put((text, futures[key], enqueued, timings))
+            with span("embed"):
+                for future in futures.values():
+                    future.result(timeout)
+            for key, (_, positions) in pending.items():
+                embedding = futures[key].result()
+                embedding.setflags(write=False)
+                if self.cache is not None:
+                    self.cache.set(key, embedding)
+                for position in positions:
+                    embeddings[position] = embedding
+        return embeddings
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _, _, _ in batch]
+            # The tokenize/forward spans run on this thread; collect them and
+            # hand them to every request in the batch for its Server-Timing
+            batch_timings = start_request_timings()
+            try:
+                tokenizer, model, device = self.models.get()
+                started = time.perf_counter()
+                embeddings = get_embeddings(texts, tokenizer, model, device)
+            except Exception as e:
+                logging.error(f"Error in batched embedding: {str(e)}", exc_info=True)
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            waiting = {id(timings): timings for _, _, _, timings in batch if timings is not None}
+            for timings in waiting.values():
+                timings.extend(batch_timings)
+            for (_, future, _, _), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._largest_batch = max(self._largest_batch, len(batch))
+                self._total_wait += sum(started - enqueued for _, _, enqueued, _ in batch)
+                self._total_forward += finished - started
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": self._batches,
+                "items": self._items,
+                "largest_batch": self._largest_batch,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+                "avg_wait_ms": 1000 * self._total_wait / self._items if self._items else 0.0,
+                "avg_forward_ms": 1000 * self._total_forward / self._batches if self._batches else 0.0,
+            }
+
 def normalize_query_embedding(embedding):
     if embedding is None:
         raise ValueError("Embedding cannot be None")
@@ -77,10 +406,22 @@ if __name__ == "__main__":
     parser.add_argument(
         "--text",
         type=str,
-        required=True,
         help="The text for which to generate an embedding."
     )
+    parser.add_argument(
+        "--export-snapshot",
+        metavar="DIR",
+        help="Write a safetensors snapshot of EMBEDDING_MODEL in MODEL_DTYPE to DIR (use it via MODEL_SNAPSHOT_DIR)."
+    )
     args = parser.parse_args()
-    tokenizer, model, device = load_model()
-    embedding = get_embedding(args.text, tokenizer, model, device)
-    print("Generated embedding:", embedding)
\ No newline at end of file
+    if not args.text and not args.export_snapshot:
+        parser.error("one of --text or --export-snapshot is required")
+    if args.export_snapshot:
+        # The snapshot holds MODEL_DTYPE weights; int8 quantization is applied at load time
+        tokenizer, model, device = load_model(quantize="")
+        export_snapshot(tokenizer, model, args.export_snapshot, os.getenv("EMBEDDING_MODEL"))
+    if args.text:
+        if not args.export_snapshot or EMBEDDING_QUANTIZE:
+            tokenizer, model, device = load_model()
+        embedding = get_embedding(args.text, tokenizer, model, device)
+        print("Generated embedding:", embedding)
\ No newline at end of file
@@ -0,0 +1,147 @@
+# neighbors.py
+# Precomputed "more like this" lists. Every movie's top NEIGHBORS_K cosine
+# neighbors are found with blocked float32 matrix products over the stored
+# embedding_normalized vectors and written to movie_neighbors, so
+# /movies/<id>/similar is a primary-key lookup instead of a vector search.
+# ingest.py refreshes the table after every load; it records the corpus
+# generation it was computed for, and db.py ignores it once that moves on.
+#   python neighbors.py            # recompute for the current table
+import io
+import os
+import time
+import argparse
+import numpy as np
+import psycopg2
+from logger import logger
+from result_cache import read_generation
+from vector_index import _parse_vector
+
+NEIGHBORS_K = int(os.getenv("NEIGHBORS_K", "50"))
+# Query rows per matrix product; the score block is NEIGHBORS_BLOCK x corpus size
+NEIGHBORS_BLOCK = int(os.getenv("NEIGHBORS_BLOCK", "1024"))
+NEIGHBORS_TABLE = "movie_neighbors"
+SHADOW_TABLE = "movie_neighbors_shadow"
+
+
+def load_vectors(conn, fetch_size=5000):
+    """(ids, unit-length float32 matrix) of every embedded movie, read in the caller's transaction."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*), max(vector_dims(embedding_normalized)) FROM movies WHERE embedding_normalized IS NOT NULL;")
+        count, dim = cur.fetchone()
+    ids = np.empty(count, dtype=np.int64)
+    vectors = np.empty((count, dim or 0), dtype=np.float32)
+    with conn.cursor(name="movie_neighbors_vectors") as cur:
+        cur.itersize = fetch_size
+        cur.execute("""
+            SELECT id, embedding_normalized::text
+            FROM movies
+            WHERE embedding_normalized IS NOT NULL
+            ORDER BY id;
+        """)
+        for i, (movie_id, normalized_text) in enumerate(cur):
+            ids[i] = movie_id
+            vectors[i] = _parse_vector(normalized_text)
+    return ids, vectors
+
+
+def top_neighbors(vectors, k=NEIGHBORS_K, block_size=NEIGHBORS_BLOCK):
+    """Yield (first row, neighbor positions, similarities) for each block of rows, best first.
+
+    Each block is scored against the whole matrix with one product; a row
+    is never its own neighbor.
+    """
+    k = min(k, len(vectors) - 1)
+    if k <= 0:
+        return
+    for start in range(0, len(vectors), block_size):
+        scores = vectors[start:start + block_size] @ vectors.T
+        rows = np.arange(len(scores))
+        scores[rows, start + rows] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        yield start, np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _copy_block(ids, start, neighbors, similarities):
+    """Tab-separated movie_id, rank, neighbor_id, similarity lines for COPY."""
+    buffer = io.StringIO()
+    movie_ids = ids[start:start + len(neighbors)].tolist()
+    for movie_id, row, scores in zip(movie_ids, ids[neighbors].tolist(), similarities.tolist()):
+        for rank, (neighbor_id, similarity) in enumerate(zip(row, scores), start=1):
+            buffer.write(f"{movie_id}\t{rank}\t{neighbor_id}\t{similarity!r}\n")
+    buffer.seek(0)
+    return buffer
+
+
+def create_state_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS movie_neighbors_state (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            generation BIGINT NOT NULL,
+            k INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+
+def refresh_neighbors(conn, k=NEIGHBORS_K, block_size=NEIGHBORS_BLOCK):
+    """Recompute movie_neighbors off to the side and swap it in; returns rows written."""
+    started = time.perf_counter()
+    # One snapshot for the generation and the vectors, so the table is
+    # never tagged with a generation it wasn't computed from
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        generation = read_generation(cur)
+    ids, vectors = load_vectors(conn)
+    conn.rollback()
+
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE};")
+    cur.execute(f"""
+        CREATE TABLE {SHADOW_TABLE} (
+            movie_id INTEGER NOT NULL,
+            rank SMALLINT NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            similarity REAL NOT NULL
+        );
+    """)
+    written = 0
+    for start, neighbors, similarities in top_neighbors(vectors, k, block_size):
+        cur.copy_expert(
+            f"COPY {SHADOW_TABLE} (movie_id, rank, neighbor_id, similarity) FROM STDIN",
+            _copy_block(ids, start, neighbors, similarities)
+        )
+        written += neighbors.size
+    # Built after the load, like the movies indexes
+    cur.execute(f"ALTER TABLE {SHADOW_TABLE} ADD CONSTRAINT {SHADOW_TABLE}_pkey PRIMARY KEY (movie_id, rank);")
+    conn.commit()
+
+    cur.execute(f"DROP TABLE IF EXISTS {NEIGHBORS_TABLE};")
+    cur.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO {NEIGHBORS_TABLE};")
+    cur.execute(f"ALTER INDEX {SHADOW_TABLE}_pkey RENAME TO {NEIGHBORS_TABLE}_pkey;")
+    create_state_table(cur)
+    cur.execute("""
+        INSERT INTO movie_neighbors_state (id, generation, k) VALUES (TRUE, %s, %s)
+        ON CONFLICT (id) DO UPDATE SET generation = EXCLUDED.generation, k = EXCLUDED.k, updated_at = now();
+    """, [generation, min(k, max(len(ids) - 1, 0))])
+    conn.commit()
+    cur.close()
+    logger.info(
+        f"Wrote {written} neighbors for {len(ids)} movies (generation {generation}) "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute every movie's nearest neighbors into movie_neighbors.")
+    parser.add_argument("--k", type=int, default=NEIGHBORS_K, help="Neighbors kept per movie.")
+    parser.add_argument("--block-size", type=int, default=NEIGHBORS_BLOCK, help="Movies scored per matrix product.")
+    args = parser.parse_args()
+    conn = psycopg2.connect("dbname='movie_recco' user='user' password='password' host='db'")
+    try:
+        refresh_neighbors(conn, args.k, args.block_size)
+    finally:
+        conn.close()
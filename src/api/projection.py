@@ -0,0 +1,99 @@
+# projection.py
+# PCA projection of unit-length embeddings down to COMPACT_DIM dimensions.
+# ingest.py fits it, stores it in vector_projections next to the table it
+# was fitted for, and fills movies.embedding_compact with projected,
+# re-normalized vectors; db.py projects queries the same way for the
+# compact first pass of a search.
+import os
+import numpy as np
+import psycopg2
+import artifacts
+
+COMPACT_DIM = int(os.getenv("COMPACT_DIM", "128"))
+PROJECTION_SAMPLE_SIZE = int(os.getenv("PROJECTION_SAMPLE_SIZE", "20000"))
+
+
+class Projection:
+    def __init__(self, mean, components):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+
+    @property
+    def source_dim(self):
+        return self.components.shape[1]
+
+    @property
+    def compact_dim(self):
+        return self.components.shape[0]
+
+    def apply(self, normalized):
+        """Project unit-length rows (or one vector) and re-normalize, so L2 order is cosine order."""
+        compact = (np.asarray(normalized, dtype=np.float32) - self.mean) @ self.components.T
+        norms = np.linalg.norm(compact, axis=-1, keepdims=True)
+        return compact / np.where(norms == 0, 1, norms)
+
+
+def fit_projection(chunk_files, compact_dim=COMPACT_DIM, sample_size=PROJECTION_SAMPLE_SIZE, seed=0):
+    """PCA over a uniform sample of the normalized chunk embeddings."""
+    total = sum(artifacts.chunk_rows(path) or 0 for path in chunk_files)
+    rate = min(1.0, sample_size / max(total, 1))
+    rng = np.random.default_rng(seed)
+    sample = []
+    for path in chunk_files:
+        _, embeddings = artifacts.read_chunk(path)
+        if isinstance(embeddings, np.ndarray):
+            picked = embeddings[rng.random(len(embeddings)) < rate]
+        else:
+            # Legacy JSON chunks may have rows without an embedding
+            picked = [embedding for embedding in embeddings if embedding is not None and rng.random() < rate]
+        if len(picked):
+            sample.append(np.asarray(picked, dtype=np.float32))
+    sample = np.vstack(sample)
+    sample /= np.linalg.norm(sample, axis=1, keepdims=True)
+    mean = sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    return Projection(mean, vt[:min(compact_dim, vt.shape[0])])
+
+
+def create_projection_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vector_projections (
+            name TEXT PRIMARY KEY,
+            source_dim INTEGER NOT NULL,
+            compact_dim INTEGER NOT NULL,
+            mean BYTEA NOT NULL,
+            components BYTEA NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+def save_projection(cur, projection, name):
+    """Store the projection fitted for table name (float32 little-endian blobs)."""
+    cur.execute("""
+        INSERT INTO vector_projections (name, source_dim, compact_dim, mean, components)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (name) DO UPDATE SET
+            source_dim = EXCLUDED.source_dim, compact_dim = EXCLUDED.compact_dim,
+            mean = EXCLUDED.mean, components = EXCLUDED.components, created_at = now();
+    """, [
+        name, projection.source_dim, projection.compact_dim,
+        psycopg2.Binary(projection.mean.astype("<f4").tobytes()),
+        psycopg2.Binary(projection.components.astype("<f4").tobytes()),
+    ])
+
+def load_projection(cur, name="movies"):
+    cur.execute("SELECT to_regclass('vector_projections') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute(
+        "SELECT source_dim, compact_dim, mean, components FROM vector_projections WHERE name = %s;",
+        [name]
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    source_dim, compact_dim, mean, components = row
+    return Projection(
+        np.frombuffer(bytes(mean), dtype="<f4"),
+        np.frombuffer(bytes(components), dtype="<f4").reshape(compact_dim, source_dim)
+    )
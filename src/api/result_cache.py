@@ -0,0 +1,248 @@
+# result_cache.py
+# Cache of search results keyed on a hash of the query vector and every
+# search parameter. Entries are tagged with the corpus generation they were
+# computed against; ingest.py bumps the generation in corpus_generation, so
+# a re-ingest turns every older entry into a miss without flushing anything.
+#
+# Backends (RESULT_CACHE_BACKEND):
+#   memory  per-process LRU (default)
+#   file    one pickle per entry under RESULT_CACHE_PATH, shared by the
+#           workers on a host and kept across restarts
+#   redis   shared by every API host (RESULT_CACHE_URL; needs the redis
+#           package); bound its size with maxmemory + an allkeys-lru policy
+#   off     no result caching
+import os
+import time
+import pickle
+import hashlib
+import threading
+import numpy as np
+import orjson
+from cache import LRUCache
+from logger import logger
+
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory").lower()
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048"))
+RESULT_CACHE_TTL = os.getenv("RESULT_CACHE_TTL")
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "./data/result_cache")
+RESULT_CACHE_URL = os.getenv("RESULT_CACHE_URL", "redis://localhost:6379/0")
+RESULT_CACHE_BACKENDS = ("memory", "file", "redis", "off")
+
+
+def result_key(kind, embedding, params):
+    """Digest of the search kind, the exact float32 query vector and its parameters."""
+    digest = hashlib.sha256(kind.encode())
+    digest.update(np.ascontiguousarray(embedding, dtype=np.float32).tobytes())
+    digest.update(orjson.dumps(params, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY))
+    return digest.hexdigest()
+
+
+class FileBackend:
+    """Size-bounded directory of pickled entries, evicting the least recently read."""
+
+    # Sets between directory scans for eviction
+    PRUNE_EVERY = 64
+
+    def __init__(self, directory=RESULT_CACHE_PATH, maxsize=RESULT_CACHE_SIZE, ttl=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be greater than 0")
+        self.directory = directory
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sets = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                expires_at, value = pickle.load(f)
+            if expires_at is not None and expires_at <= time.time():
+                os.remove(path)
+                raise FileNotFoundError(path)
+            # mtime doubles as the recency used for eviction
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((expires_at, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Failed to write result cache entry: {e}")
+            return
+        with self._lock:
+            self._sets += 1
+            prune = self._sets % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        if len(entries) <= self.maxsize:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.maxsize]:
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                os.remove(entry.path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "path": self.directory,
+        }
+
+
+class RedisBackend:
+    """Entries shared through Redis; any error is logged and treated as a miss."""
+
+    def __init__(self, url=RESULT_CACHE_URL, ttl=None, prefix="movie_results:"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key, default=None):
+        try:
+            data = self.client.get(self.prefix + key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Result cache lookup failed: {e}")
+            data = None
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            self.client.set(
+                self.prefix + key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                ex=int(ttl) if ttl else None
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Result cache write failed: {e}")
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "errors": self.errors,
+            "url": self.url,
+        }
+
+
+class ResultCache:
+    """Search results tagged with the corpus generation they were computed for."""
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+        self.stale = 0
+
+    def get(self, key, generation):
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        entry_generation, rows = entry
+        if entry_generation != generation:
+            self.stale += 1
+            return None
+        return rows
+
+    def set(self, key, generation, rows):
+        self.backend.set(key, (generation, [dict(row) for row in rows]))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return dict(self.backend.stats(), backend=self.name, stale=self.stale)
+
+
+def create_result_cache(backend=RESULT_CACHE_BACKEND):
+    """Build the result cache from env, or None when disabled."""
+    if backend not in RESULT_CACHE_BACKENDS:
+        raise ValueError(f"RESULT_CACHE_BACKEND must be one of {', '.join(RESULT_CACHE_BACKENDS)}")
+    if backend == "off" or RESULT_CACHE_SIZE <= 0:
+        return None
+    ttl = float(RESULT_CACHE_TTL) if RESULT_CACHE_TTL else None
+    if backend == "file":
+        return ResultCache(FileBackend(RESULT_CACHE_PATH, RESULT_CACHE_SIZE, ttl), backend)
+    if backend == "redis":
+        return ResultCache(RedisBackend(RESULT_CACHE_URL, ttl), backend)
+    return ResultCache(LRUCache(maxsize=RESULT_CACHE_SIZE, ttl=ttl), backend)
+
+
+def create_generation_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS corpus_generation (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            generation BIGINT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("INSERT INTO corpus_generation (id, generation) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;")
+
+def bump_generation(cur):
+    """Advance the corpus generation; commits with the caller's transaction."""
+    create_generation_table(cur)
+    cur.execute("UPDATE corpus_generation SET generation = generation + 1, updated_at = now() RETURNING generation;")
+    return cur.fetchone()[0]
+
+def read_generation(cur):
+    cur.execute("SELECT to_regclass('corpus_generation') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT generation FROM corpus_generation;")
+    row = cur.fetchone()
+    return row[0] if row else 0
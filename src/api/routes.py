@@ -1,12 +1,30 @@
 from flask import Blueprint, jsonify, request, Response
-import requests
 from logger import logger
-from db import fetch_movies, fetch_similar_movies, search_movies_hybrid
-from model_utils import get_embedding, load_model
+from serialization import json_response, ndjson_response, parse_fields, parse_format, shape_rows
+from filters import parse_filters
+from llm import stream_chat, cached_stream_chat, generation_cache, LLMError
+from db import (
+    fetch_movies, stream_movies, fetch_similar_movies, fetch_similar_to_movie, fetch_similar_movies_batch, search_movies_hybrid,
+    search_movies_hybrid_batch, pool, movie_count_cache, result_cache, get_corpus_generation, FUSION_METHODS
+)
+from model_utils import ModelHandle, EmbeddingBatcher, create_embedding_cache, MODEL_WARMUP
 import numpy as np
+import os
 
 api_bp = Blueprint('api', __name__, url_prefix='/')
-tokenizer, model, device = load_model()
+# Importing the blueprint no longer waits for the model; see MODEL_WARMUP
+models = ModelHandle()
+if MODEL_WARMUP == "eager":
+    models.get()
+elif MODEL_WARMUP == "background":
+    models.warm_up()
+embedding_cache = create_embedding_cache()
+embedder = EmbeddingBatcher(models, cache=embedding_cache)
+# Upper bound on the number of queries in one /*/batch request
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "64"))
+
+# Search results can be projected and returned as columns, but not streamed
+SEARCH_FORMATS = ("rows", "columns")
 
 @api_bp.route('/debug', methods=['POST'])
 def debug_request():
@@ -18,35 +36,98 @@ def debug_request():
         logger.error(f"Error in /debug: {e}")
         return jsonify({"error": str(e)}), 400
 
+@api_bp.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the embedding model is loaded, 503 until then."""
+    status = models.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@api_bp.route('/admin/stats', methods=['GET'])
+def admin_stats():
+    return jsonify({
+        "model": models.status(),
+        "embedding_batcher": embedder.stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "db_pool": pool.stats(),
+        "movie_count_cache": movie_count_cache.stats(),
+        "result_cache": dict(result_cache.stats(), corpus_generation=get_corpus_generation()) if result_cache else None,
+        "generation_cache": generation_cache.stats(),
+    })
+
 @api_bp.route('/movies', methods=['GET'])
 def get_movies():
     try:
         limit = request.args.get('limit', default=10, type=int)
         offset = request.args.get('offset', default=0, type=int)
         title_filter = request.args.get('title', default="", type=str)
+        cursor = request.args.get('cursor', default=None, type=str)
+        fields = parse_fields(request.args.get('fields'))
+        response_format = parse_format(request.args.get('format'))
         if limit < 1:
             return jsonify({"error": "Limit must be greater than 0"}), 400
         if offset < 0:
             return jsonify({"error": "Offset must be non-negative"}), 400
+        if response_format == "ndjson":
+            # Streams every match unless a limit is given explicitly
+            logger.info(f"Streaming movies with title_filter='{title_filter}', fields={fields}")
+            return ndjson_response(stream_movies(
+                title_filter=title_filter,
+                fields=fields,
+                limit=request.args.get('limit', type=int),
+                offset=offset,
+                cursor=cursor
+            ))
         logger.info(f"Fetching movies with limit={limit}, offset={offset}, title_filter='{title_filter}'")
         movies = fetch_movies(
             limit=limit,
             offset=offset,
-            title_filter=title_filter
+            title_filter=title_filter,
+            cursor=cursor
         )
-        return jsonify({
+        movies["movies"] = shape_rows(movies["movies"], fields, response_format)
+        return json_response({
             "movies": movies,
             "metadata": {
                 "limit": limit,
                 "offset": offset,
                 "title_filter": title_filter if title_filter else None,
                 "count": len(movies),
+                "cursor": cursor,
+                "next_cursor": movies["next_cursor"],
             }
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error fetching movies: {e}", exc_info=True)
         return jsonify({"error": f"Unable to fetch movies: {e}"}), 500
 
+@api_bp.route('/movies/<int:movie_id>/similar', methods=['GET'])
+def similar_to_movie(movie_id):
+    try:
+        num_neighbors = request.args.get('num_neighbors', default=10, type=int)
+        probes = request.args.get('probes', default=None, type=int)
+        fields = parse_fields(request.args.get('fields'))
+        response_format = parse_format(request.args.get('format'), SEARCH_FORMATS)
+        if num_neighbors < 1:
+            return jsonify({"error": "num_neighbors must be greater than 0"}), 400
+        if probes is not None and probes < 1:
+            return jsonify({"error": "probes must be greater than 0"}), 400
+        logger.info(f"Movies similar to {movie_id} - neighbors: {num_neighbors}")
+        results = fetch_similar_to_movie(movie_id, num_neighbors=num_neighbors, probes=probes)
+        if results is None:
+            return jsonify({"error": f"Movie {movie_id} not found"}), 404
+        return json_response({
+            "results": shape_rows(results, fields, response_format),
+            "movie_id": movie_id,
+            "num_results": len(results)
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Similar movies lookup failed: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @api_bp.route('/vector_search', methods=['POST'])
 def vector_search():
     try:
@@ -56,9 +137,21 @@ def vector_search():
         text = data['text']
         num_neighbors = int(data.get('num_neighbors', 10))
         metric = data.get('metric', 'cosine')
-        logger.info(f"Vector search - text: '{text}', metric: {metric}, neighbors: {num_neighbors}")
+        probes = data.get('probes')
+        exact = str(data.get('exact', False)).lower() == 'true'
+        fields = parse_fields(data.get('fields'))
+        response_format = parse_format(data.get('format'), SEARCH_FORMATS)
+        # None leaves it to COMPACT_SEARCH
+        compact = data.get('compact')
+        compact = str(compact).lower() == 'true' if compact is not None else None
+        filters = parse_filters(data.get('filters'))
+        if probes is not None:
+            probes = int(probes)
+            if probes < 1:
+                return jsonify({"error": "probes must be greater than 0"}), 400
+        logger.info(f"Vector search - text: '{text}', metric: {metric}, neighbors: {num_neighbors}, probes: {probes}, exact: {exact}, compact: {compact}, filters: {filters}")
         try:
-            embedding = get_embedding(text, tokenizer, model, device)
+            embedding = embedder.embed(text)
             embedding = np.array(embedding) if not isinstance(embedding, np.ndarray) else embedding
             logger.info(f"Generated embedding length: {len(embedding)}")
         except Exception as e:
@@ -67,18 +160,98 @@ def vector_search():
         results = fetch_similar_movies(
             embedding=embedding,
             num_neighbors=num_neighbors,
-            metric=metric
+            metric=metric,
+            probes=probes,
+            exact=exact,
+            compact=compact,
+            filters=filters
         )
-        return jsonify({
-            "results": results,
+        return json_response({
+            "results": shape_rows(results, fields, response_format),
             "query": text,
             "metric": metric,
+            "probes": probes,
+            "exact": exact,
+            "compact": compact,
+            "filters": filters,
             "num_results": len(results)
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Vector search failed: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+def parse_batch_queries(data):
+    """Per-query option dicts for a batch request.
+
+    Top-level options are defaults for every query; a query may be a bare
+    string or an object with its own text and overrides.
+    """
+    if not data or not isinstance(data.get('queries'), list) or not data['queries']:
+        raise ValueError("queries must be a non-empty list")
+    if len(data['queries']) > MAX_BATCH_QUERIES:
+        raise ValueError(f"At most {MAX_BATCH_QUERIES} queries per batch")
+    defaults = {key: value for key, value in data.items() if key != 'queries'}
+    queries = []
+    for item in data['queries']:
+        query = dict(defaults, **(item if isinstance(item, dict) else {'text': item}))
+        if not query.get('text'):
+            raise ValueError("Every query needs a text")
+        queries.append(query)
+    return queries
+
+@api_bp.route('/vector_search/batch', methods=['POST'])
+def vector_search_batch():
+    try:
+        try:
+            queries = parse_batch_queries(request.json)
+            fields = parse_fields(request.json.get('fields'))
+            response_format = parse_format(request.json.get('format'), SEARCH_FORMATS)
+            searches = []
+            for query in queries:
+                probes = query.get('probes')
+                if probes is not None and int(probes) < 1:
+                    raise ValueError("probes must be greater than 0")
+                searches.append({
+                    "num_neighbors": int(query.get('num_neighbors', 10)),
+                    "metric": query.get('metric', 'cosine'),
+                    "probes": int(probes) if probes is not None else None,
+                    "exact": str(query.get('exact', False)).lower() == 'true',
+                    "filters": parse_filters(query.get('filters')),
+                })
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        logger.info(f"Batch vector search - {len(queries)} queries")
+        try:
+            embeddings = embedder.embed_many([query['text'] for query in queries])
+        except Exception as e:
+            logger.error(f"Embedding generation failed: {str(e)}", exc_info=True)
+            return jsonify({"error": "Embedding generation failed"}), 500
+        for search, embedding in zip(searches, embeddings):
+            search["embedding"] = embedding
+        results = fetch_similar_movies_batch(searches)
+        return json_response({
+            "results": [
+                {
+                    "results": shape_rows(rows, fields, response_format),
+                    "query": query['text'],
+                    "metric": search["metric"],
+                    "probes": search["probes"],
+                    "exact": search["exact"],
+                    "filters": search["filters"],
+                    "num_results": len(rows)
+                }
+                for query, search, rows in zip(queries, searches, results)
+            ],
+            "num_queries": len(queries)
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Batch vector search failed: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 # @api_bp.route('/hybrid_search', methods=['POST'])
 # def hybrid_search():
 #     try:
@@ -131,11 +304,24 @@ def hybrid_search():
         text_query = data.get('text_query', '')
         use_normalized = data.get('use_normalized', True)
         embedding_weight = data.get('embedding_weight', 0.7)
+        fusion = data.get('fusion')
+        candidate_k = data.get('candidate_k')
+        candidate_k = int(candidate_k) if candidate_k is not None else None
+        probes = data.get('probes')
+        probes = int(probes) if probes is not None else None
+        if probes is not None and probes < 1:
+            return jsonify({"error": "probes must be greater than 0"}), 400
+        exact = str(data.get('exact', False)).lower() == 'true'
+        filters = parse_filters(data.get('filters'))
+        fields = parse_fields(data.get('fields'))
+        response_format = parse_format(data.get('format'), SEARCH_FORMATS)
+        if fusion is not None and fusion not in FUSION_METHODS:
+            return jsonify({"error": f"fusion must be one of {', '.join(FUSION_METHODS)}"}), 400
 
-        logger.info(f"Hybrid search - text: '{text}', metric: {metric}, neighbors: {num_neighbors}")
+        logger.info(f"Hybrid search - text: '{text}', metric: {metric}, neighbors: {num_neighbors}, fusion: {fusion}, filters: {filters}")
 
         try:
-            embedding = get_embedding(text, tokenizer, model, device)
+            embedding = embedder.embed(text)
             embedding = np.array(embedding) if not isinstance(embedding, np.ndarray) else embedding
             logger.info(f"Generated embedding length: {len(embedding)}")
         except Exception as e:
@@ -149,20 +335,90 @@ def hybrid_search():
             metric=metric,
             use_normalized=use_normalized,
             embedding_weight=embedding_weight,
+            fusion=fusion,
+            candidate_k=candidate_k,
+            probes=probes,
+            exact=exact,
+            filters=filters,
         )
 
-        return jsonify({
-            "results": results,
+        return json_response({
+            "results": shape_rows(results, fields, response_format),
             "query": text,
             "text_query": text_query,
             "metric": metric,
             "num_results": len(results),
-            "embedding_weight": embedding_weight
+            "embedding_weight": embedding_weight,
+            "fusion": fusion,
+            "filters": filters
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Hybrid search failed: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@api_bp.route('/hybrid_search/batch', methods=['POST'])
+def hybrid_search_batch():
+    try:
+        try:
+            queries = parse_batch_queries(request.json)
+            fields = parse_fields(request.json.get('fields'))
+            response_format = parse_format(request.json.get('format'), SEARCH_FORMATS)
+            searches = []
+            for query in queries:
+                fusion = query.get('fusion')
+                if fusion is not None and fusion not in FUSION_METHODS:
+                    raise ValueError(f"fusion must be one of {', '.join(FUSION_METHODS)}")
+                candidate_k = query.get('candidate_k')
+                probes = query.get('probes')
+                if probes is not None and int(probes) < 1:
+                    raise ValueError("probes must be greater than 0")
+                searches.append({
+                    "text_query": query.get('text_query', ''),
+                    "num_neighbors": int(query.get('num_neighbors', 10)),
+                    "metric": query.get('metric', 'cosine'),
+                    "use_normalized": query.get('use_normalized', True),
+                    "embedding_weight": query.get('embedding_weight', 0.7),
+                    "fusion": fusion,
+                    "candidate_k": int(candidate_k) if candidate_k is not None else None,
+                    "probes": int(probes) if probes is not None else None,
+                    "exact": str(query.get('exact', False)).lower() == 'true',
+                    "filters": parse_filters(query.get('filters')),
+                })
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        logger.info(f"Batch hybrid search - {len(queries)} queries")
+        try:
+            embeddings = embedder.embed_many([query['text'] for query in queries])
+        except Exception as e:
+            logger.error(f"Embedding generation failed: {str(e)}", exc_info=True)
+            return jsonify({"error": "Embedding generation failed"}), 500
+        for search, embedding in zip(searches, embeddings):
+            search["embedding"] = embedding
+        results = search_movies_hybrid_batch(searches)
+        return json_response({
+            "results": [
+                {
+                    "results": shape_rows(rows, fields, response_format),
+                    "query": query['text'],
+                    "text_query": search["text_query"],
+                    "metric": search["metric"],
+                    "num_results": len(rows),
+                    "embedding_weight": search["embedding_weight"],
+                    "fusion": search["fusion"],
+                    "filters": search["filters"]
+                }
+                for query, search, rows in zip(queries, searches, results)
+            ],
+            "num_queries": len(queries)
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Batch hybrid search failed: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @api_bp.route('/generate', methods=['POST'])
 def generate_prompt():
     try:
@@ -170,45 +426,13 @@ def generate_prompt():
         logger.info(f"data: {data}")
         prompt = data.get('prompt', "too many puppies?")
         num_ctx = data.get('num_ctx', 512)
+        use_cache = str(data.get('cache', False)).lower() == 'true'
         if not prompt:
             return jsonify({"error": "Prompt is required"}), 400
-        response = requests.post(
-            "http://llm:11434/api/chat",
-            json={
-                "model": "llama3",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": (
-                            "The system is a movie producer who crafts creative and engaging plots. "
-                            "The system creates a plot summary meant to pitch to a director. The system uses the "
-                            "terms provided by the user to create a plot summary in 50 tokens or less. "
-                            "No intro, just plain summary of the plot."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": f"{prompt}"
-                    }
-                ],
-                "options": {
-                    "num_ctx": num_ctx,
-                    "temperature": 1.2,
-                    "num_predict": 255,
-                    "top_k": 80,
-                    "top_p": 0.9,
-                    "min_p": 0.7
-                }
-            },
-            headers={"Content-Type": "application/json"},
-            stream=True
-        )
-        if response.status_code != 200:
-            return jsonify({"error": f"LLM service returned an error: {response.text}"}), response.status_code
-        def generate():
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    yield chunk.decode('utf-8')
-        return Response(generate(), content_type='application/json')
+        try:
+            chunks = (cached_stream_chat if use_cache else stream_chat)(prompt, num_ctx)
+        except LLMError as e:
+            return jsonify({"error": f"LLM service returned an error: {e.message}"}), e.status_code
+        return Response(chunks, content_type='application/json')
     except Exception as e:
-        return jsonify({"error": f"An error occurred: {e}"}), 500
\ No newline at end of file
+        return jsonify({"error": f"An error occurred: {e}"}), 500
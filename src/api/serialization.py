@@ -0,0 +1,94 @@
+# serialization.py
+# orjson-backed response bodies. Result lists can be trimmed to the fields a
+# client asks for (`fields`) and returned row-wise (the default), column-wise
+# (`format=columns`, one array per field, so keys are not repeated per row)
+# or, on /movies, streamed as NDJSON straight off a server-side cursor.
+import os
+import time
+from decimal import Decimal
+import orjson
+from flask import Response
+from metrics import span, observe_stage
+
+RESPONSE_FORMATS = ("rows", "columns", "ndjson")
+# Rows encoded per chunk written to the client when streaming NDJSON
+NDJSON_CHUNK_ROWS = int(os.getenv("NDJSON_CHUNK_ROWS", "500"))
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(payload):
+    return orjson.dumps(payload, default=_default, option=JSON_OPTIONS)
+
+
+def parse_fields(value):
+    """Requested field names from a comma-separated string or a list (None for all)."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list):
+        raise ValueError("fields must be a list or a comma-separated string")
+    fields = [str(field).strip() for field in value if str(field).strip()]
+    return fields or None
+
+def parse_format(value, allowed=RESPONSE_FORMATS):
+    response_format = str(value or "rows").lower()
+    if response_format not in allowed:
+        raise ValueError(f"format must be one of {', '.join(allowed)}")
+    return response_format
+
+def project(rows, fields):
+    """Rows restricted to fields, in that order; unknown fields are a ValueError."""
+    if not fields:
+        return rows
+    if rows:
+        missing = [field for field in fields if field not in rows[0]]
+        if missing:
+            raise ValueError(f"Unknown fields: {', '.join(missing)}")
+    return [{field: row[field] for field in fields} for row in rows]
+
+def to_columns(rows, fields=None):
+    names = fields or (list(rows[0]) if rows else [])
+    return {name: [row[name] for row in rows] for name in names}
+
+def shape_rows(rows, fields=None, response_format="rows"):
+    """A result list in the requested shape: projected rows, or columns."""
+    rows = project(rows, fields)
+    if response_format == "columns":
+        return to_columns(rows, fields)
+    return rows
+
+
+def json_response(payload, status=200):
+    with span("serialize"):
+        body = dumps(payload)
+    return Response(body, status=status, mimetype="application/json")
+
+def ndjson_response(rows):
+    """Stream an iterable of rows as newline-delimited JSON.
+
+    Rows are encoded NDJSON_CHUNK_ROWS at a time, so memory stays flat however
+    many the iterable yields; closing the response closes the iterable.
+    """
+    def generate():
+        started = time.perf_counter()
+        chunk = []
+        try:
+            for row in rows:
+                chunk.append(dumps(row))
+                if len(chunk) >= NDJSON_CHUNK_ROWS:
+                    yield b"\n".join(chunk) + b"\n"
+                    chunk = []
+            if chunk:
+                yield b"\n".join(chunk) + b"\n"
+        finally:
+            close = getattr(rows, "close", None)
+            if close is not None:
+                close()
+            observe_stage("ndjson_stream", time.perf_counter() - started)
+    return Response(generate(), mimetype="application/x-ndjson")
@@ -0,0 +1,81 @@
+# test_build.py
+# Unit tests for shard parsing and merging. Chunks and shard manifests are
+# written to a temporary directory; no model is loaded.
+import os
+import time
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("pyarrow")
+import numpy as np
+import pandas as pd
+import artifacts
+from build import parse_shard, merge_shards
+
+
+def test_parse_shard():
+    assert parse_shard("0/1") == (0, 1)
+    assert parse_shard("2/4") == (2, 4)
+
+
+@pytest.mark.parametrize("value", ["4/4", "-1/4", "1", "a/b", "1/2/3"])
+def test_parse_shard_rejects_bad_values(value):
+    with pytest.raises(ValueError):
+        parse_shard(value)
+
+
+def write_shard(output_dir, shard, num_shards, num_chunks, rows=3, dataset="data-1", created_at=None):
+    chunks = []
+    for idx in range(shard + 1, num_chunks + 1, num_shards):
+        stem = artifacts.chunk_stem(output_dir, idx)
+        artifacts.write_chunk(stem, pd.DataFrame({"Title": [f"Movie {idx}.{i}" for i in range(rows)]}), np.zeros((rows, 4)))
+        chunks.append({"index": idx, "file": os.path.basename(f"{stem}.npy"), "rows": rows})
+    artifacts.write_shard_manifest(output_dir, {
+        "shard": shard,
+        "num_shards": num_shards,
+        "num_chunks": num_chunks,
+        "dataset": dataset,
+        "model": "test-model",
+        "chunks": chunks,
+        "created_at": created_at or time.time(),
+    })
+
+
+def test_merge_combines_every_shard(tmp_path):
+    output_dir = str(tmp_path)
+    write_shard(output_dir, 0, 2, 5)
+    write_shard(output_dir, 1, 2, 5)
+    manifest = merge_shards(output_dir)
+    assert manifest["total_rows"] == 15
+    assert [chunk["file"] for chunk in manifest["chunks"]] == [f"movie_embeddings_chunk_{idx}.npy" for idx in range(1, 6)]
+    assert artifacts.read_manifest(output_dir)["model"] == "test-model"
+
+
+def test_merge_refuses_a_missing_shard(tmp_path):
+    output_dir = str(tmp_path)
+    write_shard(output_dir, 0, 3, 6)
+    write_shard(output_dir, 2, 3, 6)
+    with pytest.raises(ValueError, match="Missing shards: 1"):
+        merge_shards(output_dir)
+
+
+def test_merge_refuses_a_missing_chunk_file(tmp_path):
+    output_dir = str(tmp_path)
+    write_shard(output_dir, 0, 2, 4)
+    write_shard(output_dir, 1, 2, 4)
+    os.remove(artifacts.chunk_stem(output_dir, 3) + ".npy")
+    with pytest.raises(ValueError, match="Chunk 3"):
+        merge_shards(output_dir)
+
+
+def test_merge_drops_stale_chunks_and_older_builds(tmp_path):
+    output_dir = str(tmp_path)
+    # An earlier, larger two-shard build left chunks 1-4 and its manifests behind
+    write_shard(output_dir, 0, 2, 4, dataset="data-0", created_at=1.0)
+    write_shard(output_dir, 1, 2, 4, dataset="data-0", created_at=1.0)
+    write_shard(output_dir, 0, 1, 2, dataset="data-1")
+    manifest = merge_shards(output_dir)
+    assert manifest["total_rows"] == 6
+    assert [os.path.basename(path) for path in artifacts.list_chunks(output_dir)] == [
+        "movie_embeddings_chunk_1.npy", "movie_embeddings_chunk_2.npy",
+    ]
@@ -0,0 +1,43 @@
+# test_cache.py
+# Unit tests for LRUCache: recency order, TTL expiry and the spill file.
+import cache
+from cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    lru = LRUCache(maxsize=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert "b" not in lru
+    assert lru.get("a") == 1 and lru.get("c") == 3
+    assert lru.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    lru = LRUCache(maxsize=4, ttl=10)
+    lru.set("a", 1)
+    lru.set("b", 2, ttl=60)
+    now[0] += 11
+    assert lru.get("a") is None
+    assert lru.get("b") == 2
+    assert lru.stats()["expirations"] == 1
+    assert len(lru) == 1
+
+
+def test_spill_file_round_trip_keeps_live_entries(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    spill_path = str(tmp_path / "cache.pkl")
+    lru = LRUCache(maxsize=4, spill_path=spill_path)
+    lru.set("kept", [1, 2])
+    lru.set("expiring", 3, ttl=5)
+    lru.save()
+
+    now[0] += 6
+    restored = LRUCache(maxsize=4, spill_path=spill_path)
+    assert restored.get("kept") == [1, 2]
+    assert restored.get("expiring") is None
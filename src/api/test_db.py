@@ -0,0 +1,118 @@
+# test_db.py
+# Unit tests for the pure helpers in db.py. Nothing here opens a database
+# connection; cursors and connections are stand-ins.
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("torch")
+import db
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+
+def test_search_settings_default_leaves_session_alone():
+    cursor = RecordingCursor()
+    db.apply_search_settings(cursor)
+    assert cursor.statements == []
+
+
+def test_search_settings_probes_are_transaction_local():
+    cursor = RecordingCursor()
+    db.apply_search_settings(cursor, probes=7)
+    assert cursor.statements == [("SELECT set_config('ivfflat.probes', %s, true);", ["7"])]
+
+
+def test_search_settings_exact_disables_index_scans():
+    cursor = RecordingCursor()
+    db.apply_search_settings(cursor, probes=7, exact=True)
+    assert cursor.statements == [("SET LOCAL enable_indexscan = off;", None)]
+
+
+class FakeInfo:
+    transaction_status = db.psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.last_used = db.time.monotonic()
+        self.info = FakeInfo()
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = db.psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(monkeypatch, **kwargs):
+    pool = db.ConnectionPool(**kwargs)
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    monkeypatch.setattr(pool, "_connect", connect)
+    return pool, opened
+
+
+def test_pool_prefills_and_reuses_connections(monkeypatch):
+    pool, opened = make_pool(monkeypatch, minconn=2, maxconn=3)
+    conn = pool.getconn()
+    assert len(opened) == 2 and conn in opened
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert pool.stats()["idle"] == 1
+
+
+def test_pool_times_out_when_exhausted(monkeypatch):
+    pool, _ = make_pool(monkeypatch, minconn=0, maxconn=1, timeout=0.01)
+    conn = pool.getconn()
+    with pytest.raises(db.PoolTimeout):
+        pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_pool_rolls_back_open_transactions_on_return(monkeypatch):
+    pool, _ = make_pool(monkeypatch, minconn=0, maxconn=1)
+    conn = pool.getconn()
+    conn.info.transaction_status = db.psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+
+
+def test_pool_discards_closed_connections(monkeypatch):
+    pool, opened = make_pool(monkeypatch, minconn=1, maxconn=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.close()
+    replacement = pool.getconn()
+    assert replacement is not conn and len(opened) == 2
+
+
+def test_pool_rejects_impossible_sizes():
+    with pytest.raises(ValueError):
+        db.ConnectionPool(minconn=3, maxconn=2)
+
+
+def test_cursor_round_trip():
+    cursor = db.encode_cursor(0.875, 42)
+    assert db.decode_cursor(cursor) == (0.875, 42)
+    # URL-safe, so it can go straight into a query string
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", db.encode_cursor("x", 1)[:-4], "WzEsMiwzXQ=="])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        db.decode_cursor(cursor)
@@ -0,0 +1,56 @@
+# test_filters.py
+# Unit tests for parsing structured search filters and turning them into SQL.
+import pytest
+from filters import parse_filters, filter_clause, filter_shape, normalize_genres
+
+
+def test_empty_filters_are_none():
+    assert parse_filters(None) is None
+    assert parse_filters({}) is None
+    assert parse_filters({"director": "  ", "genres": []}) is None
+
+
+def test_filters_are_normalized():
+    assert parse_filters({"year": "1984", "genre": "Horror", "genres": ["comedy / Drama", "horror"], "director": " John Carpenter "}) == {
+        "year_min": 1984,
+        "year_max": 1984,
+        "genres": ["comedy", "drama", "horror"],
+        "director": "John Carpenter",
+    }
+
+
+def test_genres_split_like_ingest():
+    assert normalize_genres("Comedy, romance|drama;war") == ["comedy", "drama", "romance", "war"]
+
+
+@pytest.mark.parametrize("filters, message", [
+    ([1980], "filters must be an object"),
+    ({"decade": 1980}, "Unknown filters: decade"),
+    ({"year_min": "eighties"}, "year_min must be an integer year"),
+    ({"year_min": 1990, "year_max": 1980}, "year_min must not be after year_max"),
+    ({"genres": 3}, "genres must be a string or a list of strings"),
+])
+def test_invalid_filters_are_rejected(filters, message):
+    with pytest.raises(ValueError, match=message):
+        parse_filters(filters)
+
+
+def test_clause_with_psycopg2_placeholders():
+    filters = parse_filters({"year_min": 1980, "genres": ["comedy"], "director": "John Carpenter"})
+    assert filter_clause(filters, alias="m.") == (
+        "m.release_year >= %s AND m.genres && %s AND lower(m.director) = lower(%s)",
+        [1980, ["comedy"], "John Carpenter"],
+        ["integer", "text[]", "text"],
+    )
+
+
+def test_clause_with_numbered_parameters():
+    filters = parse_filters({"year_min": 1980, "year_max": 1989})
+    assert filter_clause(filters, first_param=3) == (
+        "release_year >= $3 AND release_year <= $4", [1980, 1989], ["integer", "integer"]
+    )
+    assert filter_shape(filters) == "year_min_year_max"
+
+
+def test_clause_without_filters():
+    assert filter_clause({}) == ("TRUE", [], [])
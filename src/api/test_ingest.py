@@ -0,0 +1,72 @@
+# test_ingest.py
+# Integration test for the incremental ingest path. Needs a Postgres with
+# pgvector and pg_trgm available; point TEST_DATABASE_URL at a scratch
+# database. Everything is created in a throwaway schema and dropped after.
+import os
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+import numpy as np
+import ingest
+from projection import Projection, create_projection_table, save_projection
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+SCHEMA = f"test_ingest_{os.getpid()}"
+
+
+def make_record(title, year, plot, embedding):
+    record = {
+        "Title": title,
+        "Release Year": year,
+        "Origin/Ethnicity": "American",
+        "Director": "Unknown",
+        "Cast": "",
+        "Genre": "drama",
+        "Wiki Page": f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}",
+        "Plot": plot,
+        "PlotSummary": plot,
+        "embedding": np.asarray(embedding, dtype=np.float32),
+    }
+    record["_source_key"] = ingest.source_key(record)
+    record["_content_hash"] = ingest.content_hash(record, "test-model")
+    return record
+
+
+@pytest.fixture
+def conn():
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    cur = conn.cursor()
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    cur.execute(f"CREATE SCHEMA {SCHEMA};")
+    cur.execute(f"SET search_path TO {SCHEMA}, public;")
+    ingest.create_table(cur, 4, compact_dim=2)
+    create_projection_table(cur)
+    save_projection(cur, Projection(np.zeros(4), np.eye(2, 4)), "movies")
+    conn.commit()
+    yield conn
+    conn.rollback()
+    cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE;")
+    conn.commit()
+    conn.close()
+
+
+def test_upsert_twice_with_one_changed_row(conn, monkeypatch):
+    records = [
+        make_record("First Movie", 1990, "A plot.", [1, 0, 0, 0]),
+        make_record("Second Movie", 1991, "Another plot.", [0, 1, 0, 0]),
+    ]
+    monkeypatch.setattr(ingest, "iter_records", lambda chunk_files: iter(records))
+    ingest.upsert(conn, [])
+    cur = conn.cursor()
+    cur.execute("SELECT title, id FROM movies;")
+    ids = dict(cur.fetchall())
+    assert set(ids) == {"First Movie", "Second Movie"}
+
+    records[1] = make_record("Second Movie", 1991, "A rewritten plot.", [0, 0, 1, 0])
+    ingest.upsert(conn, [])
+    cur.execute("SELECT title, id, plot_summary FROM movies ORDER BY id;")
+    rows = cur.fetchall()
+    assert [(title, movie_id) for title, movie_id, _ in rows] == sorted(ids.items(), key=lambda item: item[1])
+    assert dict((title, plot) for title, _, plot in rows)["Second Movie"] == "A rewritten plot."
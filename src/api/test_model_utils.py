@@ -0,0 +1,64 @@
+# test_model_utils.py
+# Unit tests for EmbeddingBatcher. get_embeddings is replaced with a fake
+# that records each batch, so no model is loaded.
+import threading
+import pytest
+
+pytest.importorskip("torch")
+import numpy as np
+import model_utils
+from model_utils import EmbeddingBatcher, ModelHandle
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    seen = []
+
+    def fake_get_embeddings(texts, tokenizer, model, device):
+        seen.append(list(texts))
+        return [np.array([len(text), i], dtype=np.float32) for i, text in enumerate(texts)]
+
+    monkeypatch.setattr(model_utils, "get_embeddings", fake_get_embeddings)
+    return seen
+
+
+def make_batcher(**kwargs):
+    return EmbeddingBatcher(ModelHandle(loader=lambda: (None, None, "cpu")), **kwargs)
+
+
+def test_embed_many_packs_misses_into_full_batches(batches):
+    batcher = make_batcher(max_batch_size=2, max_wait_ms=50)
+    texts = ["a", "bb", "ccc", "bb", "ddddd"]
+    embeddings = batcher.embed_many(texts, timeout=5)
+    assert [int(embedding[0]) for embedding in embeddings] == [1, 2, 3, 2, 5]
+    # The repeated "bb" is embedded once
+    assert sorted(len(batch) for batch in batches) == [2, 2]
+    assert batcher.stats()["items"] == 4
+
+
+def test_concurrent_embeds_share_a_forward_pass(batches):
+    batcher = make_batcher(max_batch_size=4, max_wait_ms=500)
+    results = {}
+
+    def call(text):
+        results[text] = batcher.embed(text, timeout=5)
+
+    threads = [threading.Thread(target=call, args=(text,)) for text in ["one", "three", "seven", "eleven"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [len(batch) for batch in batches] == [4]
+    assert {text: int(embedding[0]) for text, embedding in results.items()} == {
+        "one": 3, "three": 5, "seven": 5, "eleven": 6,
+    }
+
+
+def test_forward_pass_errors_reach_every_caller(monkeypatch):
+    def failing_get_embeddings(texts, tokenizer, model, device):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(model_utils, "get_embeddings", failing_get_embeddings)
+    batcher = make_batcher(max_batch_size=2, max_wait_ms=1)
+    with pytest.raises(RuntimeError, match="out of memory"):
+        batcher.embed("anything", timeout=5)
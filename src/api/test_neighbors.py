@@ -0,0 +1,47 @@
+# test_neighbors.py
+# Unit tests for the blocked top-k neighbor search, checked against a
+# brute-force ranking.
+import pytest
+
+pytest.importorskip("psycopg2")
+import numpy as np
+from neighbors import top_neighbors
+
+
+def unit_vectors(count, dim, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def collect(vectors, k, block_size):
+    neighbors, similarities = [], []
+    for start, block_neighbors, block_similarities in top_neighbors(vectors, k, block_size):
+        assert start == len(neighbors)
+        neighbors.extend(block_neighbors.tolist())
+        similarities.extend(block_similarities.tolist())
+    return np.array(neighbors), np.array(similarities)
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 7, 100])
+def test_matches_brute_force_for_any_block_size(block_size):
+    vectors = unit_vectors(23, 6)
+    neighbors, similarities = collect(vectors, 5, block_size)
+    scores = vectors @ vectors.T
+    np.fill_diagonal(scores, -np.inf)
+    expected = np.argsort(-scores, axis=1, kind="stable")[:, :5]
+    np.testing.assert_array_equal(neighbors, expected)
+    np.testing.assert_allclose(similarities, np.take_along_axis(scores, expected, axis=1), rtol=1e-6)
+
+
+def test_rows_are_never_their_own_neighbor_and_come_best_first():
+    vectors = unit_vectors(10, 3, seed=1)
+    neighbors, similarities = collect(vectors, 9, 3)
+    assert all(row not in neighbors[row] for row in range(10))
+    assert (np.diff(similarities, axis=1) <= 0).all()
+
+
+def test_k_is_capped_by_corpus_size():
+    vectors = unit_vectors(4, 3)
+    neighbors, _ = collect(vectors, 50, 2)
+    assert neighbors.shape == (4, 3)
+    assert list(top_neighbors(vectors[:1], 50, 2)) == []
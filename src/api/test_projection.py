@@ -0,0 +1,32 @@
+# test_projection.py
+# Unit tests for Projection.apply on small hand-built projections.
+import pytest
+
+pytest.importorskip("psycopg2")
+import numpy as np
+from projection import Projection
+
+
+def test_apply_centers_projects_and_renormalizes():
+    projection = Projection(mean=[0.5, 0, 0], components=[[1, 0, 0], [0, 1, 0]])
+    compact = projection.apply([1.0, 0.0, 0.0])
+    np.testing.assert_allclose(compact, [1.0, 0.0])
+    compact = projection.apply([0.5, 3.0, 4.0])
+    np.testing.assert_allclose(compact, [0.0, 1.0])
+    assert compact.dtype == np.float32
+
+
+def test_apply_rows_are_unit_length():
+    rng = np.random.default_rng(0)
+    rows = rng.normal(size=(5, 8))
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    projection = Projection(np.zeros(8), np.linalg.qr(rng.normal(size=(8, 3)))[0].T)
+    compact = projection.apply(rows)
+    assert compact.shape == (5, 3)
+    np.testing.assert_allclose(np.linalg.norm(compact, axis=1), 1.0, rtol=1e-5)
+
+
+def test_apply_leaves_vectors_projecting_to_zero_at_zero():
+    projection = Projection(np.zeros(2), [[1, 0]])
+    compact = projection.apply([[0.0, 1.0], [2.0, 0.0]])
+    np.testing.assert_array_equal(compact, [[0.0], [1.0]])
@@ -0,0 +1,46 @@
+# test_result_cache.py
+# Unit tests for result keys and generation tagging, on the in-memory and
+# file backends.
+import pytest
+
+pytest.importorskip("orjson")
+import numpy as np
+from cache import LRUCache
+from result_cache import result_key, ResultCache, FileBackend
+
+
+def test_result_key_ignores_param_order_and_vector_dtype():
+    embedding = np.array([0.25, -1.0, 3.5])
+    key = result_key("vector", embedding, {"limit": 10, "metric": "cosine"})
+    assert key == result_key("vector", embedding.astype(np.float32), {"metric": "cosine", "limit": 10})
+
+
+def test_result_key_covers_kind_vector_and_params():
+    embedding = np.array([0.25, -1.0, 3.5], dtype=np.float32)
+    key = result_key("vector", embedding, {"limit": 10})
+    assert key != result_key("hybrid", embedding, {"limit": 10})
+    assert key != result_key("vector", embedding + np.float32(1e-6), {"limit": 10})
+    assert key != result_key("vector", embedding, {"limit": 11})
+
+
+@pytest.fixture(params=["memory", "file"])
+def results(request, tmp_path):
+    if request.param == "file":
+        return ResultCache(FileBackend(str(tmp_path), maxsize=8), "file")
+    return ResultCache(LRUCache(maxsize=8), "memory")
+
+
+def test_entries_from_an_older_generation_are_misses(results):
+    rows = [{"id": 1, "similarity": 0.9}]
+    results.set("key", 3, rows)
+    assert results.get("key", 3) == rows
+    assert results.get("key", 4) is None
+    assert results.get("missing", 3) is None
+    assert results.stats()["stale"] == 1
+
+
+def test_cached_rows_are_copies(results):
+    rows = [{"id": 1}]
+    results.set("key", 0, rows)
+    rows[0]["id"] = 2
+    assert results.get("key", 0) == [{"id": 1}]
@@ -0,0 +1,43 @@
+# test_serialization.py
+# Unit tests for result shaping: field projection and the columnar format.
+import pytest
+
+pytest.importorskip("orjson")
+pytest.importorskip("flask")
+from serialization import shape_rows, parse_fields, parse_format
+
+ROWS = [
+    {"id": 1, "title": "Alien", "release_year": 1979},
+    {"id": 2, "title": "Aliens", "release_year": 1986},
+]
+
+
+def test_rows_are_returned_unchanged_without_fields():
+    assert shape_rows(ROWS) == ROWS
+
+
+def test_fields_project_rows_in_the_requested_order():
+    shaped = shape_rows(ROWS, ["title", "id"])
+    assert shaped == [{"title": "Alien", "id": 1}, {"title": "Aliens", "id": 2}]
+    assert list(shaped[0]) == ["title", "id"]
+
+
+def test_columns_format():
+    assert shape_rows(ROWS, ["id", "release_year"], "columns") == {"id": [1, 2], "release_year": [1979, 1986]}
+    assert shape_rows(ROWS, response_format="columns") == {
+        "id": [1, 2], "title": ["Alien", "Aliens"], "release_year": [1979, 1986],
+    }
+    assert shape_rows([], ["id"], "columns") == {"id": []}
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(ValueError, match="Unknown fields: plot"):
+        shape_rows(ROWS, ["id", "plot"])
+
+
+def test_request_parsing():
+    assert parse_fields(" id, title ,") == ["id", "title"]
+    assert parse_fields("") is None
+    assert parse_format(None) == "rows"
+    with pytest.raises(ValueError):
+        parse_format("xml")
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+import numpy as np
+import psycopg2
+from logger import logger
+from result_cache import bump_generation
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "postgres")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "/app/data/index")
+# Pointer file naming the live version directory; swapped with os.replace
+CURRENT_FILE = "current.json"
+KEEP_VERSIONS = 2
+
+
+def _parse_vector(text):
+    return np.fromstring(text[1:-1], sep=",", dtype=np.float32)
+
+
+def export_index(conn, index_dir=VECTOR_INDEX_DIR, fetch_size=5000):
+    """Dump movie vectors from Postgres into a new memory-mappable index version.
+
+    Writes ids.npy, embeddings_normalized.npy, embeddings_original.npy and
+    original_sq_norms.npy into a fresh version directory, then atomically
+    points current.json at it so running servers pick it up on their next query.
+    """
+    # One snapshot for the count and the scan so the arrays are sized exactly
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cur.execute("SELECT COUNT(*) FROM movies WHERE embedding_normalized IS NOT NULL;")
+        count = cur.fetchone()[0]
+        cur.execute("SELECT vector_dims(embedding_normalized) FROM movies WHERE embedding_normalized IS NOT NULL LIMIT 1;")
+        row = cur.fetchone()
+    if not count or row is None:
+        raise ValueError("movies has no embeddings to export")
+    dim = row[0]
+
+    version = time.strftime("%Y%m%d%H%M%S") + f"-{os.getpid()}"
+    version_dir = os.path.join(index_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+    open_memmap = np.lib.format.open_memmap
+    ids = open_memmap(os.path.join(version_dir, "ids.npy"), mode="w+", dtype=np.int64, shape=(count,))
+    normalized = open_memmap(os.path.join(version_dir, "embeddings_normalized.npy"), mode="w+", dtype=np.float32, shape=(count, dim))
+    original = open_memmap(os.path.join(version_dir, "embeddings_original.npy"), mode="w+", dtype=np.float32, shape=(count, dim))
+
+    # Named cursor streams rows server-side instead of materializing the table
+    with conn.cursor(name="vector_index_export") as cur:
+        cur.itersize = fetch_size
+        cur.execute("""
+            SELECT id, embedding_original::text, embedding_normalized::text
+            FROM movies
+            WHERE embedding_normalized IS NOT NULL
+            ORDER BY id;
+        """)
+        for i, (movie_id, original_text, normalized_text) in enumerate(cur):
+            ids[i] = movie_id
+            original[i] = _parse_vector(original_text)
+            normalized[i] = _parse_vector(normalized_text)
+    conn.rollback()
+
+    sq_norms = np.einsum("ij,ij->i", original, original)
+    np.save(os.path.join(version_dir, "original_sq_norms.npy"), sq_norms.astype(np.float32))
+    for array in (ids, normalized, original):
+        array.flush()
+    del ids, normalized, original
+
+    manifest = {"version": version, "count": count, "dim": dim, "created_at": time.time()}
+    with open(os.path.join(version_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    tmp_pointer = os.path.join(index_dir, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp_pointer, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_pointer, os.path.join(index_dir, CURRENT_FILE))
+
+    # Already-open mmaps keep working after unlink, so old versions can go
+    versions = sorted(d for d in os.listdir(index_dir) if os.path.isdir(os.path.join(index_dir, d)))
+    for stale in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(index_dir, stale), ignore_errors=True)
+    logger.info(f"Exported {count} vectors ({dim}-d) to {version_dir}")
+    return manifest
+
+
+class NumpyVectorIndex:
+    """Exact k-NN over memory-mapped float32 embedding matrices."""
+
+    def __init__(self, version_dir):
+        load = lambda name: np.load(os.path.join(version_dir, name), mmap_mode="r")
+        self.version_dir = version_dir
+        self.ids = load("ids.npy")
+        self.normalized = load("embeddings_normalized.npy")
+        self.original = load("embeddings_original.npy")
+        self.original_sq_norms = load("original_sq_norms.npy")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def scores(self, embedding, metric="cosine"):
+        """Similarity of every row to the query, on the same scale as the SQL backend."""
+        query = np.asarray(embedding, dtype=np.float32)
+        if metric == "cosine":
+            query = query / np.linalg.norm(query)
+            return self.normalized @ query
+        if metric == "euclidean":
+            sq_dist = self.original_sq_norms - 2 * (self.original @ query) + query @ query
+            return -np.sqrt(np.maximum(sq_dist, 0))
+        raise ValueError("Metric must be either 'cosine' or 'euclidean'")
+
+    def search(self, embedding, num_neighbors=5, metric="cosine"):
+        """Return (ids, similarities) of the top num_neighbors rows, best first."""
+        scores = self.scores(embedding, metric)
+        k = min(num_neighbors, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return np.asarray(self.ids[top]), scores[top]
+
+    def search_many(self, embeddings, num_neighbors, metric="cosine"):
+        """Top-k for several queries from a single matrix product.
+
+        num_neighbors is one k per query; returns a list of (ids, similarities).
+        """
+        queries = np.asarray(embeddings, dtype=np.float32)
+        if metric == "cosine":
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+            scores = queries @ self.normalized.T
+        elif metric == "euclidean":
+            sq_dist = (
+                self.original_sq_norms[None, :]
+                - 2 * (queries @ self.original.T)
+                + np.einsum("ij,ij->i", queries, queries)[:, None]
+            )
+            scores = -np.sqrt(np.maximum(sq_dist, 0))
+        else:
+            raise ValueError("Metric must be either 'cosine' or 'euclidean'")
+        results = []
+        for row, k in zip(scores, num_neighbors):
+            k = min(int(k), len(row))
+            if k <= 0:
+                results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                continue
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind="stable")]
+            results.append((np.asarray(self.ids[top]), row[top]))
+        return results
+
+
+_index = None
+_index_version = None
+# (inode, mtime) of the current.json last read; os.replace gives every new pointer a new inode
+_pointer_stat = None
+_index_lock = threading.Lock()
+
+def get_index(index_dir=VECTOR_INDEX_DIR):
+    """Per-process index, reopened whenever current.json points at a new version.
+
+    current.json is only re-read when a stat shows it was replaced.
+    """
+    global _index, _index_version, _pointer_stat
+    pointer = os.path.join(index_dir, CURRENT_FILE)
+    stat = os.stat(pointer)
+    pointer_stat = (stat.st_ino, stat.st_mtime_ns)
+    if _index is None or pointer_stat != _pointer_stat:
+        with _index_lock:
+            if _index is None or pointer_stat != _pointer_stat:
+                with open(pointer) as f:
+                    version = json.load(f)["version"]
+                if _index is None or version != _index_version:
+                    _index = NumpyVectorIndex(os.path.join(index_dir, version))
+                    _index_version = version
+                    logger.info(f"Opened vector index {version} with {len(_index)} vectors")
+                _pointer_stat = pointer_stat
+    return _index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export movie vectors for the in-process numpy backend.")
+    parser.add_argument("--index-dir", default=VECTOR_INDEX_DIR, help="Directory holding index versions.")
+    args = parser.parse_args()
+    conn = psycopg2.connect("dbname='movie_recco' user='user' password='password' host='db'")
+    try:
+        export_index(conn, args.index_dir)
+        with conn.cursor() as cur:
+            bump_generation(cur)
+        conn.commit()
+    finally:
+        conn.close()